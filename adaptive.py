@@ -0,0 +1,95 @@
+import time
+from statistics import NormalDist
+import numpy as np
+from ensemble import EnsembleResult
+from parallel import seed_sequence
+
+DEFAULT_TARGETS = {
+    "median": 0.01,     # CI half-width as a fraction of the median corpus
+    "p5": 0.02,         # CI half-width as a fraction of the 5th percentile corpus
+    "shortfall": 0.01,  # CI half-width of the shortfall probability, in probability units
+}
+
+
+def quantile_interval(values, q, confidence=0.95):
+    # Distribution-free confidence interval for a quantile from order statistics.
+    n = len(values)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    spread = z * np.sqrt(n * q * (1 - q))
+    ordered = np.sort(values)
+    low = int(np.clip(np.floor(n * q - spread), 0, n - 1))
+    high = int(np.clip(np.ceil(n * q + spread), 0, n - 1))
+    return ordered[low], ordered[high]
+
+
+def proportion_interval(successes, n, confidence=0.95):
+    # Wilson score interval, which stays honest when the proportion is near 0 or 1.
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    centre = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    half = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+    return centre - half, centre + half
+
+
+def precision_report(final_corpuses, shortfall=None, confidence=0.95):
+    median = np.median(final_corpuses)
+    p5 = np.percentile(final_corpuses, 5)
+    median_low, median_high = quantile_interval(final_corpuses, 0.5, confidence)
+    p5_low, p5_high = quantile_interval(final_corpuses, 0.05, confidence)
+    report = {
+        "median": (median_high - median_low) / 2 / max(abs(median), 1.0),
+        "p5": (p5_high - p5_low) / 2 / max(abs(p5), 1.0),
+    }
+    if shortfall is not None:
+        low, high = proportion_interval(np.count_nonzero(shortfall), len(shortfall), confidence)
+        report["shortfall"] = (high - low) / 2
+    return report
+
+
+def run_until_converged(simulate_batch, shortfall_fn=None, batch_size=500, min_paths=1000, max_paths=50_000,
+                        max_seconds=5.0, targets=None, confidence=0.95, seed=None):
+    # Simulates in batches until the confidence intervals for the median corpus, the p5 corpus and the
+    # shortfall probability are within `targets`, or until the path or time cap is hit.
+    # simulate_batch(n, seed) -> EnsembleResult; shortfall_fn(batch, seed) -> bool array per path.
+    targets = {**DEFAULT_TARGETS, **(targets or {})}
+    seeds = seed_sequence(seed)
+    start = time.perf_counter()
+    batches = []
+    finals = []
+    shortfalls = []
+    paths = 0
+    while True:
+        size = min(batch_size, max_paths - paths)
+        batch_seed, shortfall_seed = seeds.spawn(2)
+        batch = simulate_batch(size, batch_seed)
+        batches.append(batch)
+        finals.append(batch.final())
+        if shortfall_fn is not None:
+            shortfalls.append(shortfall_fn(batch, shortfall_seed))
+        paths += size
+
+        report = precision_report(
+            np.concatenate(finals), np.concatenate(shortfalls) if shortfalls else None, confidence
+        )
+        elapsed = time.perf_counter() - start
+        converged = paths >= min_paths and all(report[key] <= targets[key] for key in report)
+        if converged:
+            reason = "converged"
+        elif paths >= max_paths:
+            reason = "path cap"
+        elif elapsed >= max_seconds:
+            reason = "time cap"
+        else:
+            continue
+        break
+
+    summary = {
+        "Paths Used": paths,
+        "Stop Reason": reason,
+        "Elapsed Seconds": elapsed,
+        "Median CI Half-Width %": report["median"] * 100,
+        "P5 CI Half-Width %": report["p5"] * 100,
+    }
+    if "shortfall" in report:
+        summary["Shortfall CI Half-Width (pp)"] = report["shortfall"] * 100
+    return EnsembleResult.concatenate(batches), summary
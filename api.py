@@ -0,0 +1,256 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from batch import summary_metrics
+from cache import ResultCache, parameter_key
+from pipeline import RETIREMENT_STAGES, Pipeline, prime_batched, variant_key
+from profiles import CLIENT_DEFAULTS, profile_inputs
+from scheduler import JobScheduler, QueueFull
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8600
+# Requests arriving this many seconds after the first one of a batch are evaluated with it
+DEFAULT_WINDOW = 0.01
+DEFAULT_MAX_BATCH = 64
+MAX_PATHS = 200_000
+REQUEST_TIMEOUT = 120
+# Request fields that are not client profile inputs
+REQUEST_FIELDS = {"client_id"}
+
+
+def ensemble_key(inputs):
+    # Requests with the same key simulate the same pre-retirement ensemble
+    return parameter_key({name: inputs[name] for name in RETIREMENT_STAGES[0].inputs})
+
+
+def group_key(inputs):
+    # Requests with the same key are evaluated in one job: their ensembles can be simulated together on one
+    # set of draws (pipeline.variant_key). Adaptive requests size their own batches and group by ensemble.
+    key = variant_key(inputs)
+    return key if key is not None else ensemble_key(inputs)
+
+
+def json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def response_body(inputs, outputs):
+    percentiles = outputs["aggregates"]["corpus_percentiles"]
+    return {
+        "summary": {name: json_value(value) for name, value in summary_metrics(inputs, outputs).items()},
+        "projection": [{name: json_value(value) for name, value in row.items()} for row in percentiles.to_dict("records")],
+    }
+
+
+def request_inputs(profile):
+    # Pipeline inputs for a request body; ValueError for anything the service should answer with a 400
+    if not isinstance(profile, dict):
+        raise ValueError("The request body must be a JSON object of client profile inputs")
+    unknown = set(profile) - set(CLIENT_DEFAULTS) - REQUEST_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown inputs: {sorted(unknown)}")
+    try:
+        inputs = profile_inputs(profile)
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError(f"Invalid inputs: {error}") from None
+    if not 1 <= inputs["n_simulation"] <= MAX_PATHS:
+        raise ValueError(f"n_simulation must be between 1 and {MAX_PATHS:,}")
+    return inputs
+
+
+class MicroBatcher:
+    # Collects requests for `window` seconds after the first one arrives, then evaluates them together:
+    # identical requests once, requests that differ only in post-retirement inputs on one shared ensemble
+    # and its aggregates, and the distinct ensembles of requests that differ only in salary, contribution
+    # or allocation inputs in one vectorized engine call along its variant axis, the way sensitivity sweeps
+    # do. Each group is one job on the scheduler, and later requests join a group until its job starts, so
+    # the busier the workers, the larger the groups. With `batching` off every request is its own job.
+
+    def __init__(self, pipeline, scheduler, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH, batching=True):
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.window = window if batching else 0.0
+        self.max_batch = max_batch if batching else 1
+        self.batching = batching
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        # Group key -> {request key: (inputs, futures)} of each group whose job has not started yet
+        self._pending = {}
+        self._requests = queue.Queue()
+        threading.Thread(target=self._collect, name="micro-batcher", daemon=True).start()
+
+    def submit(self, inputs):
+        future = Future()
+        self._requests.put((inputs, future))
+        return future
+
+    def _collect(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._requests.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        new_groups = []
+        with self._lock:
+            for inputs, future in batch:
+                key = group_key(inputs) if self.batching else id(future)
+                if key not in self._pending:
+                    self._pending[key] = {}
+                    new_groups.append(key)
+                self._pending[key].setdefault(parameter_key(inputs), (inputs, []))[1].append(future)
+            self.counts["batches"] += 1
+            self.counts["requests"] += len(batch)
+        for key in new_groups:
+            try:
+                self.scheduler.submit(partial(self._run_group, key))
+            except QueueFull as error:
+                with self._lock:
+                    variants = self._pending.pop(key)
+                for _, futures in variants.values():
+                    for future in futures:
+                        future.set_exception(error)
+
+    def _run_group(self, key, job):
+        with self._lock:
+            variants = self._pending.pop(key)
+        # Requests of one ensemble share a state, so only their post-retirement stages differ
+        states = {}
+        runs = [(inputs, states.setdefault(ensemble_key(inputs), {})) for inputs, _ in variants.values()]
+        with self._lock:
+            self.counts["jobs"] += 1
+            self.counts["ensembles"] += len(states)
+            self.counts["evaluations"] += len(variants)
+        try:
+            prime_batched(self.pipeline, runs)
+        except Exception as error:
+            for _, futures in variants.values():
+                for future in futures:
+                    future.set_exception(error)
+            return
+        for (inputs, state), (_, futures) in zip(runs, variants.values()):
+            try:
+                outputs, _ = self.pipeline.run(inputs, state)
+                body = response_body(inputs, outputs)
+            except Exception as error:
+                for future in futures:
+                    future.set_exception(error)
+                continue
+            for future in futures:
+                future.set_result(body)
+
+    def metrics(self):
+        counts = dict(self.counts)
+        batches = counts.get("batches", 0)
+        ensembles = counts.get("ensembles", 0)
+        jobs = counts.get("jobs", 0)
+        return dict(counts, mean_batch_size=counts.get("requests", 0) / batches if batches else 0.0,
+                    mean_group_size=counts.get("requests", 0) / ensembles if ensembles else 0.0,
+                    mean_job_size=counts.get("requests", 0) / jobs if jobs else 0.0)
+
+
+class SimulationHandler(BaseHTTPRequestHandler):
+    # POST /simulate with a JSON client profile (any keys of profiles.CLIENT_DEFAULTS) returns the summary
+    # metrics and the corpus percentiles by age; GET /metrics reports batching, queue and cache statistics
+    batcher = None
+    cache = None
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._send(200, {
+                "batching": self.batcher.metrics(),
+                "queue": self.batcher.scheduler.metrics(),
+                "cache": self.cache.stats(),
+            })
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/simulate":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            inputs = request_inputs(json.loads(self.rfile.read(length) or b"{}"))
+        except ValueError as error:
+            self._send(400, {"error": str(error)})
+            return
+        try:
+            body = self.batcher.submit(inputs).result(timeout=REQUEST_TIMEOUT)
+        except QueueFull as error:
+            self._send(503, {"error": str(error)}, {"Retry-After": "1"})
+            return
+        except ValueError as error:
+            self._send(400, {"error": str(error)})
+            return
+        except Exception as error:
+            self._send(500, {"error": f"{type(error).__name__}: {error}"})
+            return
+        self._send(200, body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH, workers=None,
+                batching=True):
+    # The server and its batcher; port 0 picks a free port (server.server_address has the one bound)
+    cache = ResultCache()
+    scheduler = JobScheduler(workers=workers, max_per_session=None)
+    batcher = MicroBatcher(Pipeline(RETIREMENT_STAGES, cache=cache), scheduler, window, max_batch, batching)
+    handler = type("Handler", (SimulationHandler,), {"batcher": batcher, "cache": cache})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the retirement simulation as a JSON API with micro-batching")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW, help="seconds to collect requests into a batch")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="requests per batch at most")
+    parser.add_argument("--workers", type=int, default=None, help="simulation threads (default: one per CPU)")
+    parser.add_argument("--no-batching", action="store_true", help="evaluate every request on its own")
+    args = parser.parse_args(argv)
+    server = make_server(args.host, args.port, args.window, args.max_batch, args.workers, not args.no_batching)
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]} (POST /simulate, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import copy
+import numpy as np
+from cache import parameter_key
+from ensemble import quantile_label
+from instrumentation import recording
+from scheduler import JobScheduler
+
+# Paths of the whole run the partial risk band is drawn from; the final corpus of every path is kept
+PREVIEW_PATHS = 2000
+PREVIEW_QUANTILES = (0.05, 0.5, 0.95)
+
+
+class PreviewSampler:
+    # Collects what the partial results are drawn from as shards finish: every `stride`-th path's corpus
+    # by age, spread evenly over the run, and the final corpus of every path. Each update copies only the
+    # new shards' rows, so the simulation thread never rebuilds the ensemble, and returns a snapshot that
+    # later updates leave alone.
+
+    def __init__(self, n_simulation, metric="Adjusted Fund Value", paths=PREVIEW_PATHS):
+        self.stride = max(1, n_simulation // paths)
+        self.metric = metric
+        self.paths = 0
+        self.ages = None
+        self.samples = []
+        self.finals = []
+
+    def update(self, shards):
+        # `shards` covers every path simulated so far, in order; earlier shards may arrive merged
+        start = 0
+        for shard in shards:
+            end = start + shard.n_sims
+            if end > self.paths:
+                values = shard.arrays[self.metric][self.paths - start:]
+                first = -self.paths % self.stride
+                self.samples.append(np.array(values[first::self.stride], dtype=float))
+                self.finals.append(np.array(values[:, -1], dtype=float))
+                self.ages = shard.ages
+                self.paths = end
+            start = end
+        return self.paths, self.ages, tuple(self.samples), tuple(self.finals)
+
+
+def ensemble_preview(snapshot):
+    # The corpus risk band of the sampled paths and the final corpus of every path so far
+    paths, ages, samples, finals = snapshot
+    import pandas as pd
+    values = np.quantile(np.concatenate(samples), PREVIEW_QUANTILES, axis=0)
+    percentiles = pd.DataFrame({"Age": ages.astype(int)})
+    for q, row in zip(PREVIEW_QUANTILES, values):
+        percentiles[quantile_label(q)] = row
+    return {"paths": paths, "corpus_percentiles": percentiles, "final_corpuses": np.concatenate(finals)}
+
+
+def run_pipeline(pipeline, inputs, state, context, profile, preview, job):
+    # Previews cost the simulation thread a copy of each new shard's sampled rows, so they are only
+    # collected when asked for
+    context = dict(context, cancel=job.cancel_event)
+    if preview:
+        sampler = PreviewSampler(inputs["n_simulation"])
+
+        def progress(shards):
+            job.progress = sampler.update(shards)
+
+        context["progress"] = progress
+    with recording(profile=profile) as timings:
+        outputs, recomputed = pipeline.run(inputs, state, context)
+    return outputs, recomputed, timings, state
+
+
+class BackgroundRun:
+    # A pipeline run submitted to a JobScheduler, so the caller can keep drawing while the ensemble is
+    # simulated. With `preview`, the `preview` property holds the ensemble_preview of the paths simulated
+    # so far, built on the caller's thread from the latest shard snapshot; a run that joins one already in
+    # flight without previews gets none. cancel()
+    # stops the run at the next shard or stage boundary; a cancelled run ends without outputs or error.
+    # The run works on its own copy of `state`, which the caller adopts once the run has finished. Runs
+    # of the same inputs submitted while one is in flight follow that one instead of simulating again.
+    # Without a scheduler the run gets a private single-thread one.
+
+    def __init__(self, pipeline, inputs, state, context=None, profile=False, scheduler=None, session=None,
+                 preview=False):
+        self.inputs = inputs
+        self.scheduler = scheduler or JobScheduler(workers=1)
+        self.job = self.scheduler.submit(
+            lambda job: run_pipeline(pipeline, inputs, dict(state), dict(context or {}), profile, preview, job),
+            key=parameter_key({"inputs": inputs, "profile": profile}),
+            session=session,
+        )
+        self._released = False
+        self._snapshot = None
+        self._preview = None
+
+    @property
+    def preview(self):
+        snapshot = self.job.progress
+        if snapshot is not self._snapshot:
+            self._snapshot = snapshot
+            self._preview = ensemble_preview(snapshot) if snapshot is not None else None
+        return self._preview
+
+    @property
+    def queued_ahead(self):
+        # None once the run has started
+        return self.scheduler.queued_ahead(self.job) if self.job.started is None else None
+
+    @property
+    def error(self):
+        return self.job.error
+
+    @property
+    def outputs(self):
+        return self.job.result[0] if self.job.result else None
+
+    @property
+    def recomputed(self):
+        return self.job.result[1] if self.job.result else None
+
+    @property
+    def timings(self):
+        # A copy, since every run following the job adds its own chart and render times
+        return copy.deepcopy(self.job.result[2]) if self.job.result else None
+
+    @property
+    def state(self):
+        return self.job.result[3] if self.job.result else None
+
+    @property
+    def done(self):
+        return self.job.done
+
+    @property
+    def cancelled(self):
+        return self.job.cancelled
+
+    def wait(self, timeout=None):
+        # True once the run has finished, been cancelled or failed
+        return self.job.wait(timeout)
+
+    def cancel(self):
+        # Other sessions following the same run keep it going
+        if not self._released:
+            self._released = True
+            self.job.release()
@@ -0,0 +1,237 @@
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import pandas as pd
+from pipeline import RETIREMENT_STAGES, Pipeline
+from profiles import profile_inputs
+from scenarios import ScenarioBank
+
+ID_COLUMN = "client_id"
+DEFAULT_CHUNK_SIZE = 500
+RESULT_COLUMNS = [
+    ID_COLUMN,
+    "n_simulation",
+    "mean_corpus",
+    "median_corpus",
+    "p5_corpus",
+    "p95_corpus",
+    "corpus_at_retirement",
+    "total_contributions",
+    "required_fund",
+    "sufficiency_score",
+    "funding_status",
+    "shortfall_probability",
+    "spending_basis",
+    "seconds",
+    "error",
+]
+
+
+def is_parquet(path):
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+
+def read_profiles(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Yields the profiles table in chunks, so only one chunk of inputs is in memory at a time
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def summary_metrics(inputs, outputs):
+    # The result columns of one pipeline run
+    aggregates = outputs["aggregates"]
+    summaries = outputs["summaries"]
+    return dict(
+        n_simulation=inputs["n_simulation"],
+        mean_corpus=summaries["mean_corpus"],
+        median_corpus=aggregates["median_corpus"],
+        p5_corpus=aggregates["p5"],
+        p95_corpus=aggregates["p95"],
+        corpus_at_retirement=aggregates["corpus_at_retirement"],
+        total_contributions=aggregates["total_contributions"],
+        required_fund=summaries["total_fund_withdrawal"],
+        sufficiency_score=summaries["sufficiency_score"],
+        funding_status=summaries["funding_status"],
+        shortfall_probability=summaries["shortfall_probability"],
+        spending_basis=outputs["post"]["spending_basis"],
+    )
+
+
+def summarize_profile(profile, scenario_bank=None):
+    # One client through the dashboard pipeline; a failing profile is reported in its row instead of stopping the batch
+    start = time.perf_counter()
+    row = {column: None for column in RESULT_COLUMNS}
+    row[ID_COLUMN] = profile[ID_COLUMN]
+    try:
+        inputs = dict(profile_inputs(profile), scenario_bank=scenario_bank)
+        outputs, _ = Pipeline(RETIREMENT_STAGES).run(inputs, {})
+        row.update(summary_metrics(inputs, outputs))
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {error}"
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+
+# --- OUTPUT ---
+# CSV output is one file appended a chunk at a time; Parquet output is a directory with one part file per
+# chunk, which pandas and pyarrow read back as a single table. Either way a crash loses at most the chunk
+# being written. --resume skips every client already in the output, except those whose row records an
+# error: their rows are dropped first and the resumed run writes new ones.
+def _repair_csv(path):
+    # Drops a partially written last line left behind by a crash
+    with open(path, "rb+") as handle:
+        data = handle.read()
+        if data and not data.endswith(b"\n"):
+            handle.truncate(data.rfind(b"\n") + 1)
+
+
+def completed_ids(output):
+    # Clients with a result in the output; failed ones are not completed, so a resumed run retries them
+    if not os.path.exists(output):
+        return set()
+    if is_parquet(output):
+        import pyarrow.parquet as pq
+        ids = set()
+        for name in sorted(os.listdir(output)):
+            if name.endswith(".parquet"):
+                table = pq.read_table(os.path.join(output, name), columns=[ID_COLUMN, "error"])
+                ids.update(str(client) for client, error in zip(table[ID_COLUMN].to_pylist(), table["error"].to_pylist())
+                           if error is None)
+        return ids
+    _repair_csv(output)
+    if os.path.getsize(output) == 0:
+        return set()
+    frame = pd.read_csv(output, usecols=[ID_COLUMN, "error"], dtype=str)
+    return set(frame.loc[frame["error"].isna(), ID_COLUMN])
+
+
+def drop_failed(output):
+    # Removes the rows of failed clients before a resumed run writes their new ones. Each file is rewritten
+    # under a temporary name, so a crash leaves either the old or the new file; returns the rows dropped.
+    if not os.path.exists(output):
+        return 0
+    dropped = 0
+    if is_parquet(output):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        for name in sorted(os.listdir(output)):
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(output, name)
+            table = pq.read_table(path)
+            kept = table.filter(pc.is_null(table["error"]))
+            if kept.num_rows == table.num_rows:
+                continue
+            dropped += table.num_rows - kept.num_rows
+            if kept.num_rows:
+                pq.write_table(kept, f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+            else:
+                os.remove(path)
+        return dropped
+    _repair_csv(output)
+    # Rows are copied as text, so the kept ones are written back exactly as they were
+    with open(output, newline="") as source, open(f"{output}.tmp", "w", newline="") as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target, lineterminator=os.linesep)
+        header = next(reader, None)
+        if header is not None:
+            writer.writerow(header)
+            error = header.index("error")
+            for row in reader:
+                if row[error]:
+                    dropped += 1
+                else:
+                    writer.writerow(row)
+        target.flush()
+        os.fsync(target.fileno())
+    if dropped:
+        os.replace(f"{output}.tmp", output)
+    else:
+        os.remove(f"{output}.tmp")
+    return dropped
+
+
+def write_chunk(output, rows):
+    frame = pd.DataFrame(rows, columns=RESULT_COLUMNS).astype({"n_simulation": "Int64", "sufficiency_score": "Int64"})
+    if is_parquet(output):
+        os.makedirs(output, exist_ok=True)
+        parts = [int(name[5:10]) for name in os.listdir(output) if name.startswith("part-") and name.endswith(".parquet")]
+        part = max(parts) + 1 if parts else 0
+        path = os.path.join(output, f"part-{part:05d}.parquet")
+        # Written under a temporary name first so a crash never leaves a truncated part behind
+        frame.to_parquet(f"{path}.tmp", index=False, engine="pyarrow")
+        os.replace(f"{path}.tmp", path)
+        return
+    header = not os.path.exists(output) or os.path.getsize(output) == 0
+    with open(output, "a", newline="") as handle:
+        handle.write(frame.to_csv(index=False, header=header))
+        handle.flush()
+        os.fsync(handle.fileno())
+
+
+def run_batch(profiles, output, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=False, log=None, scenario_bank=None):
+    # With a ScenarioBank every client is simulated against the same stored markets
+    if os.path.exists(output) and not resume:
+        raise FileExistsError(f"{output} already exists; pass resume=True to continue it")
+    retried = drop_failed(output) if resume else 0
+    done = completed_ids(output) if resume else set()
+    workers = workers or os.cpu_count() or 1
+    counts = {"done": 0, "skipped": 0, "failed": 0, "retried": retried}
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    summarize = partial(summarize_profile, scenario_bank=scenario_bank)
+    try:
+        for chunk in read_profiles(profiles, chunk_size):
+            if ID_COLUMN not in chunk.columns:
+                raise ValueError(f"Profiles need a {ID_COLUMN!r} column")
+            records = [record for record in chunk.to_dict("records") if str(record[ID_COLUMN]) not in done]
+            counts["skipped"] += len(chunk) - len(records)
+            if not records:
+                continue
+            if pool is None:
+                rows = [summarize(record) for record in records]
+            else:
+                rows = list(pool.map(summarize, records, chunksize=max(1, len(records) // (workers * 4))))
+            write_chunk(output, rows)
+            counts["done"] += len(rows)
+            counts["failed"] += sum(row["error"] is not None for row in rows)
+            if log is not None:
+                log(f"{counts['done']:,} profiles written ({counts['failed']:,} failed, {counts['skipped']:,} skipped)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run client profiles through the retirement pipeline without the dashboard")
+    parser.add_argument("profiles", help=f"CSV or Parquet file with one client per row and a {ID_COLUMN!r} column")
+    parser.add_argument("output", help="CSV file, or a .parquet directory of part files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="profiles read and written at a time")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run, skipping finished clients "
+                        "and retrying failed ones")
+    parser.add_argument("--scenario-bank", help="directory of a bank written by scenarios.py to draw markets from")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.output) and not args.resume:
+        parser.error(f"{args.output} already exists; pass --resume to continue it or choose another output")
+
+    start = time.perf_counter()
+    scenario_bank = ScenarioBank(args.scenario_bank) if args.scenario_bank else None
+    counts = run_batch(args.profiles, args.output, args.workers, args.chunk_size, args.resume,
+                       log=lambda message: print(message, file=sys.stderr), scenario_bank=scenario_bank)
+    print(f"{counts['done']:,} profiles in {time.perf_counter() - start:.1f}s "
+          f"({counts['failed']:,} failed, {counts['skipped']:,} already done, {counts['retried']:,} retried)")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,399 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+import numpy as np
+from profiles import profile_inputs
+
+try:
+    import resource
+except ImportError:  # Windows has no getrusage; peak RSS is then left out
+    resource = None
+
+DEFAULT_HISTORY = "benchmark_history.jsonl"
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+PRE_HORIZONS = (20, 36, 50)
+POST_HORIZONS = (25, 35)
+# The per-path reference engines are far slower, so they only run up to this many paths
+REFERENCE_MAX_PATHS = 1_000
+SUMMARY_METRICS = ["Adjusted Fund Value", "Total Contribution", "Total Spent"]
+
+
+def default_pre_params(years=36):
+    # The dashboard's default inputs
+    return dict(profile_inputs({})["pre_params"], years=years)
+
+
+def default_post_params(years=25):
+    return dict(profile_inputs({})["post_params"], years=years)
+
+
+# --- BENCHMARKS ---
+# Each takes (paths, horizon) and returns a zero-argument callable that does the timed work.
+def bench_tax_reference(paths, horizon):
+    from pre_retirement import calculate_tax
+    brackets = default_pre_params()["tax_brackets"]
+    salaries = np.random.default_rng(0).lognormal(11, 0.5, paths).tolist()
+    return lambda: [calculate_tax(s, brackets, year) for year in range(1, horizon + 1) for s in salaries]
+
+
+def bench_tax_table(paths, horizon):
+    from tax import TaxTable
+    brackets = default_pre_params()["tax_brackets"]
+    salaries = np.random.default_rng(0).lognormal(11, 0.5, paths)
+
+    def run():
+        table = TaxTable(brackets, horizon)
+        return [table.tax(salaries, year) for year in range(1, horizon + 1)]
+    return run
+
+
+def bench_pre_reference(paths, horizon):
+    from pre_retirement import simulate_pre_retirement
+    params = default_pre_params(horizon)
+    return lambda: [simulate_pre_retirement(**params) for _ in range(paths)]
+
+
+def bench_pre_batch(paths, horizon):
+    from pre_retirement import simulate_pre_retirement_batch
+    params = default_pre_params(horizon)
+    return lambda: simulate_pre_retirement_batch(paths, **params, metrics=SUMMARY_METRICS, rng=0)
+
+
+def bench_post_reference(paths, horizon):
+    from post_retirement import simulate_post_retirement
+    params = default_post_params(horizon)
+    return lambda: [simulate_post_retirement(4e6, **params) for _ in range(paths)]
+
+
+def bench_post_batch(paths, horizon):
+    from post_retirement import simulate_post_retirement_batch
+    params = default_post_params(horizon)
+    corpuses = np.random.default_rng(0).normal(4e6, 1e6, paths)
+    return lambda: simulate_post_retirement_batch(corpuses, **params, rng=0)
+
+
+def bench_aggregates(paths, horizon):
+    from pipeline import aggregates_stage
+    from pre_retirement import simulate_pre_retirement_batch
+    ensemble = simulate_pre_retirement_batch(paths, **default_pre_params(horizon), metrics=SUMMARY_METRICS, rng=0)
+    return lambda: aggregates_stage({"ensemble": ensemble, "adaptive_summary": None})
+
+
+def bench_dashboard(paths, horizon):
+    # Every compute stage of the dashboard, without figures, caching or Streamlit
+    from pipeline import RETIREMENT_STAGES, Pipeline
+    params = default_pre_params(horizon)
+    inputs = {
+        "pre_params": params, "n_simulation": paths, "random_seed": 42, "variance_reduction": "none",
+        "adaptive": None, "scenario_bank": None, "post_params": default_post_params(), "spending_ratio": 0.7,
+        "allocation_blocks": params["allocation_blocks"],
+    }
+    return lambda: Pipeline(RETIREMENT_STAGES).run(inputs, {})
+
+
+BENCHMARKS = {
+    "calculate_tax": (bench_tax_reference, PRE_HORIZONS[1:2], True),
+    "tax_table": (bench_tax_table, PRE_HORIZONS[1:2], False),
+    "pre_retirement": (bench_pre_reference, PRE_HORIZONS, True),
+    "pre_retirement_batch": (bench_pre_batch, PRE_HORIZONS, False),
+    "post_retirement": (bench_post_reference, POST_HORIZONS, True),
+    "post_retirement_batch": (bench_post_batch, POST_HORIZONS, False),
+    "aggregates": (bench_aggregates, PRE_HORIZONS[1:2], False),
+    "dashboard": (bench_dashboard, PRE_HORIZONS[1:2], False),
+}
+
+
+def _measure(name, paths, horizon, repeat):
+    # Runs in a fresh process so peak RSS belongs to this case alone
+    random.seed(0)
+    np.random.seed(0)
+    run = BENCHMARKS[name][0](paths, horizon)
+    run()  # warm-up: imports, allocator and caches
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run()
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    peak_rss = None
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    seconds = min(times)
+    return {
+        "benchmark": name,
+        "paths": paths,
+        "horizon": horizon,
+        "seconds": seconds,
+        "paths_per_second": paths / seconds if seconds > 0 else None,
+        "peak_rss_mb": peak_rss / 1024 ** 2 if peak_rss is not None else None,
+        "peak_traced_mb": peak_traced / 1024 ** 2,
+        "repeat": repeat,
+    }
+
+
+# --- IMPORT TIMES ---
+IMPORT_MODULES = ("numpy", "pre_retirement", "post_retirement", "pipeline", "charts", "figures", "streamlit_retirement_app")
+
+
+def import_time(module, repeat=3):
+    # Cumulative import time reported by -X importtime, each in a fresh interpreter; the best of `repeat`
+    # runs, after one run that writes the bytecode cache
+    seconds = []
+    for _ in range(repeat + 1):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                seconds.append(int(fields[1]) / 1e6)
+    loaded = subprocess.run([sys.executable, "-c", f"import sys, {module}; print(' '.join(sorted(sys.modules)))"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    heavy = [name for name in ("pandas", "scipy", "matplotlib", "seaborn", "streamlit") if name in loaded.stdout.split()]
+    return {"module": module, "seconds": min(seconds[1:]), "loads": heavy}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names, sizes, repeat=3, history=DEFAULT_HISTORY, reference_max_paths=REFERENCE_MAX_PATHS):
+    run_info = {
+        "run_id": uuid.uuid4().hex[:12],
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    context = multiprocessing.get_context("spawn")
+    records = []
+    for name in names:
+        _, horizons, reference = BENCHMARKS[name]
+        for horizon in horizons:
+            for paths in sizes:
+                if reference and paths > reference_max_paths:
+                    continue
+                with context.Pool(1) as pool:
+                    result = pool.apply(_measure, (name, paths, horizon, repeat))
+                record = {**run_info, **result}
+                records.append(record)
+                print(f"{name:<22} {paths:>8,} paths {horizon:>3}y  {result['seconds']:8.3f}s  "
+                      f"{result['paths_per_second'] or 0:>12,.0f} paths/s  "
+                      f"RSS {result['peak_rss_mb'] or float('nan'):7.1f} MB  traced {result['peak_traced_mb']:7.1f} MB")
+                with open(history, "a") as handle:
+                    handle.write(json.dumps(record) + "\n")
+    return records
+
+
+def load_history(history=DEFAULT_HISTORY):
+    with open(history) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def compare_runs(records, baseline=None, candidate=None, threshold=0.10, min_seconds=0.01):
+    # Flags cases whose time or traced peak memory grew by more than `threshold` between two runs.
+    # Slowdowns under `min_seconds` are ignored, since timer noise dominates the smallest cases.
+    run_ids = list(dict.fromkeys(record["run_id"] for record in records))
+    if len(run_ids) < 2 and (baseline is None or candidate is None):
+        raise ValueError("Need at least two benchmark runs in the history to compare")
+    baseline = baseline or run_ids[-2]
+    candidate = candidate or run_ids[-1]
+    by_case = {}
+    for record in records:
+        if record["run_id"] in (baseline, candidate):
+            key = (record["benchmark"], record["paths"], record["horizon"])
+            by_case.setdefault(key, {})[record["run_id"]] = record
+    rows = []
+    for key, runs in sorted(by_case.items()):
+        if baseline not in runs or candidate not in runs:
+            continue
+        old, new = runs[baseline], runs[candidate]
+        time_change = new["seconds"] / old["seconds"] - 1
+        memory_change = new["peak_traced_mb"] / old["peak_traced_mb"] - 1 if old["peak_traced_mb"] else 0.0
+        rows.append({
+            "benchmark": key[0], "paths": key[1], "horizon": key[2],
+            "baseline_s": old["seconds"], "candidate_s": new["seconds"],
+            "time_change": time_change, "memory_change": memory_change,
+            "regression": (time_change > threshold and new["seconds"] - old["seconds"] > min_seconds)
+                          or memory_change > threshold,
+        })
+    return baseline, candidate, rows
+
+
+# --- STATISTICAL EQUIVALENCE ---
+def equivalence_checks(paths=2_000, reference_paths=500, alpha=0.01, seed=0):
+    # Two-sample KS tests of final-corpus distributions: each faster engine against the per-path
+    # reference, and each sampling variant against plain Monte Carlo. A p-value below alpha fails.
+    from scipy.stats import ks_2samp
+    from parallel import run_pre_retirement_parallel
+    from post_retirement import simulate_post_retirement, simulate_post_retirement_batch
+    from pre_retirement import simulate_pre_retirement, simulate_pre_retirement_batch
+    random.seed(seed)
+    np.random.seed(seed)
+    checks = []
+
+    def check(name, sample, reference):
+        result = ks_2samp(sample, reference)
+        checks.append({"check": name, "ks_statistic": result.statistic, "p_value": result.pvalue,
+                       "passed": bool(result.pvalue >= alpha)})
+
+    for life_events in ("No", "Auto"):
+        params = dict(default_pre_params(), has_partner=life_events, has_children=life_events,
+                      invested_real_estate=life_events)
+        reference = [simulate_pre_retirement(**params)["Adjusted Fund Value"].iloc[-1] for _ in range(reference_paths)]
+        batch = simulate_pre_retirement_batch(paths, **params, metrics=["Adjusted Fund Value"], rng=seed).final()
+        check(f"pre_retirement_batch vs reference (life events: {life_events})", batch, reference)
+        compact = simulate_pre_retirement_batch(paths, **params, metrics=["Adjusted Fund Value"], compact=True,
+                                                rng=seed + 1).final()
+        check(f"pre_retirement_batch compact vs reference (life events: {life_events})", compact, reference)
+
+    params = default_pre_params()
+    plain = simulate_pre_retirement_batch(paths, **params, metrics=["Adjusted Fund Value"], rng=seed + 2).final()
+    for method in ("antithetic", "sobol", "control_variate"):
+        sample = simulate_pre_retirement_batch(paths, **params, metrics=["Adjusted Fund Value"],
+                                               variance_reduction=method, rng=seed + 3).final()
+        check(f"pre_retirement_batch {method} vs plain", sample, plain)
+    parallel = run_pre_retirement_parallel(paths, seed=seed + 4, workers=2, shard_size=max(paths // 4, 1),
+                                           **params, metrics=["Adjusted Fund Value"]).final()
+    check("pre_retirement parallel vs plain", parallel, plain)
+
+    post = default_post_params()
+    reference = [simulate_post_retirement(4e6, **post)["Remaining Corpus"].iloc[-1] for _ in range(reference_paths)]
+    batch = simulate_post_retirement_batch(np.full(paths, 4e6), **post, rng=seed)["Remaining Corpus"][:, -1]
+    check("post_retirement_batch vs reference", batch, reference)
+    return checks
+
+
+def kernel_parity(paths=2_000, seed=0, rtol=1e-12, atol=1e-6):
+    # Runs the engine once per kernel backend on the same random stream and compares every stored column,
+    # the detail-path columns and the control variate. Backends differ only in how the year loop is run.
+    from kernels import numba_available
+    from pre_retirement import simulate_pre_retirement_batch
+    backends = ["numpy"] + (["numba"] if numba_available() else [])
+    cases = {
+        "summary metrics": {},
+        "all columns": {"metrics": None, "detail_paths": 5},
+        "no life events": {"has_partner": "No", "has_children": "No", "invested_real_estate": "No"},
+        "random withdrawals": {"unforeseen_withdrawal_years": [3, 8, 12], "metrics": None},
+        "fixed withdrawals": {"unforeseen_withdrawal_years": {2: 40000, 20: 90000}, "metrics": None},
+        "control variate": {"variance_reduction": "control_variate"},
+        "compact": {"compact": True},
+    }
+    rows = []
+    for case, overrides in cases.items():
+        params = dict(default_pre_params(), **dict({"metrics": SUMMARY_METRICS}, **overrides))
+        results = {backend: simulate_pre_retirement_batch(paths, **params, kernel=backend, rng=seed) for backend in backends}
+        reference = results["numpy"]
+        for backend in backends[1:]:
+            result = results[backend]
+            pairs = [(reference.arrays[name], result.arrays[name]) for name in reference.arrays]
+            pairs += [(reference.detail[name], result.detail[name]) for name in reference.detail]
+            pairs += [(reference.attrs[name], result.attrs[name]) for name in ("Control", "Control Mean") if name in reference.attrs]
+            max_diff = max(float(np.max(np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float)), initial=0)) for a, b in pairs)
+            passed = all(np.allclose(np.asarray(a, dtype=float), np.asarray(b, dtype=float), rtol=rtol, atol=atol) for a, b in pairs)
+            rows.append({"case": case, "backend": backend, "columns": len(pairs), "max_abs_diff": max_diff, "passed": passed})
+    return backends, rows
+
+
+def kernel_timings(sizes=DEFAULT_SIZES, repeat=3):
+    # Seconds per engine run with each backend; Numba is compiled (or loaded from its cache) before timing
+    from kernels import numba_available
+    from pre_retirement import simulate_pre_retirement_batch
+    params = default_pre_params()
+    backends = ["numpy"] + (["numba"] if numba_available() else [])
+    rows = []
+    for paths in sizes:
+        for backend in backends:
+            simulate_pre_retirement_batch(10, **params, metrics=SUMMARY_METRICS, kernel=backend, rng=0)
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                simulate_pre_retirement_batch(paths, **params, metrics=SUMMARY_METRICS, kernel=backend, rng=0)
+                seconds.append(time.perf_counter() - start)
+            rows.append({"paths": paths, "backend": backend, "seconds": min(seconds)})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks and statistical equivalence checks for the engines")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="time the engines and append the results to the history file")
+    run_parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    run_parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--reference-max-paths", type=int, default=REFERENCE_MAX_PATHS)
+    run_parser.add_argument("--history", default=DEFAULT_HISTORY)
+    compare_parser = commands.add_parser("compare", help="compare two runs and flag regressions")
+    compare_parser.add_argument("--baseline", help="run id (default: second most recent run)")
+    compare_parser.add_argument("--candidate", help="run id (default: most recent run)")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown or growth")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.01, help="ignore slowdowns smaller than this")
+    compare_parser.add_argument("--history", default=DEFAULT_HISTORY)
+    equivalence_parser = commands.add_parser("equivalence", help="KS tests of fast engines against the reference")
+    equivalence_parser.add_argument("--paths", type=int, default=2_000)
+    equivalence_parser.add_argument("--reference-paths", type=int, default=500)
+    equivalence_parser.add_argument("--alpha", type=float, default=0.01)
+    equivalence_parser.add_argument("--seed", type=int, default=0)
+    kernels_parser = commands.add_parser("kernels", help="check the kernel backends agree and time them")
+    kernels_parser.add_argument("--paths", type=int, default=2_000, help="paths per parity case")
+    kernels_parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    kernels_parser.add_argument("--repeat", type=int, default=3)
+    kernels_parser.add_argument("--seed", type=int, default=0)
+    imports_parser = commands.add_parser("imports", help="time importing each module in a fresh interpreter")
+    imports_parser.add_argument("--modules", nargs="+", default=list(IMPORT_MODULES))
+    imports_parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        run_benchmarks(args.benchmarks, args.sizes, args.repeat, args.history, args.reference_max_paths)
+        return 0
+    if args.command == "compare":
+        baseline, candidate, rows = compare_runs(load_history(args.history), args.baseline, args.candidate,
+                                                 args.threshold, args.min_seconds)
+        print(f"baseline {baseline} -> candidate {candidate} (threshold {args.threshold:.0%})")
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            print(f"{row['benchmark']:<22} {row['paths']:>8,} {row['horizon']:>3}y  {row['baseline_s']:8.3f}s -> "
+                  f"{row['candidate_s']:8.3f}s  time {row['time_change']:+7.1%}  memory {row['memory_change']:+7.1%}  {flag}")
+        return 1 if any(row["regression"] for row in rows) else 0
+    if args.command == "imports":
+        for module in args.modules:
+            row = import_time(module, args.repeat)
+            print(f"{row['module']:<26} {row['seconds']:7.3f}s  loads {', '.join(row['loads']) or 'NumPy only'}")
+        return 0
+    if args.command == "kernels":
+        backends, rows = kernel_parity(args.paths, args.seed)
+        if len(backends) == 1:
+            print("Numba is not installed; only the NumPy backend is available")
+        for row in rows:
+            print(f"{'PASS' if row['passed'] else 'FAIL'}  {row['case']:<20} {row['backend']:<6} vs numpy  "
+                  f"{row['columns']:>3} columns  max |diff| {row['max_abs_diff']:.3g}")
+        for row in kernel_timings(args.sizes, args.repeat):
+            print(f"{row['backend']:<6} {row['paths']:>8,} paths  {row['seconds']:8.3f}s")
+        return 0 if all(row["passed"] for row in rows) else 1
+    checks = equivalence_checks(args.paths, args.reference_paths, args.alpha, args.seed)
+    for row in checks:
+        print(f"{'PASS' if row['passed'] else 'FAIL'}  {row['check']:<62} KS {row['ks_statistic']:.4f}  p {row['p_value']:.3f}")
+    return 0 if all(row["passed"] for row in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from ensemble import EnsembleResult
+
+DEFAULT_CACHE_BYTES = 256 * 1024 ** 2
+
+
+def _canonical(value):
+    # Turns engine inputs into a JSON structure that is identical for equal parameters.
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items(), key=lambda item: str(item[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return [_canonical(v) for v in value.tolist()]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        # repr round-trips exactly and also covers inf/nan, which JSON cannot encode
+        return repr(value) if not np.isfinite(value) else value
+    if hasattr(value, "cache_key"):
+        # Market data sources (scenario banks, return histories) say what identifies their contents
+        return _canonical(value.cache_key())
+    if isinstance(value, np.random.SeedSequence):
+        return {"entropy": _canonical(value.entropy), "spawn_key": list(value.spawn_key)}
+    if value is None or isinstance(value, str):
+        return value
+    raise TypeError(f"Cannot build a cache key from {type(value).__name__}")
+
+
+def parameter_key(params):
+    encoded = json.dumps(_canonical(params), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def result_nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, EnsembleResult):
+        return result_nbytes(value.arrays) + result_nbytes(value.detail) + result_nbytes(value.attrs)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sum(result_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(result_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    # In-memory LRU bounded by a byte budget, with an optional pickle-per-key disk tier that
+    # survives restarts. Safe to share between Streamlit sessions.
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _remember(self, key, value):
+        size = result_nbytes(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        while self._entries and self._bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+        self._entries[key] = (value, size)
+        self._bytes += size
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), "rb") as handle:
+                    value = pickle.load(handle)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.disk_dir:
+            # Write then rename so a crash never leaves a truncated entry behind
+            temp_path = f"{self._disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as handle:
+                pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._disk_path(key))
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
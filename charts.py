@@ -0,0 +1,175 @@
+import matplotlib
+# Off-screen backend, as in figures.py; it has to be chosen before pyplot loads
+matplotlib.use("Agg")
+import matplotlib.patches as patches
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.ticker import FuncFormatter
+from formatting import format_currency, million_formatter
+
+sns.set_style("whitegrid")
+
+ASSET_COLUMNS = [
+    "Harboursafe Contribution",
+    "Horizon Contribution",
+    "SkyHigh Contribution",
+    "Foreign_Equities Contribution",
+    "Bitcoin Contribution"
+]
+
+
+def plot_retirement_corpus_distribution(final_values):
+    mu = np.mean(final_values)
+    p5 = np.percentile(final_values, 5)
+    p95 = np.percentile(final_values, 95)
+
+    x = np.linspace(min(final_values), max(final_values), 200)
+    sigma = np.std(final_values)
+    pdf = np.exp(-0.5 * ((x - mu) / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    sns.histplot(final_values, kde=False, stat="density", bins=30, color="#6fa8dc", ax=ax)
+    ax.plot(x, pdf, color="#2a4d69", linewidth=2.5, label="Normal PDF")
+    ax.fill_between(x, 0, pdf, where=(x <= p5), color="#f4cccc", alpha=0.4, label="Lower 5% tail")
+    ax.fill_between(x, 0, pdf, where=(x >= p95), color="#d9ead3", alpha=0.4, label="Upper 5% tail")
+    ax.axvline(mu, color="#1f618d", linestyle="-", linewidth=2, label=f"Mean: {format_currency(mu)}")
+    ax.axvline(p5, color="#a6acaf", linestyle="--", linewidth=1.5, label=f"5th percentile: {format_currency(p5)}")
+    ax.axvline(p95, color="#a6acaf", linestyle="--", linewidth=1.5, label=f"95th percentile: {format_currency(p95)}")
+    ax.set_title("Distribution of Final Retirement Corpus")
+    ax.set_xlabel("Corpus at Retirement (Millions NZD)")
+    ax.set_ylabel("Density")
+    ax.xaxis.set_major_formatter(FuncFormatter(million_formatter))
+    ax.legend(loc="upper right", frameon=False)
+    return fig, mu, p5, p95
+
+
+def plot_corpus_band(percentiles):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    band_label = "5th–95th percentile range"
+    if "relative_accuracy" in percentiles.attrs:
+        band_label += f" (±{percentiles.attrs['relative_accuracy']:.1%} sketch error)"
+    ax.fill_between(percentiles["Age"], percentiles["p5"], percentiles["p95"], color="#cfe2f3", alpha=0.3, label=band_label)
+    ax.plot(percentiles["Age"], percentiles["median"], color="#114b8d", linewidth=2.5, label="Median corpus")
+    ax.set_title("Projected Retirement Corpus with Risk Bands")
+    ax.set_xlabel("Age")
+    ax.set_ylabel("Projected Fund Value (Millions NZD)")
+    ax.yaxis.set_major_formatter(FuncFormatter(million_formatter))
+    ax.legend()
+    return fig
+
+
+def plot_contribution_stack(df_pre):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    contributions = df_pre[["Age"] + ASSET_COLUMNS].copy()
+    contributions = contributions.set_index("Age")
+    contributions.plot.area(ax=ax, cmap="tab20", alpha=0.9)
+    ax.set_title("Annual Fund Contributions by Asset")
+    ax.set_xlabel("Age")
+    ax.set_ylabel("Contribution Amount (NZD)")
+    ax.legend(loc="upper left", fontsize="small")
+    return fig
+
+
+def plot_cashflow(df_pre):
+    df = df_pre.copy()
+    expense_cols = ["Rent", "Groceries", "Travel", "Utilities", "Insurance", "Leisure", "Misc"]
+    df["Total Expenses"] = df[expense_cols].sum(axis=1)
+    fig, ax = plt.subplots(figsize=(10, 4))
+    ax.plot(df["Age"], df["Net Salary"], label="Net Salary", color="#2a6f97", linewidth=2)
+    ax.plot(df["Age"], df["Total Contribution"], label="Total Contribution", color="#ff8c42", linewidth=2)
+    ax.plot(df["Age"], df["Total Expenses"], label="Total Expenses", color="#8c2d04", linewidth=2)
+    ax.plot(df["Age"], df["Adjusted Fund Value"], label="Portfolio Value", color="#1b4f72", linewidth=2, linestyle="--")
+    ax.set_title("Net Cashflow, Savings, Expenses and Portfolio Value")
+    ax.set_xlabel("Age")
+    ax.set_ylabel("NZD")
+    ax.legend()
+    ax.yaxis.set_major_formatter(FuncFormatter(million_formatter))
+    return fig
+
+
+def plot_funding_gauge(score, corpus, required):
+    fig, ax = plt.subplots(figsize=(4, 2.2))
+    fig.subplots_adjust(top=0.85, bottom=0.12, left=0.05, right=0.98)
+    ax.axis("off")
+
+    segments = [
+        (108, 180, "#d9534f"),  # 0-60%
+        (36, 108, "#f0ad4e"),   # 60-80%
+        (0, 36, "#5cb85c"),     # 80-100%
+    ]
+    for start, end, color in segments:
+        wedge = patches.Wedge((0, 0), 1.0, start, end, width=0.18, facecolor=color, edgecolor="none")
+        ax.add_patch(wedge)
+
+    outer = patches.Wedge((0, 0), 1.0, 180, 0, width=0.03, facecolor="none", edgecolor="#666", linewidth=1.5)
+    ax.add_patch(outer)
+
+    score_theta = 180 - np.clip(score, 0, 100) / 100 * 180
+    x = np.cos(np.radians(score_theta)) * 0.82
+    y = np.sin(np.radians(score_theta)) * 0.82
+    needle_color = "#d9534f" if score < 60 else "#f0ad4e" if score < 80 else "#5cb85c"
+    ax.plot([0, x], [0, y], color=needle_color, linewidth=4, zorder=5)
+    hub = patches.Circle((0, 0), 0.06, facecolor=needle_color, edgecolor="#ffffff", linewidth=2, zorder=6)
+    ax.add_patch(hub)
+
+    for pct in range(0, 101, 20):
+        angle = 180 - pct / 100 * 180
+        x0 = np.cos(np.radians(angle)) * 0.92
+        y0 = np.sin(np.radians(angle)) * 0.92
+        x1 = np.cos(np.radians(angle)) * 1.0
+        y1 = np.sin(np.radians(angle)) * 1.0
+        ax.plot([x0, x1], [y0, y1], color="#333", linewidth=2)
+        xl = np.cos(np.radians(angle)) * 1.12
+        yl = np.sin(np.radians(angle)) * 1.12
+        ax.text(xl, yl, f"{pct}%", ha="center", va="center", fontsize=9, color="#333")
+
+    ax.text(0, -0.18, f"Funding sufficiency", ha="center", fontsize=12, fontweight="bold")
+    ax.text(0, -0.34, f"{score:.0f}% funded", ha="center", fontsize=11, color="#333")
+    ax.text(0, -0.52, f"{format_currency(corpus)} / {format_currency(required)}", ha="center", fontsize=9, color="#555")
+
+    ax.set_xlim(-1.2, 1.2)
+    ax.set_ylim(-0.7, 1.05)
+    return fig
+
+
+def plot_allocation_evolution(normalized_blocks):
+    data = {"Age": [block["end"] for block in normalized_blocks]}
+    assets = list(normalized_blocks[0]["weights"].keys())
+    for asset in assets:
+        data[asset] = [block["weights"][asset] for block in normalized_blocks]
+    df = pd.DataFrame(data)
+
+    fig, ax = plt.subplots(figsize=(10, 4))
+    palette = ["#1b4f72", "#117a65", "#d35400", "#6c3483", "#1f618d"]
+    for asset, color in zip(assets, palette):
+        ax.plot(df["Age"], df[asset], marker="o", linewidth=2, label=asset, color=color)
+    ax.set_title("Selected Portfolio Allocation Over Time")
+    ax.set_xlabel("Year End")
+    ax.set_ylabel("Allocation Weight")
+    ax.set_ylim(0, 1)
+    ax.legend(loc="upper left", fontsize="small")
+    return fig
+
+
+def plot_drawdown(df_post):
+    fig, ax = plt.subplots(figsize=(10, 4))
+    ax.plot(df_post["Age"], df_post["Remaining Corpus"], color="#d1495b", linewidth=2.5)
+    ax.fill_between(df_post["Age"], df_post["Remaining Corpus"], 0, where=df_post["Remaining Corpus"] >= 0, color="#f7cac9", alpha=0.4)
+    ax.fill_between(df_post["Age"], df_post["Remaining Corpus"], 0, where=df_post["Remaining Corpus"] < 0, color="#c1121f", alpha=0.4)
+    ax.set_title("Post-Retirement Corpus Drawdown")
+    ax.set_xlabel("Age")
+    ax.set_ylabel("Remaining Corpus (NZD)")
+    ax.grid(True)
+    return fig
+
+
+def plot_fund_returns(df_pre):
+    return_columns = [col for col in df_pre.columns if "Return" in col and "FIF" not in col and "Return Rate" not in col]
+    fig, ax = plt.subplots(figsize=(10, 4))
+    sns.boxplot(data=df_pre[return_columns], ax=ax, palette="Set3")
+    ax.set_title("Annual Fund Return Distribution")
+    ax.set_ylabel("Return (NZD)")
+    ax.set_xticklabels(ax.get_xticklabels(), rotation=30, ha="right")
+    return fig
@@ -0,0 +1,95 @@
+import numpy as np
+from schema import compact_frame
+
+QUANTILE_LABELS = {0.05: "p5", 0.5: "median", 0.95: "p95"}
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+
+
+def quantile_label(q):
+    return QUANTILE_LABELS.get(q, f"p{q * 100:g}")
+
+
+class EnsembleResult:
+    # Columnar store for a batch of simulated paths.
+    # `arrays` holds one preallocated (n_sims, years) array per requested metric and (years,) arrays for
+    # metrics that only depend on the year. `detail` holds every other column for the first few paths,
+    # so a full table can still be shown for a displayed path without keeping it for the whole ensemble.
+
+    def __init__(self, n_sims, arrays, columns, detail=None, attrs=None):
+        self.n_sims = n_sims
+        self.arrays = arrays
+        self.columns = columns
+        self.detail = detail or {}
+        # Per-path sampling metadata: "Groups" (replicate ids), "Control" and "Control Mean"
+        self.attrs = attrs or {}
+
+    @classmethod
+    def concatenate(cls, results):
+        # Joins shards in order; yearly columns and detail paths come from the first shard.
+        first = results[0]
+        arrays = {
+            column: values if values.ndim == 1 else np.concatenate([r.arrays[column] for r in results], axis=0)
+            for column, values in first.arrays.items()
+        }
+        attrs = dict(first.attrs)
+        if "Groups" in first.attrs:
+            offsets = np.cumsum([0] + [r.attrs["Groups"].max() + 1 for r in results[:-1]])
+            attrs["Groups"] = np.concatenate([r.attrs["Groups"] + offset for r, offset in zip(results, offsets)])
+        for key in ("Control", "Control Mean"):
+            if key in first.attrs:
+                attrs[key] = np.concatenate([r.attrs[key] for r in results])
+        return cls(sum(r.n_sims for r in results), arrays, first.columns, first.detail, attrs)
+
+    def __getitem__(self, metric):
+        return self.arrays[metric]
+
+    def __contains__(self, metric):
+        return metric in self.arrays
+
+    @property
+    def ages(self):
+        return self.arrays["Age"]
+
+    def percentiles(self, metric="Adjusted Fund Value", quantiles=DEFAULT_QUANTILES):
+        # Statistics are always taken in float64, also for compact float32 ensembles
+        values = np.quantile(np.asarray(self.arrays[metric], dtype=float), quantiles, axis=0)
+        # pandas loads with the first table, so importing the engines only loads NumPy
+        import pandas as pd
+        frame = pd.DataFrame({"Age": self.ages.astype(int)})
+        for q, row in zip(quantiles, values):
+            frame[quantile_label(q)] = row
+        return frame
+
+    def path_sums(self, metric):
+        return self.arrays[metric].sum(axis=1, dtype=float)
+
+    def at_age(self, metric, age):
+        matches = np.flatnonzero(self.ages == age)
+        if matches.size == 0:
+            return np.full(self.n_sims, np.nan)
+        return self.arrays[metric][:, matches[-1]].astype(float)
+
+    def final(self, metric="Adjusted Fund Value"):
+        return self.arrays[metric][:, -1].astype(float)
+
+    def path_frame(self, path=0, compact=False):
+        data = {}
+        for column in self.columns:
+            if column in self.arrays:
+                values = self.arrays[column]
+            elif column in self.detail and path < self.detail[column].shape[0]:
+                values = self.detail[column]
+            else:
+                continue
+            value = values if values.ndim == 1 else values[path]
+            if column in ("Partner Status", "Children Status") and not compact:
+                data[column] = np.where(value, "Yes", "No")
+            elif value.dtype == bool:
+                data[column] = value
+            elif column in ("Year", "Age"):
+                data[column] = value.astype(int)
+            else:
+                data[column] = np.round(np.asarray(value, dtype=float), 2)
+        import pandas as pd
+        frame = pd.DataFrame(data)
+        return compact_frame(frame) if compact else frame
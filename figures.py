@@ -0,0 +1,60 @@
+import hashlib
+import io
+import matplotlib
+# Render off-screen: interactive backends keep figures alive in a GUI event loop a server never runs
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from cache import ResultCache, parameter_key
+from instrumentation import timed
+
+DEFAULT_FIGURE_CACHE_BYTES = 64 * 1024 ** 2
+
+
+def data_key(name, *data):
+    # Hash of everything a chart is drawn from; arrays and frames are hashed by content, not identity
+    digest = hashlib.sha256(name.encode("utf-8"))
+    for value in data:
+        if isinstance(value, pd.DataFrame):
+            digest.update(parameter_key({"columns": [str(c) for c in value.columns], "attrs": value.attrs}).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        elif isinstance(value, (np.ndarray, pd.Series)):
+            array = np.ascontiguousarray(value)
+            digest.update(f"{array.dtype}{array.shape}".encode())
+            digest.update(array.tobytes())
+        else:
+            digest.update(parameter_key(value).encode())
+    return digest.hexdigest()
+
+
+def render(fig, fmt="png", dpi=100):
+    # Saves a figure to bytes and always closes it, so pyplot's figure registry never holds on to it
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class FigureRenderer:
+    # Renders charts to PNG/SVG bytes and keeps the bytes in a byte-bounded LRU keyed by the chart name,
+    # output format and plotted data. Identical charts (reruns, other sessions) are served without matplotlib.
+
+    def __init__(self, cache=None, fmt="png", dpi=100):
+        self.cache = cache if cache is not None else ResultCache(max_bytes=DEFAULT_FIGURE_CACHE_BYTES)
+        self.fmt = fmt
+        self.dpi = dpi
+
+    def render(self, name, plot, *data):
+        key = data_key(f"{name}:{self.fmt}:{self.dpi}", *data)
+        image = self.cache.get(key)
+        if image is None:
+            with timed(f"figure.{name}"):
+                result = plot(*data)
+                # Plot functions may return extra values alongside the figure
+                fig = result[0] if isinstance(result, tuple) else result
+                image = render(fig, self.fmt, self.dpi)
+            self.cache.put(key, image)
+        return image
@@ -0,0 +1,15 @@
+import pandas as pd
+
+
+def format_currency(value):
+    if pd.isna(value):
+        return "N/A"
+    return f"${value:,.0f}"
+
+
+def million_formatter(x, pos):
+    if x >= 1e6:
+        return f"{x/1e6:.1f}M"
+    if x >= 1e3:
+        return f"{x/1e3:.0f}K"
+    return f"{x:.0f}"
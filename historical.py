@@ -0,0 +1,163 @@
+import argparse
+import glob
+import hashlib
+import os
+import sys
+import numpy as np
+
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CSV Files")
+# The single-path workbook; the Monte Carlo one averages many paths and has almost no year-to-year variation
+DEFAULT_HISTORY_FILE = os.path.join(HISTORY_DIR, "Task 1 - No change in fund allocation.xlsx")
+BOOTSTRAP_METHODS = ("stationary", "block")
+DEFAULT_BLOCK_LENGTH = 5
+PORTFOLIO = "Portfolio"
+# The fixed allocation the projection notebook wrote the workbooks with. Its "<fund> Return" columns hold
+# the year's contribution share after one year's growth, contribution * weight * (1 + return).
+HISTORY_WEIGHTS = {"Harboursafe": 0.4, "Horizon": 0.3, "SkyHigh": 0.3}
+# Bumped whenever parse_history changes, so cached .npz files and results from older versions are not reused
+HISTORY_FORMAT = 2
+
+_histories = {}
+# (absolute path, mtime, size) -> content hash, so only a changed workbook is read and hashed again
+_digests = {}
+
+
+def file_digest(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _digests:
+        digest = hashlib.sha256()
+        with open(path, "rb") as handle:
+            for chunk in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(chunk)
+        _digests[key] = digest.hexdigest()
+    return _digests[key]
+
+
+def cache_path(path, digest):
+    # Set RETIREMENT_HISTORY_CACHE to keep converted histories somewhere other than next to the workbooks
+    cache_dir = os.environ.get("RETIREMENT_HISTORY_CACHE") or os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    stem = os.path.splitext(os.path.basename(path))[0].replace(" ", "_")
+    return os.path.join(cache_dir, f"{stem}-{digest[:16]}-v{HISTORY_FORMAT}.npz")
+
+
+def parse_history(path):
+    # Yearly returns from a projection workbook. The portfolio return is what the fund value grew by beyond
+    # the year's contribution: (value_t - value_t-1 - contribution_t) / value_t-1. Each fund's return is its
+    # grown contribution share over the share it started from: value_f / (contribution_t * weight_f) - 1.
+    # Every series covers the same years (the first has no portfolio return), so one index is one year.
+    import pandas as pd
+    sheet = pd.read_excel(path, engine="openpyxl")
+    value = sheet["Total Fund Value"].to_numpy(dtype=float)
+    contribution = sheet["Total Contribution"].to_numpy(dtype=float)
+    series = {PORTFOLIO: (value[1:] - value[:-1] - contribution[1:]) / value[:-1]}
+    for fund, weight in HISTORY_WEIGHTS.items():
+        fund_value = sheet[f"{fund} Return"].to_numpy(dtype=float)
+        series[fund] = (fund_value / (contribution * weight) - 1)[1:]
+    return series
+
+
+def load_history(path=DEFAULT_HISTORY_FILE):
+    # Workbooks are parsed once and converted to an .npz keyed by their content hash; later loads, in this
+    # or any other process, read the binary file. An edited workbook hashes differently and is converted again.
+    # Within a process the hash is reused while the file's modification time and size are unchanged.
+    digest = file_digest(path)
+    if digest in _histories:
+        return _histories[digest]
+    cached = cache_path(path, digest)
+    if os.path.exists(cached):
+        with np.load(cached) as data:
+            series = {name: data[name] for name in data.files}
+    else:
+        series = parse_history(path)
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            # Written under a temporary name first so a concurrent reader never sees a partial file
+            tmp = f"{cached}.{os.getpid()}.tmp.npz"
+            np.savez(tmp, **series)
+            os.replace(tmp, cached)
+        except OSError:
+            # A read-only install still works; the workbook is just parsed once per process
+            pass
+    _histories[digest] = (digest, series)
+    return _histories[digest]
+
+
+def stationary_indices(rng, n_obs, years, n, block_length):
+    # Politis-Romano stationary bootstrap: each year starts a new block with probability 1 / block_length,
+    # otherwise it continues the previous year's block; blocks wrap around the end of the history.
+    # `rng` is a Generator or np.random itself, so the scalar engines can share the global stream.
+    restart = rng.random((years, n)) < 1 / block_length
+    restart[0] = True
+    starts = (rng.random((years, n)) * n_obs).astype(int)
+    year = np.arange(years)[:, None]
+    block_start = np.maximum.accumulate(np.where(restart, year, 0), axis=0)
+    return (np.take_along_axis(starts, block_start, axis=0) + year - block_start) % n_obs
+
+
+def block_indices(rng, n_obs, years, n, block_length):
+    # Circular block bootstrap with fixed-length blocks
+    starts = (rng.random((-(-years // block_length), n)) * n_obs).astype(int)
+    year = np.arange(years)[:, None]
+    return (starts[year[:, 0] // block_length] + year % block_length) % n_obs
+
+
+class HistoricalReturns:
+    # Resamples yearly returns from a projection workbook with a stationary or block bootstrap. Blocks
+    # keep runs of consecutive years together, so the resampled paths keep the history's short-term
+    # momentum and mean reversion that independent normal draws cannot. One index draw serves every fund,
+    # so all funds earn their own return of the same sampled year and keep the history's co-movement.
+    # Funds the workbook has no column for (Foreign Equities) and post-retirement returns use the
+    # portfolio's return of that year.
+
+    def __init__(self, path=DEFAULT_HISTORY_FILE, method="stationary", block_length=DEFAULT_BLOCK_LENGTH):
+        if method not in BOOTSTRAP_METHODS:
+            raise ValueError(f"Unknown bootstrap method: {method}; choose from {BOOTSTRAP_METHODS}")
+        if block_length < 1:
+            raise ValueError("block_length must be at least 1")
+        self.path = path
+        self.method = method
+        self.block_length = block_length
+        self.digest, self.series = load_history(path)
+        self.n_obs = len(self.series[PORTFOLIO])
+
+    def cache_key(self):
+        # Identified by the workbook contents, not by where it is stored
+        return {"historical": self.digest, "format": HISTORY_FORMAT, "method": self.method,
+                "block_length": self.block_length}
+
+    def __repr__(self):
+        return f"HistoricalReturns({os.path.basename(self.path)!r}, {self.method}, block_length={self.block_length})"
+
+    def check_variance_reduction(self, method):
+        # Bootstrapped years are dependent within a block, so no control has a known expectation
+        if method != "none":
+            raise ValueError(f"Variance reduction {method!r} cannot be used with historical returns")
+
+    def sample(self, rng, years, n):
+        # (years, n) indices into the history, drawn for every path at once
+        indices = stationary_indices if self.method == "stationary" else block_indices
+        return indices(rng, self.n_obs, years, n, self.block_length)
+
+    @property
+    def funds(self):
+        return [name for name in self.series if name != PORTFOLIO]
+
+    def returns(self, indices, fund=PORTFOLIO):
+        return self.series.get(fund, self.series[PORTFOLIO])[indices]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert projection workbooks to the cached binary return histories")
+    parser.add_argument("paths", nargs="*", help="workbooks to convert (default: every .xlsx in 'CSV Files')")
+    args = parser.parse_args(argv)
+    for path in args.paths or sorted(glob.glob(os.path.join(HISTORY_DIR, "*.xlsx"))):
+        digest, series = load_history(path)
+        print(f"{os.path.basename(path)}: {len(series[PORTFOLIO])} years -> {cache_path(path, digest)}")
+        for name, returns in series.items():
+            print(f"  {name:<12} mean {returns.mean():6.2%}  std {returns.std(ddof=1):6.2%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Structured run logs go to this logger as one JSON object per line. Set RETIREMENT_PERF_LOG to a file
+# path (or "-" for stderr) to attach a handler; otherwise whatever logging setup the host has applies.
+logger = logging.getLogger("retirement.performance")
+_NOOP = nullcontext()
+_active = threading.local()
+# tracemalloc is process-wide while recordings are per thread: profiled recordings share one trace, started
+# by the first and stopped by the last, and "starts" counts recordings so a timer can tell another began
+_tracing = {"runs": 0, "starts": 0, "owned": False}
+_tracing_lock = threading.Lock()
+
+
+class Timings:
+    # Wall time, call counts and allocation peaks per timed name for one recording.
+    # Peaks are only measured when profiling, since tracemalloc slows every allocation while it traces, and
+    # only for blocks no other profiled recording overlaps, since the peak is shared by the whole process.
+
+    def __init__(self, profile=False):
+        self.profile = profile
+        self.stats = {}
+        self._peaks = []
+
+    def add(self, name, seconds, peak_bytes=None):
+        entry = self.stats.setdefault(name, {"calls": 0, "seconds": 0.0, "peak_bytes": None})
+        entry["calls"] += 1
+        entry["seconds"] += seconds
+        if peak_bytes is not None:
+            entry["peak_bytes"] = max(entry["peak_bytes"] or 0, peak_bytes)
+
+    def total(self, prefix=""):
+        return sum(entry["seconds"] for name, entry in self.stats.items() if name.startswith(prefix))
+
+    def frame(self):
+        import pandas as pd
+        rows = [
+            {"Name": name, "Calls": entry["calls"], "Seconds": round(entry["seconds"], 4),
+             "Peak MB": None if entry["peak_bytes"] is None else round(entry["peak_bytes"] / 1024 ** 2, 2)}
+            for name, entry in self.stats.items()
+        ]
+        return pd.DataFrame(rows, columns=["Name", "Calls", "Seconds", "Peak MB"])
+
+    def as_dict(self):
+        return {name: dict(entry) for name, entry in self.stats.items()}
+
+
+class _Timer:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.measured = False
+        if self.timings.profile:
+            with _tracing_lock:
+                self.measured = _tracing["runs"] == 1
+                self.starts = _tracing["starts"]
+        if self.measured:
+            # Nested timers each reset the tracemalloc peak, so the outer peak so far is set aside first
+            current, peak = tracemalloc.get_traced_memory()
+            if self.timings._peaks:
+                self.timings._peaks[-1] = max(self.timings._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.start_bytes = current
+            self.timings._peaks.append(current)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        peak_bytes = None
+        if self.measured:
+            peak = max(self.timings._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self.timings._peaks:
+                self.timings._peaks[-1] = max(self.timings._peaks[-1], peak)
+            with _tracing_lock:
+                # Another recording that started meanwhile may have reset the peak
+                alone = _tracing["starts"] == self.starts
+            peak_bytes = peak - self.start_bytes if alone else None
+        self.timings.add(self.name, seconds, peak_bytes)
+        return False
+
+
+def timed(name):
+    # Times a block into the recording active on this thread; a shared no-op when nothing is recording
+    timings = getattr(_active, "timings", None)
+    return _Timer(timings, name) if timings is not None else _NOOP
+
+
+def phase(name):
+    # Engine phases are only timed in profiling recordings, keeping the default run to a flag check per phase
+    timings = getattr(_active, "timings", None)
+    return _Timer(timings, name) if timings is not None and timings.profile else _NOOP
+
+
+def instrument(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def recording(profile=False, timings=None):
+    # Collects everything timed on this thread until the block exits; pass an earlier `timings` to add to it.
+    # Work done in worker processes (parallel shards) shows up in the enclosing stage time but not as
+    # separate engine phases.
+    previous = getattr(_active, "timings", None)
+    timings = timings if timings is not None else Timings(profile)
+    if timings.profile:
+        with _tracing_lock:
+            if _tracing["runs"] == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracing["owned"] = True
+            _tracing["runs"] += 1
+            _tracing["starts"] += 1
+    _active.timings = timings
+    try:
+        yield timings
+    finally:
+        _active.timings = previous
+        if timings.profile:
+            with _tracing_lock:
+                _tracing["runs"] -= 1
+                if _tracing["runs"] == 0 and _tracing["owned"]:
+                    tracemalloc.stop()
+                    _tracing["owned"] = False
+
+
+def configure_logging():
+    destination = os.environ.get("RETIREMENT_PERF_LOG")
+    if not destination or logger.handlers:
+        return
+    handler = logging.StreamHandler() if destination == "-" else logging.FileHandler(destination)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def log_timings(timings, event="run", **fields):
+    record = {"event": event, "timestamp": time.time(), "profile": timings.profile, **fields,
+              "timings": timings.as_dict()}
+    logger.info(json.dumps(record, default=str))
+    return record
@@ -0,0 +1,124 @@
+import importlib.util
+import os
+import numpy as np
+
+# Backends of the pre-retirement fund balance recurrence. "auto" uses Numba when it is installed;
+# RETIREMENT_KERNEL sets the default for every engine call.
+KERNEL_BACKENDS = ("auto", "numpy", "numba")
+FIF_THRESHOLD = 50000
+HOME_DEPOSIT = 60000
+
+_compiled = {}
+
+
+def fund_recurrence_numpy(buying_home, withdrawal_years, requested_withdrawal, foreign_contrib, foreign_return_rates,
+                          weights, fund_g, total_contrib, marginal_tax_rate, corpus_out, foreign_out, fif_out,
+                          withdrawal_out, fund_returns):
+    # The year loop vectorized across paths. Inputs are (years, n) except withdrawal_years (years,) flags,
+    # weights (years, funds, k) and fund_g (funds, years, n). The paths are k equal runs of consecutive
+    # columns, each invested with its own allocation. Each output keeps the first out.shape[-1] paths.
+    years, n = total_contrib.shape
+    n_funds, k = weights.shape[1:]
+    corpus = np.zeros(n)
+    foreign_corpus = np.zeros(n)
+    for t in range(years):
+        corpus = corpus - HOME_DEPOSIT * buying_home[t]
+
+        withdrawal = np.zeros(n)
+        if withdrawal_years[t]:
+            withdrawal = np.minimum(requested_withdrawal[t], corpus)
+            corpus = corpus - withdrawal
+
+        foreign_corpus = foreign_corpus + foreign_contrib[t] + foreign_corpus * foreign_return_rates[t]
+
+        # One broadcast over funds and allocations replaces the per-fund dict loop; funds are summed in the same order
+        w = weights[t][:, :, None]
+        returns = (corpus.reshape(k, -1) * w * fund_g[:, t].reshape(n_funds, k, -1)
+                   + total_contrib[t].reshape(k, -1) * w * 0.5).reshape(n_funds, n)
+        total_growth = returns.sum(axis=0)
+        fund_returns[:, t] = returns[:, :fund_returns.shape[2]]
+
+        fif_tax = np.where(foreign_corpus > FIF_THRESHOLD, foreign_corpus * 0.05 * marginal_tax_rate, 0)
+        corpus = corpus + total_contrib[t] + total_growth - fif_tax - withdrawal
+
+        for out, value in ((corpus_out, corpus), (foreign_out, foreign_corpus), (fif_out, fif_tax),
+                           (withdrawal_out, withdrawal)):
+            out[t] = value[:out.shape[1]]
+
+
+def fund_recurrence_loops(buying_home, withdrawal_years, requested_withdrawal, foreign_contrib, foreign_return_rates,
+                          weights, fund_g, total_contrib, marginal_tax_rate, corpus_out, foreign_out, fif_out,
+                          withdrawal_out, fund_returns):
+    # The same recurrence as explicit loops: slow in Python, and the function Numba compiles. Each year is
+    # one pass over contiguous rows with no temporaries, and operations keep the NumPy backend's order so
+    # both round the same way.
+    years, n = total_contrib.shape
+    n_funds = weights.shape[1]
+    per_allocation = n // weights.shape[2]
+    corpus = np.zeros(n)
+    foreign_corpus = np.zeros(n)
+    for t in range(years):
+        for i in range(n):
+            balance = corpus[i]
+            if buying_home[t, i]:
+                balance = balance - HOME_DEPOSIT
+            withdrawal = 0.0
+            if withdrawal_years[t]:
+                withdrawal = min(requested_withdrawal[t, i], balance)
+                balance = balance - withdrawal
+
+            foreign = foreign_corpus[i] + foreign_contrib[t, i] + foreign_corpus[i] * foreign_return_rates[t, i]
+
+            total_growth = 0.0
+            w = i // per_allocation
+            for f in range(n_funds):
+                fund_return = balance * weights[t, f, w] * fund_g[f, t, i] + total_contrib[t, i] * weights[t, f, w] * 0.5
+                total_growth += fund_return
+                if i < fund_returns.shape[2]:
+                    fund_returns[f, t, i] = fund_return
+
+            fif_tax = foreign * 0.05 * marginal_tax_rate if foreign > FIF_THRESHOLD else 0.0
+            balance = balance + total_contrib[t, i] + total_growth - fif_tax - withdrawal
+            corpus[i] = balance
+            foreign_corpus[i] = foreign
+
+            if i < corpus_out.shape[1]:
+                corpus_out[t, i] = balance
+            if i < foreign_out.shape[1]:
+                foreign_out[t, i] = foreign
+            if i < fif_out.shape[1]:
+                fif_out[t, i] = fif_tax
+            if i < withdrawal_out.shape[1]:
+                withdrawal_out[t, i] = withdrawal
+
+
+def numba_available():
+    return importlib.util.find_spec("numba") is not None
+
+
+def numba_kernel():
+    # Compiled on first use rather than on import, so the engines still import with NumPy alone; cache=True
+    # keeps the machine code in __pycache__ so later processes skip the compilation
+    if "numba" not in _compiled:
+        import numba
+        _compiled["numba"] = numba.njit(cache=True, nogil=True)(fund_recurrence_loops)
+    return _compiled["numba"]
+
+
+def resolve_backend(backend=None):
+    backend = backend or os.environ.get("RETIREMENT_KERNEL") or "auto"
+    if backend not in KERNEL_BACKENDS:
+        raise ValueError(f"Unknown kernel backend: {backend}; choose from {KERNEL_BACKENDS}")
+    if backend == "auto":
+        return "numba" if numba_available() else "numpy"
+    if backend == "numba" and not numba_available():
+        raise ValueError("The numba kernel backend needs Numba installed (pip install numba)")
+    return backend
+
+
+def fund_recurrence(*arrays, backend=None):
+    # Runs the year loop of simulate_pre_retirement_batch into the preallocated outputs
+    if resolve_backend(backend) == "numba":
+        numba_kernel()(*arrays)
+    else:
+        fund_recurrence_numpy(*arrays)
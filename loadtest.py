@@ -0,0 +1,116 @@
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+DEFAULT_REQUESTS = 200
+DEFAULT_CONCURRENCY = 16
+# Distinct pre-retirement profiles in the workload, and post-retirement variants of each
+DEFAULT_PROFILES = 4
+DEFAULT_VARIANTS = 8
+
+
+def workload(requests, profiles, variants, paths, seed=0):
+    # Request bodies cycling through `profiles` contribution rates, each asked with one of `variants`
+    # retirement lifestyles, in a random order
+    rng = np.random.default_rng(seed)
+    bodies = []
+    for i in range(requests):
+        profile, variant = rng.integers(profiles), rng.integers(variants)
+        bodies.append({
+            "client_id": f"load-{i}",
+            "n_simulation": paths,
+            "contribution_max": 0.08 + 0.01 * int(profile),
+            "retirement_spending_ratio": None,
+            "lifestyle_base_today": 50_000 + 5_000 * int(variant),
+        })
+    return bodies
+
+
+def post(url, body):
+    request = urllib.request.Request(f"{url}/simulate", data=json.dumps(body).encode(),
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return status, time.perf_counter() - start
+
+
+def load_test(url, bodies, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda body: post(url, body), bodies))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([seconds for status, seconds in results if status == 200])
+    with urllib.request.urlopen(f"{url}/metrics") as response:
+        metrics = json.load(response)
+    return {
+        "requests": len(bodies),
+        "errors": sum(status != 200 for status, _ in results),
+        "seconds": elapsed,
+        "throughput": len(bodies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000 if latencies.size else None,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000 if latencies.size else None,
+        "mean_group_size": metrics["batching"]["mean_group_size"],
+        "mean_job_size": metrics["batching"].get("mean_job_size", 0.0),
+        "evaluations": metrics["batching"].get("evaluations", 0),
+        "utilization": metrics["queue"]["utilization"],
+    }
+
+
+def local_server(window, workers, batching):
+    # An API server on a free localhost port, serving from a daemon thread
+    from api import make_server
+    server = make_server(port=0, window=window, workers=workers, batching=batching)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+def report(name, result):
+    print(f"{name:<12} {result['requests']:>5} requests  {result['throughput']:7.1f} req/s  "
+          f"p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+          f"per ensemble {result['mean_group_size']:5.1f}  per job {result['mean_job_size']:5.1f}  evaluations {result['evaluations']:>4}  "
+          f"errors {result['errors']}  utilization {result['utilization']:.0%}")
+
+
+def main(argv=None):
+    from api import DEFAULT_WINDOW
+    parser = argparse.ArgumentParser(description="Load-test the JSON API and report throughput and p50/p99 latency")
+    parser.add_argument("--url", help="running API to test (default: start one on localhost for each mode)")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--paths", type=int, default=1000, help="n_simulation of every request")
+    parser.add_argument("--profiles", type=int, default=DEFAULT_PROFILES, help="distinct pre-retirement profiles")
+    parser.add_argument("--variants", type=int, default=DEFAULT_VARIANTS, help="retirement lifestyles per profile")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW, help="batching window of the local server")
+    parser.add_argument("--workers", type=int, default=None, help="simulation threads of the local server")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    bodies = workload(args.requests, args.profiles, args.variants, args.paths, args.seed)
+
+    if args.url:
+        report("api", load_test(args.url.rstrip("/"), bodies, args.concurrency))
+        return 0
+    # Each mode gets a fresh server, so neither starts with the other's cached results
+    for name, batching in (("unbatched", False), ("micro-batch", True)):
+        server, url = local_server(args.window, args.workers, batching)
+        try:
+            report(name, load_test(url, bodies, args.concurrency))
+        finally:
+            server.shutdown()
+            server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ensemble import EnsembleResult
+from post_retirement import drawdown_statistics, post_retirement_frame, simulate_post_retirement_batch
+from pre_retirement import simulate_pre_retirement_batch
+from sketch import QuantileSketch
+
+# Shards have a fixed size so the random streams do not depend on how many workers run them.
+DEFAULT_SHARD_SIZE = 10_000
+# Paths of all variants together one engine call evaluates at most; more variants split into several calls
+VARIANT_COLUMNS = 50_000
+
+# Inputs of the shards the current thread runs: set once per worker process, or per in-process run, which
+# the scheduler and the API can start from several threads at once
+_shared = threading.local()
+
+
+def seed_sequence(seed=None):
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+def shard_sizes(n_sims, shard_size=DEFAULT_SHARD_SIZE, first_shard=None):
+    # With `first_shard`, shards double from that size up to shard_size, so a caller watching shards
+    # complete sees its first results after a few hundred paths instead of after a whole shard
+    if first_shard is None:
+        full, rest = divmod(n_sims, shard_size)
+        return [shard_size] * full + ([rest] if rest else [])
+    sizes = []
+    size = min(first_shard, shard_size)
+    while sum(sizes) < n_sims:
+        sizes.append(min(size, n_sims - sum(sizes)))
+        size = min(size * 2, shard_size)
+    return sizes
+
+
+def _init_worker(params):
+    # Inputs are sent to each worker once instead of with every shard
+    _shared.params = dict(params)
+
+
+def _run_pre_shard(task):
+    size, seed, offset = task
+    variants = _shared.params.get("variants")
+    if variants is None:
+        return simulate_pre_retirement_batch(size, **_shared.params, scenario_offset=offset, rng=np.random.default_rng(seed))
+    # Each group of variants redraws the shard from its seed, so every group sees the same draws
+    params = {name: value for name, value in _shared.params.items() if name != "variants"}
+    per_call = max(1, VARIANT_COLUMNS // size)
+    results = []
+    for start in range(0, len(variants), per_call):
+        results += simulate_pre_retirement_batch(size, **params, variants=variants[start:start + per_call],
+                                                 scenario_offset=offset, rng=np.random.default_rng(seed))
+    return results
+
+
+def _run_post_shard(task):
+    corpuses, seed, offset = task
+    return simulate_post_retirement_batch(corpuses, **_shared.params, scenario_offset=offset, rng=np.random.default_rng(seed))
+
+
+def _sketch_pre_shard(task):
+    # A shard folded into its own sketch in the worker, so only the sketch is sent back
+    size, seed, offset = task
+    metric, relative_accuracy = _shared.params["sketch"]
+    params = {name: value for name, value in _shared.params.items() if name != "sketch"}
+    chunk = simulate_pre_retirement_batch(size, **dict(params, metrics=[metric], detail_paths=0),
+                                          scenario_offset=offset, rng=np.random.default_rng(seed))
+    return QuantileSketch(chunk.ages, relative_accuracy=relative_accuracy).update(chunk[metric])
+
+
+def _imap_shards(func, tasks, params, workers):
+    # Yields the shard results in order; closing the generator early cancels the shards not yet started
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        _init_worker(params)
+        for task in tasks:
+            yield func(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(params,)) as pool:
+        try:
+            yield from pool.map(func, tasks)
+        except BaseException:
+            pool.shutdown(cancel_futures=True)
+            raise
+
+
+def _map_shards(func, tasks, params, workers, on_shard=None):
+    # on_shard(results) is called with the shards finished so far, in order, after each one; an exception
+    # it raises stops the run and cancels the shards not yet started
+    results = []
+    shards = _imap_shards(func, tasks, params, workers)
+    try:
+        for result in shards:
+            results.append(result)
+            if on_shard is not None:
+                on_shard(results)
+    finally:
+        shards.close()
+    return results
+
+
+def run_pre_retirement_parallel(n_sims, seed=None, workers=None, shard_size=DEFAULT_SHARD_SIZE, scenario_offset=0,
+                                first_shard=None, on_shard=None, **params):
+    # Each shard gets its own SeedSequence child, so the merged ensemble is identical for a
+    # given seed and shard layout whatever the worker count. With a scenario bank in `params`, shard paths
+    # map onto consecutive bank paths from `scenario_offset`; workers reopen the bank rather than copy it.
+    # With `variants` (see simulate_pre_retirement_batch) it returns one ensemble per variant, every one
+    # simulated on the same shards and draws.
+    sizes = shard_sizes(n_sims, shard_size, first_shard)
+    seeds = seed_sequence(seed).spawn(len(sizes))
+    offsets = scenario_offset + np.cumsum([0] + sizes[:-1])
+    tasks = list(zip(sizes, seeds, offsets.tolist()))
+    shards = _map_shards(_run_pre_shard, tasks, params, workers, on_shard)
+    if params.get("variants") is not None:
+        return [EnsembleResult.concatenate(list(parts)) for parts in zip(*shards)]
+    return EnsembleResult.concatenate(shards)
+
+
+def run_pre_retirement_sketch(n_sims, seed=None, workers=None, shard_size=DEFAULT_SHARD_SIZE, scenario_offset=0,
+                              metric="Adjusted Fund Value", relative_accuracy=0.01, **params):
+    # Per-age quantiles of `metric` for ensembles too large to keep: every shard is simulated and sketched
+    # in a worker, and the parent merges the sketches as they arrive, so memory depends on the shard size
+    # and the workers, not on n_sims. Shards and seeds are those of run_pre_retirement_parallel, so the
+    # sketch describes the same paths within its relative accuracy.
+    sizes = shard_sizes(n_sims, shard_size)
+    seeds = seed_sequence(seed).spawn(len(sizes))
+    offsets = scenario_offset + np.cumsum([0] + sizes[:-1])
+    tasks = list(zip(sizes, seeds, offsets.tolist()))
+    params = dict(params, sketch=(metric, relative_accuracy))
+    merged = None
+    for sketch in _imap_shards(_sketch_pre_shard, tasks, params, workers):
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
+
+
+def run_post_retirement_parallel(corpuses, seed=None, workers=None, shard_size=DEFAULT_SHARD_SIZE,
+                                 detail_path=None, spending_basis="Manual lifestyle input", scenario_offset=0, **params):
+    corpuses = np.asarray(corpuses, dtype=float)
+    starts = range(0, max(len(corpuses), 1), shard_size)
+    seeds = seed_sequence(seed).spawn(len(starts))
+    tasks = [(corpuses[start:start + shard_size], s, scenario_offset + start) for start, s in zip(starts, seeds)]
+    shards = _map_shards(_run_post_shard, tasks, params, workers)
+    if len(shards) == 1:
+        # A single shard is already the full result, drawdown statistics included
+        results = shards[0]
+        if detail_path is not None:
+            results["Table"] = post_retirement_frame(results, detail_path, spending_basis)
+        return results
+
+    results = {key: value for key, value in shards[0].items() if np.ndim(value) == 1}
+    for key in ("Opening Corpus", "Annual Return Rate", "Remaining Corpus"):
+        if key in shards[0]:
+            results[key] = np.concatenate([shard[key] for shard in shards], axis=0)
+    offsets = np.cumsum([0] + [shard["Groups"].max() + 1 if len(shard["Groups"]) else 0 for shard in shards[:-1]])
+    results["Groups"] = np.concatenate([shard["Groups"] + offset for shard, offset in zip(shards, offsets)])
+    results.update(drawdown_statistics(results["Age"], results["Remaining Corpus"]))
+    if detail_path is not None:
+        results["Table"] = post_retirement_frame(results, detail_path, spending_basis)
+    return results
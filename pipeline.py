@@ -0,0 +1,303 @@
+import numpy as np
+import pandas as pd
+from adaptive import run_until_converged
+from cache import parameter_key
+from instrumentation import timed
+from parallel import run_post_retirement_parallel, run_pre_retirement_parallel
+from post_retirement import simulate_post_retirement_batch
+from pre_retirement import VARIANT_PARAMS, get_funds
+from variance_reduction import estimate_precision
+
+SUMMARY_METRICS = ["Adjusted Fund Value", "Total Contribution", "Total Spent"]
+# The ensemble is simulated in shards that double from this size, so progress arrives after the first few paths
+FIRST_SHARD_SIZE = 100
+# Paths of the ensembles run_batched simulates together at most; more runs are simulated in several groups
+BATCHED_PATHS = 200_000
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class Stage:
+    # A pipeline step. `inputs` are the run inputs it reads and, together with the keys of its
+    # `upstream` stages, decide whether it has to rerun. `context` values (worker counts, progress
+    # callbacks and the like) are passed through but never change the result, so they are not part of the key.
+
+    def __init__(self, name, func, inputs=(), upstream=(), context=(), shared=False):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.upstream = tuple(upstream)
+        self.context = tuple(context)
+        self.shared = shared
+
+
+class Pipeline:
+    # Runs stages in order and reuses the output of any stage whose declared inputs and upstream
+    # stages are unchanged since the previous run. `state` is a per-session dict of the last outputs;
+    # stages marked `shared` are also looked up in and stored to `cache` so other sessions can reuse them.
+    # Setting the threading.Event in context["cancel"] stops a run at the next stage or shard boundary.
+
+    def __init__(self, stages, cache=None):
+        self.stages = list(stages)
+        self.cache = cache
+
+    def stage_key(self, stage, inputs, keys):
+        return parameter_key({
+            "stage": stage.name,
+            "inputs": {name: inputs[name] for name in stage.inputs},
+            "upstream": [keys[name] for name in stage.upstream],
+        })
+
+    def lookup(self, name, inputs, state):
+        # The output of the first stage `name` for `inputs` if the state or the cache already has it
+        stage = self.stages[0]
+        if stage.name != name:
+            raise ValueError(f"Only the first stage can be looked up or primed, not {name!r}")
+        key = self.stage_key(stage, inputs, {})
+        previous = state.get(name)
+        if previous is not None and previous["key"] == key:
+            return previous["output"]
+        return self.cache.get(key) if stage.shared and self.cache is not None else None
+
+    def prime(self, name, inputs, state, output):
+        # Records an output of the first stage computed outside the pipeline, so the next run reuses it
+        stage = self.stages[0]
+        if stage.name != name:
+            raise ValueError(f"Only the first stage can be looked up or primed, not {name!r}")
+        key = self.stage_key(stage, inputs, {})
+        state[name] = {"key": key, "output": output}
+        if stage.shared and self.cache is not None:
+            self.cache.put(key, output)
+
+    def run(self, inputs, state, context=None):
+        context = context or {}
+        outputs = {}
+        keys = {}
+        recomputed = []
+        cancel = context.get("cancel")
+        for stage in self.stages:
+            if cancel is not None and cancel.is_set():
+                raise RunCancelled()
+            stage_inputs = {name: inputs[name] for name in stage.inputs}
+            key = self.stage_key(stage, inputs, keys)
+            keys[stage.name] = key
+            previous = state.get(stage.name)
+            if previous is not None and previous["key"] == key:
+                outputs[stage.name] = previous["output"]
+                continue
+
+            output = self.cache.get(key) if stage.shared and self.cache is not None else None
+            if output is None:
+                with timed(f"stage.{stage.name}"):
+                    output = stage.func(
+                        **stage_inputs,
+                        **{name: outputs[name] for name in stage.upstream},
+                        **{name: context[name] for name in stage.context if name in context},
+                    )
+                if stage.shared and self.cache is not None:
+                    self.cache.put(key, output)
+            state[stage.name] = {"key": key, "output": output}
+            outputs[stage.name] = output
+            recomputed.append(stage.name)
+        return outputs, recomputed
+
+
+# --- RETIREMENT STAGES ---
+def stage_seeds(random_seed):
+    pre_seed, post_seed, median_path_seed = np.random.SeedSequence(random_seed).spawn(3)
+    return pre_seed, post_seed, median_path_seed
+
+
+def linked_lifestyle(ensemble, spending_ratio):
+    # Retirement lifestyle linked to the modeled age-65 spending; None means the manual input is used
+    if spending_ratio is None:
+        return None
+    median_spending = np.median(ensemble.at_age("Total Spent", 65))
+    return median_spending * spending_ratio if pd.notna(median_spending) else None
+
+
+def ensemble_stage(pre_params, n_simulation, random_seed, variance_reduction, adaptive, scenario_bank, workers=1,
+                   progress=None, cancel=None):
+    pre_seed = stage_seeds(random_seed)[0]
+    # float32 paths halve what the ensemble costs in the result cache; every figure shown is whole dollars
+    params = dict(pre_params, metrics=SUMMARY_METRICS, compact=True, scenarios=scenario_bank)
+    # Paths simulated so far; each batch reads the scenario bank paths that follow the previous batch's
+    drawn = [0]
+    batches = []
+
+    def on_shard(shards):
+        if cancel is not None and cancel.is_set():
+            raise RunCancelled()
+        if progress is not None:
+            # Every shard simulated so far, earlier adaptive batches included
+            progress(batches + shards)
+
+    def simulate(n, seed):
+        batch = run_pre_retirement_parallel(n, seed=seed, workers=workers, variance_reduction=variance_reduction,
+                                            scenario_offset=drawn[-1], first_shard=FIRST_SHARD_SIZE, on_shard=on_shard,
+                                            **params)
+        drawn.append(drawn[-1] + n)
+        batches.append(batch)
+        return batch
+
+    if adaptive is None:
+        return {"ensemble": simulate(n_simulation, pre_seed), "adaptive_summary": None}
+
+    def batch_shortfall(batch, seed):
+        # Runs right after simulate(), so the batch starts at drawn[-2]
+        return simulate_post_retirement_batch(
+            batch.final(), **adaptive["post_params"],
+            lifestyle_at_retirement=linked_lifestyle(batch, adaptive["spending_ratio"]),
+            variance_reduction=variance_reduction, scenarios=scenario_bank, scenario_offset=drawn[-2], rng=seed,
+        )["Ruined"]
+
+    ensemble, summary = run_until_converged(
+        simulate,
+        shortfall_fn=batch_shortfall,
+        max_paths=n_simulation,
+        max_seconds=adaptive["time_limit"],
+        seed=pre_seed,
+    )
+    return {"ensemble": ensemble, "adaptive_summary": summary}
+
+
+def ensemble_variants(pre_params_list, n_simulation, random_seed, variance_reduction, scenario_bank, workers=1):
+    # ensemble_stage for several pre_params that differ only in VARIANT_PARAMS, simulated together on one
+    # set of draws along the engine's variant axis; each output is the one ensemble_stage gives on its own
+    variants = [{name: pre_params[name] for name in VARIANT_PARAMS} for pre_params in pre_params_list]
+    params = dict(pre_params_list[0], metrics=SUMMARY_METRICS, compact=True, scenarios=scenario_bank, variants=variants)
+    ensembles = run_pre_retirement_parallel(n_simulation, seed=stage_seeds(random_seed)[0], workers=workers,
+                                            variance_reduction=variance_reduction, first_shard=FIRST_SHARD_SIZE, **params)
+    return [{"ensemble": ensemble, "adaptive_summary": None} for ensemble in ensembles]
+
+
+def variant_key(inputs):
+    # Runs with the same variant key can have their ensembles simulated together: they differ at most in
+    # pre-retirement parameters that leave the draws unchanged. Adaptive runs size their own batches.
+    if inputs["adaptive"] is not None:
+        return None
+    pre_params = inputs["pre_params"]
+    return parameter_key({
+        "pre_params": {name: value for name, value in pre_params.items() if name not in VARIANT_PARAMS},
+        "funds": get_funds(pre_params["allocation_blocks"]),
+        **{name: inputs[name] for name in ("n_simulation", "random_seed", "variance_reduction", "scenario_bank")},
+    })
+
+
+def prime_batched(pipeline, runs, workers=1):
+    # Simulates the ensembles of the (inputs, state) `runs` that neither the state nor the cache has yet,
+    # together wherever their variant keys match and in groups of up to BATCHED_PATHS paths, and primes
+    # every state with its ensemble
+    groups = {}
+    for inputs, state in runs:
+        key = variant_key(inputs)
+        if key is not None and pipeline.lookup("ensemble", inputs, state) is None:
+            ensemble_key = pipeline.stage_key(pipeline.stages[0], inputs, {})
+            groups.setdefault(key, {}).setdefault(ensemble_key, []).append((inputs, state))
+    for group in groups.values():
+        members = list(group.values())
+        per_call = max(1, BATCHED_PATHS // members[0][0][0]["n_simulation"])
+        for start in range(0, len(members), per_call):
+            chunk = members[start:start + per_call]
+            inputs = chunk[0][0][0]
+            outputs = ensemble_variants([runs_of[0][0]["pre_params"] for runs_of in chunk], inputs["n_simulation"],
+                                        inputs["random_seed"], inputs["variance_reduction"], inputs["scenario_bank"], workers)
+            for runs_of, output in zip(chunk, outputs):
+                for run_inputs, state in runs_of:
+                    pipeline.prime("ensemble", run_inputs, state, output)
+
+
+def run_batched(pipeline, runs, workers=1):
+    # pipeline.run for every (inputs, state) in `runs` after prime_batched. Returns (outputs, recomputed)
+    # per run, as pipeline.run does.
+    prime_batched(pipeline, runs, workers)
+    return [pipeline.run(inputs, state, {"workers": workers}) for inputs, state in runs]
+
+
+def aggregates_stage(ensemble):
+    simulated = ensemble["ensemble"]
+    corpus_percentiles = simulated.percentiles("Adjusted Fund Value", [0.05, 0.5, 0.95])
+    final_corpuses = simulated.final("Adjusted Fund Value")
+    mean_corpus = np.mean(final_corpuses)
+    retirement_corpus_median = corpus_percentiles.loc[corpus_percentiles["Age"] == 65, "median"].squeeze()
+    return {
+        "df_pre": simulated.path_frame(0),
+        "corpus_percentiles": corpus_percentiles,
+        "total_contributions": simulated.path_sums("Total Contribution").mean(),
+        "median_age_65_spending": np.median(simulated.at_age("Total Spent", 65)),
+        "final_corpuses": final_corpuses,
+        "mean_corpus": mean_corpus,
+        "median_corpus": np.median(final_corpuses),
+        "p5": np.percentile(final_corpuses, 5),
+        "p95": np.percentile(final_corpuses, 95),
+        "corpus_at_retirement": retirement_corpus_median if pd.notna(retirement_corpus_median) else mean_corpus,
+    }
+
+
+def post_stage(post_params, spending_ratio, random_seed, variance_reduction, scenario_bank, ensemble, aggregates, workers=1):
+    _, post_seed, median_path_seed = stage_seeds(random_seed)
+    lifestyle_start = linked_lifestyle(ensemble["ensemble"], spending_ratio)
+    spending_basis = "Manual lifestyle input"
+    if lifestyle_start is not None:
+        spending_basis = f"{spending_ratio:.0%} of median modeled age-65 spending"
+    params = dict(post_params, lifestyle_at_retirement=lifestyle_start, scenarios=scenario_bank)
+    df_post = simulate_post_retirement_batch(
+        [aggregates["corpus_at_retirement"]], **params, detail_path=0, spending_basis=spending_basis, rng=median_path_seed
+    )["Table"]
+    post_batch = run_post_retirement_parallel(
+        aggregates["final_corpuses"], seed=post_seed, workers=workers, variance_reduction=variance_reduction, **params
+    )
+    return {"df_post": df_post, "post_batch": post_batch, "spending_basis": spending_basis}
+
+
+def summaries_stage(variance_reduction, ensemble, aggregates, post):
+    simulated = ensemble["ensemble"]
+    df_post = post["df_post"]
+    post_batch = post["post_batch"]
+    # The pre-retirement shadow corpus is the control for the shortfall too: ruin follows the corpus at
+    # retirement far more closely than the compounded post-retirement return, which misses the return order
+    precision = pd.DataFrame(estimate_precision(
+        aggregates["final_corpuses"],
+        variance_reduction,
+        simulated.attrs["Groups"],
+        shortfall=post_batch["Ruined"],
+        control=simulated.attrs.get("Control"),
+        control_mean=simulated.attrs.get("Control Mean"),
+    ))
+    estimates = precision.set_index("Metric")["Estimate"]
+    ruin_curve = post_batch["Percentiles"].assign(
+        **{"Survival Probability %": post_batch["Survival Probability"] * 100,
+           "Ruin Probability %": post_batch["Ruin Probability"] * 100}
+    )
+    return {
+        "precision": precision,
+        "mean_corpus": estimates["Mean Corpus at 65"],
+        "shortfall_probability": estimates["Shortfall Probability"] * 100,
+        "ruin_curve": ruin_curve,
+        **funding_summary(aggregates["corpus_at_retirement"], df_post),
+    }
+
+
+def funding_summary(corpus_at_retirement, df_post):
+    total_fund_withdrawal = df_post["Withdrawal from Fund"].sum()
+    sufficiency_score = int(min(100, 100 * corpus_at_retirement / total_fund_withdrawal)) if total_fund_withdrawal > 0 else 100
+    funding_status = "Sufficient" if sufficiency_score >= 80 and df_post["Remaining Corpus"].min() >= 0 else "At Risk"
+    return {
+        "total_fund_withdrawal": total_fund_withdrawal,
+        "sufficiency_score": sufficiency_score,
+        "funding_status": funding_status,
+    }
+
+
+RETIREMENT_STAGES = [
+    Stage("ensemble", ensemble_stage,
+          inputs=("pre_params", "n_simulation", "random_seed", "variance_reduction", "adaptive", "scenario_bank"),
+          context=("workers", "progress", "cancel"), shared=True),
+    Stage("aggregates", aggregates_stage, upstream=("ensemble",)),
+    Stage("post", post_stage,
+          inputs=("post_params", "spending_ratio", "random_seed", "variance_reduction", "scenario_bank"),
+          upstream=("ensemble", "aggregates"), context=("workers",), shared=True),
+    Stage("summaries", summaries_stage, inputs=("variance_reduction",), upstream=("ensemble", "aggregates", "post")),
+]
@@ -1,5 +1,7 @@
-import pandas as pd
 import numpy as np
+from instrumentation import phase
+from schema import compact_frame
+from variance_reduction import replicate_groups, standard_normals
 def simulate_post_retirement(
     corpus,
     start_age,
@@ -12,15 +14,17 @@ def simulate_post_retirement(
     nz_super_annuity,
     accumulation_years,
     lifestyle_at_retirement=None,
-    spending_basis="Manual lifestyle input"
+    spending_basis="Manual lifestyle input",
+    compact=False,
+    historical=None
 ):
     data = []
+    # With a HistoricalReturns, yearly returns are bootstrapped from its history instead of drawn normally
+    historical_returns = historical.returns(historical.sample(np.random, years, 1)[:, 0]) if historical is not None else None
 
-    if lifestyle_at_retirement is None:
-        adjusted_lifestyle_today = lifestyle_base_today * (1 + lifestyle_improvement_pct)
-        lifestyle_start = adjusted_lifestyle_today * ((1 + inflation) ** accumulation_years)
-    else:
-        lifestyle_start = lifestyle_at_retirement
+    lifestyle_start = retirement_lifestyle_start(
+        lifestyle_base_today, lifestyle_improvement_pct, inflation, accumulation_years, lifestyle_at_retirement
+    )
 
     nz_super_2060 = nz_super_annuity * ((1 + inflation) ** accumulation_years)
 
@@ -33,7 +37,7 @@ def simulate_post_retirement(
         withdrawal = max(0, desired_withdrawal - govt_support)
         income_surplus = max(0, govt_support - desired_withdrawal)
 
-        ret_rate = np.random.normal(return_mean, return_std)
+        ret_rate = np.random.normal(return_mean, return_std) if historical is None else historical_returns[i - 1]
         growth = opening_corpus * ret_rate
         corpus = corpus + growth - withdrawal
 
@@ -53,4 +57,137 @@ def simulate_post_retirement(
             "Spending Basis": spending_basis
         })
 
-    return pd.DataFrame(data)
+    # pandas loads with the first table, so importing the engine only loads NumPy
+    import pandas as pd
+    frame = pd.DataFrame(data)
+    return compact_frame(frame) if compact else frame
+
+
+def retirement_lifestyle_start(lifestyle_base_today, lifestyle_improvement_pct, inflation, accumulation_years,
+                               lifestyle_at_retirement=None):
+    if lifestyle_at_retirement is not None:
+        return lifestyle_at_retirement
+    adjusted_lifestyle_today = lifestyle_base_today * (1 + lifestyle_improvement_pct)
+    return adjusted_lifestyle_today * ((1 + inflation) ** accumulation_years)
+
+
+def simulate_post_retirement_batch(
+    corpuses,
+    start_age,
+    years,
+    return_mean,
+    return_std,
+    inflation,
+    lifestyle_base_today,
+    lifestyle_improvement_pct,
+    nz_super_annuity,
+    accumulation_years,
+    lifestyle_at_retirement=None,
+    spending_basis="Manual lifestyle input",
+    detail_path=None,
+    variance_reduction="none",
+    compact=False,
+    scenarios=None,
+    scenario_offset=0,
+    historical=None,
+    rng=None
+):
+    # Runs the simulate_post_retirement drawdown for every starting corpus at once.
+    # Withdrawals do not depend on the corpus, so only returns and balances are (n_sims, years).
+    # With a ScenarioBank in `scenarios`, return shocks are read from its paths starting at `scenario_offset`;
+    # with a HistoricalReturns in `historical`, returns are bootstrapped from its history.
+    rng = np.random.default_rng(rng)
+    corpuses = np.asarray(corpuses, dtype=float)
+    n = corpuses.shape[0]
+
+    lifestyle_start = retirement_lifestyle_start(
+        lifestyle_base_today, lifestyle_improvement_pct, inflation, accumulation_years, lifestyle_at_retirement
+    )
+    nz_super_2060 = nz_super_annuity * ((1 + inflation) ** accumulation_years)
+
+    year_index = np.arange(1, years + 1)
+    inflation_factor = (1 + inflation) ** (year_index - 1)
+    desired_withdrawal = lifestyle_start * inflation_factor
+    govt_support = nz_super_2060 * inflation_factor
+    withdrawal = np.maximum(0, desired_withdrawal - govt_support)
+    income_surplus = np.maximum(0, govt_support - desired_withdrawal)
+
+    with phase("post.drawdown"):
+        if historical is not None:
+            if scenarios is not None:
+                raise ValueError("Use either a scenario bank or historical returns, not both")
+            historical.check_variance_reduction(variance_reduction)
+            return_rates = historical.returns(historical.sample(rng, years, n))
+        else:
+            if scenarios is None:
+                shocks = standard_normals(rng, n, years, variance_reduction)
+            else:
+                scenarios.check_variance_reduction(variance_reduction)
+                shocks = scenarios.post_shocks(years, scenario_offset, n)
+            return_rates = return_mean + return_std * shocks
+        opening_corpus = np.empty((n, years), order='F')
+        remaining_corpus = np.empty((n, years), order='F')
+        corpus = corpuses.copy()
+        for t in range(years):
+            opening_corpus[:, t] = corpus
+            corpus = corpus + corpus * return_rates[t] - withdrawal[t]
+            remaining_corpus[:, t] = corpus
+
+    results = {
+        "Age": start_age + year_index - 1,
+        "Target Lifestyle Spending": desired_withdrawal,
+        "Govt Support (NZ Super)": govt_support,
+        "Withdrawal from Fund": withdrawal,
+        "Income Surplus": income_surplus,
+        "Opening Corpus": opening_corpus,
+        "Annual Return Rate": return_rates.T,
+        "Remaining Corpus": remaining_corpus,
+        "Groups": replicate_groups(n, variance_reduction),
+    }
+    with phase("post.records"):
+        results.update(drawdown_statistics(results["Age"], remaining_corpus))
+        if detail_path is not None:
+            results["Table"] = post_retirement_frame(results, detail_path, spending_basis, compact)
+    return results
+
+
+def drawdown_statistics(ages, remaining_corpus):
+    import pandas as pd
+    n, years = remaining_corpus.shape
+    # A path is ruined from the first year its balance drops below zero
+    ruined = np.logical_or.accumulate(remaining_corpus < 0, axis=1)
+    ruin_probability = ruined.mean(axis=0) if n else np.zeros(years)
+    bands = np.quantile(remaining_corpus, [0.05, 0.5, 0.95], axis=0) if n else np.full((3, years), np.nan)
+    return {
+        "Ruined": ruined[:, -1] if years else np.zeros(n, dtype=bool),
+        "Ruin Probability": ruin_probability,
+        "Survival Probability": 1 - ruin_probability,
+        "Percentiles": pd.DataFrame({"Age": ages, "p5": bands[0], "median": bands[1], "p95": bands[2]}),
+    }
+
+
+def post_retirement_frame(results, path=0, spending_basis="Manual lifestyle input", compact=False):
+    # Rebuilds the simulate_post_retirement table for a single path of a batch result.
+    import pandas as pd
+    opening_corpus = results["Opening Corpus"][path]
+    desired_withdrawal = results["Target Lifestyle Spending"]
+    withdrawal = results["Withdrawal from Fund"]
+    return_rate = results["Annual Return Rate"][path]
+    positive = opening_corpus > 0
+    safe_opening = np.where(positive, opening_corpus, 1)
+    frame = pd.DataFrame({
+        "Post-Retirement Year": np.arange(1, len(opening_corpus) + 1),
+        "Age": results["Age"],
+        "Opening Corpus": np.round(opening_corpus, 2),
+        "Target Lifestyle Spending": np.round(desired_withdrawal, 2),
+        "Target Spending % of Corpus": np.where(positive, np.round(desired_withdrawal / safe_opening * 100, 2), 0),
+        "Govt Support (NZ Super)": np.round(results["Govt Support (NZ Super)"], 2),
+        "Withdrawal from Fund": np.round(withdrawal, 2),
+        "Withdrawal % of Corpus": np.where(positive, np.round(withdrawal / safe_opening * 100, 2), 0),
+        "Income Surplus": np.round(results["Income Surplus"], 2),
+        "Annual Return Rate (%)": np.round(return_rate * 100, 2),
+        "Growth (NZD)": np.round(opening_corpus * return_rate, 2),
+        "Remaining Corpus": np.round(results["Remaining Corpus"][path], 2),
+        "Spending Basis": spending_basis,
+    })
+    return compact_frame(frame) if compact else frame
@@ -1,6 +1,18 @@
-import pandas as pd
 import numpy as np
 import random
+from ensemble import EnsembleResult
+from instrumentation import phase
+from kernels import fund_recurrence
+from schema import MONEY_DTYPE, compact_frame
+from tax import NZ_TAX_RATES, TaxTable
+from variance_reduction import replicate_groups, standard_normals
+
+# Table columns that are labels, flags or counters rather than money, so they are not rounded
+UNROUNDED_COLUMNS = {"Year", "Age", "Partner Status", "Children Status", "Owns Home"}
+# Foreign equities return (1 + base) * (1 + currency) - 1: a base equity return with a currency overlay
+FOREIGN_BASE_RETURN = {"mean": 0.12, "std": 0.15}
+CURRENCY_RETURN = {"mean": 0.03, "std": 0.02}
+
 
 # --- SUPPORTING FUNCTIONS ---
 def get_allocation(year, allocation_blocks):
@@ -9,8 +21,7 @@ def get_allocation(year, allocation_blocks):
             return block['weights']
     return allocation_blocks[-1]['weights']
 
-def calculate_tax(salary, brackets, year, inflation=0.025):
-    tax_rates = [0.105, 0.175, 0.30, 0.33, 0.39]
+def calculate_tax(salary, brackets, year, inflation=0.025, tax_rates=NZ_TAX_RATES):
     adjusted = [(b[0]*(1+inflation)**(year-1), b[1]*(1+inflation)**(year-1), r)
                 for b, r in zip(brackets, tax_rates)]
     tax = 0
@@ -27,7 +38,11 @@ def simulate_pre_retirement(initial_salary, hike_rate_mean, hike_rate_std, contr
                                    lump_sum_amount, lump_sum_frequency, start_lump_sum_year, years,
                                    start_age, acc_levy, inflation_rate, marginal_tax_rate, tax_brackets, growth_rates,
                                    allocation_blocks, has_partner='Auto', partner_contribution_perc = 'Auto', has_children='Auto', invested_real_estate='Auto',
-                                   double_promotion_year=None, unforeseen_withdrawal_years=None):
+                                   double_promotion_year=None, unforeseen_withdrawal_years=None, tax_rates=NZ_TAX_RATES,
+                                   glide_path=False, metrics=None, compact=False, historical=None):
+    # `metrics` returns just those columns as {column: per-year array} without building the table;
+    # `compact` returns the table in the compact schema (see schema.py).
+    # `historical` (a HistoricalReturns) bootstraps every fund's yearly return from its history.
 
     # --- Handle user-specified or probabilistic life events ---
     if has_partner == 'Auto':
@@ -77,12 +92,28 @@ def simulate_pre_retirement(initial_salary, hike_rate_mean, hike_rate_std, contr
     prev_salary = None
     owns_home = False
     expense_base_amounts = None
+    # Bootstrapped history years for every year, drawn from the global stream up front
+    historical_years = historical.sample(np.random, years, 1)[:, 0] if historical is not None else None
 
     child_start_age = start_age + child_year - 1
     child_duration = 18
     base_child_cost = 12000
     child_expenses = []
 
+    # Allocation schedule and column names are resolved once rather than every year
+    funds = get_funds(allocation_blocks)
+    if glide_path:
+        yearly_allocations = [dict(zip(funds, row)) for row in allocation_matrix(allocation_blocks, years, funds, True).tolist()]
+    else:
+        yearly_allocations = [get_allocation(year, allocation_blocks) for year in range(1, years + 1)]
+    contribution_names = {fund: f"{fund} Contribution" for fund in funds}
+    return_names = {fund: f"{fund} Return" for fund in funds}
+    if metrics is not None:
+        unknown = set(metrics) - set(pre_retirement_columns(funds))
+        if unknown:
+            raise ValueError(f"Unknown pre-retirement metrics: {sorted(unknown)}")
+        summary = {metric: [] for metric in metrics}
+
     records = []
 
     for year in range(1, years + 1):
@@ -96,7 +127,7 @@ def simulate_pre_retirement(initial_salary, hike_rate_mean, hike_rate_std, contr
             salary *= 2
             promotion_bonus = 10000
 
-        tax = calculate_tax(salary, tax_brackets, year, inflation_rate)
+        tax = calculate_tax(salary, tax_brackets, year, inflation_rate, tax_rates)
         acc = acc_levy * salary
         net_salary = salary - tax - acc
 
@@ -144,28 +175,31 @@ def simulate_pre_retirement(initial_salary, hike_rate_mean, hike_rate_std, contr
             corpus -= withdrawal
             current_record_withdrawal = withdrawal
 
-        allocation = get_allocation(year, allocation_blocks)
+        allocation = yearly_allocations[year - 1]
         total_growth = 0
         fund_returns = {}
         fund_contributions = {}
         foreign_weight = allocation.get("Foreign_Equities", 0)
         foreign_contrib = total_contrib * foreign_weight
 
-        base_g = np.random.normal(0.12, 0.15)
-        currency_g = np.random.normal(0.03, 0.02)
-        foreign_return_rate = (1 + base_g) * (1 + currency_g) - 1
+        if historical is None:
+            base_g = np.random.normal(FOREIGN_BASE_RETURN["mean"], FOREIGN_BASE_RETURN["std"])
+            currency_g = np.random.normal(CURRENCY_RETURN["mean"], CURRENCY_RETURN["std"])
+            foreign_return_rate = (1 + base_g) * (1 + currency_g) - 1
+        else:
+            foreign_return_rate = historical.returns(historical_years[year - 1], "Foreign_Equities")
         foreign_return = foreign_corpus * foreign_return_rate
         foreign_corpus += foreign_contrib + foreign_return
 
         for fund, weight in allocation.items():
-            g = np.random.normal(growth_rates[fund]["mean"], growth_rates[fund]["std"])
+            g = np.random.normal(growth_rates[fund]["mean"], growth_rates[fund]["std"]) if historical is None else historical.returns(historical_years[year - 1], fund)
             if fund == "Foreign_Equities":
                 g = foreign_return_rate
             contrib_val = total_contrib * weight
-            fund_contributions[f"{fund} Contribution"] = round(contrib_val, 2)
+            fund_contributions[contribution_names[fund]] = contrib_val
             r = corpus * weight * g + contrib_val * 0.5
             total_growth += r
-            fund_returns[f"{fund} Return"] = round(r, 2)
+            fund_returns[return_names[fund]] = r
 
         fif_tax = foreign_corpus * 0.05 * marginal_tax_rate if foreign_corpus > 50000 else 0
         fif_tax_percent = (fif_tax / foreign_corpus * 100) if foreign_corpus > 0 else 0
@@ -205,45 +239,476 @@ def simulate_pre_retirement(initial_salary, hike_rate_mean, hike_rate_std, contr
         total_spent = rent + groceries + travel + utilities + insurance + leisure + misc + child_exp
 
 
-        records.append({
-            
+        row = {
             "Year": year,
             "Age": age,
-            "Gross Salary": round(salary, 2),
-            "Salary Hike Value": round(salary_change_value, 2),
-            "Salary Hike %": round(salary_change_percent, 2),
-            "Income Tax": round(tax, 2),
-            "ACC Levy": round(acc, 2),
-            "Net Salary": round(net_salary, 2),
-            "Employee Contribution Rate %": round(contrib_rate * 100, 2),
-            "Employer Contribution Rate %": round(min(0.03, contrib_rate) * 100, 2),
-            "Employee Contribution": round(emp_contrib, 2),
-            "Employer Contribution": round(employer_contrib, 2),
-            "Total Contribution": round(total_contrib, 2),
-            "Lump Sum Added": round(lump_sum, 2),
-            "Foreign Corpus": round(foreign_corpus, 2),
-            "Foreign Return Rate": round(foreign_return_rate * 100, 2),
-            "FIF Tax (NZD)": round(fif_tax, 2),
-            "FIF Tax % of Foreign Value": round(fif_tax_percent, 2),
+            "Gross Salary": salary,
+            "Salary Hike Value": salary_change_value,
+            "Salary Hike %": salary_change_percent,
+            "Income Tax": tax,
+            "ACC Levy": acc,
+            "Net Salary": net_salary,
+            "Employee Contribution Rate %": contrib_rate * 100,
+            "Employer Contribution Rate %": min(0.03, contrib_rate) * 100,
+            "Employee Contribution": emp_contrib,
+            "Employer Contribution": employer_contrib,
+            "Total Contribution": total_contrib,
+            "Lump Sum Added": lump_sum,
+            "Foreign Corpus": foreign_corpus,
+            "Foreign Return Rate": foreign_return_rate * 100,
+            "FIF Tax (NZD)": fif_tax,
+            "FIF Tax % of Foreign Value": fif_tax_percent,
             **fund_contributions,
             **fund_returns,
-            "Rent": round(rent, 2),
-            "Groceries": round(groceries, 2),
-            "Travel": round(travel, 2),
-            "Utilities": round(utilities, 2),
-            "Insurance": round(insurance, 2),
-            "Leisure": round(leisure, 2),
-            "Misc": round(misc, 2),
-            "Total Spent": round(total_spent, 2),
+            "Rent": rent,
+            "Groceries": groceries,
+            "Travel": travel,
+            "Utilities": utilities,
+            "Insurance": insurance,
+            "Leisure": leisure,
+            "Misc": misc,
+            "Total Spent": total_spent,
             "Partner Status": partner_status[year - 1],
             "Children Status": child_status[year - 1],
             "Owns Home": owns_home,
-            "Unforeseen Withdrawal": round(current_record_withdrawal, 2) if 'current_record_withdrawal' in locals() else 0,
-            "Requested Withdrawal": round(requested_withdrawal, 2) if 'requested_withdrawal' in locals() else 0,
-            "Withdrawal Shortfall": round(requested_withdrawal - current_record_withdrawal, 2) if 'requested_withdrawal' in locals() else 0,
-            "Adjusted Fund Value": round(corpus, 2)
-        })
+            "Unforeseen Withdrawal": current_record_withdrawal,
+            "Requested Withdrawal": requested_withdrawal,
+            "Withdrawal Shortfall": requested_withdrawal - current_record_withdrawal,
+            "Adjusted Fund Value": corpus,
+        }
+        if metrics is None:
+            records.append({
+                column: value if column in UNROUNDED_COLUMNS else round(value, 2) for column, value in row.items()
+            })
+        else:
+            for metric in metrics:
+                summary[metric].append(row[metric])
 
         salary *= (1 + np.random.normal(hike_rate_mean, hike_rate_std))
 
-    return pd.DataFrame(records)
+    if metrics is not None:
+        return {metric: np.array(values) for metric, values in summary.items()}
+    # pandas loads with the first table, so importing the engine only loads NumPy
+    import pandas as pd
+    frame = pd.DataFrame(records)
+    return compact_frame(frame) if compact else frame
+
+
+# --- BATCH ENGINE ---
+EXPENSE_CATEGORIES = ["Rent", "Groceries", "Travel", "Utilities", "Insurance", "Leisure", "Misc"]
+
+
+def get_funds(allocation_blocks):
+    funds = []
+    for block in allocation_blocks:
+        for fund in block['weights']:
+            if fund not in funds:
+                funds.append(fund)
+    return funds
+
+
+def allocation_matrix(allocation_blocks, years, funds=None, glide_path=False):
+    # (years, n_funds) weights in a fixed fund order, compiled once instead of scanning the blocks every year.
+    # With glide_path the weights move linearly from one block end to the next instead of stepping.
+    funds = get_funds(allocation_blocks) if funds is None else funds
+    ends = np.array([block["end"] for block in allocation_blocks], dtype=float)
+    anchors = np.array([[block["weights"].get(fund, 0.0) for fund in funds] for block in allocation_blocks], dtype=float)
+    year_index = np.arange(1, years + 1)
+    if glide_path:
+        return np.column_stack([np.interp(year_index, ends, anchors[:, i]) for i in range(len(funds))])
+    block = np.minimum(np.searchsorted(ends, year_index, side="left"), len(allocation_blocks) - 1)
+    return anchors[block]
+
+
+def pre_retirement_columns(funds):
+    return (
+        ["Year", "Age", "Gross Salary", "Salary Hike Value", "Salary Hike %", "Income Tax", "ACC Levy",
+         "Net Salary", "Employee Contribution Rate %", "Employer Contribution Rate %", "Employee Contribution",
+         "Employer Contribution", "Total Contribution", "Lump Sum Added", "Foreign Corpus", "Foreign Return Rate",
+         "FIF Tax (NZD)", "FIF Tax % of Foreign Value"]
+        + [f"{fund} Contribution" for fund in funds]
+        + [f"{fund} Return" for fund in funds]
+        + EXPENSE_CATEGORIES
+        + ["Total Spent", "Partner Status", "Children Status", "Owns Home", "Unforeseen Withdrawal",
+           "Requested Withdrawal", "Withdrawal Shortfall", "Adjusted Fund Value"]
+    )
+
+
+# Columns that only depend on the year are stored once as (years,) arrays.
+YEARLY_COLUMNS = {"Year", "Age", "Employee Contribution Rate %", "Employer Contribution Rate %", "Lump Sum Added"}
+BOOL_COLUMNS = {"Partner Status", "Children Status", "Owns Home"}
+# Inputs that do not change which random numbers are drawn, so several values of them can be evaluated on
+# one set of draws (see `variants` in simulate_pre_retirement_batch)
+VARIANT_PARAMS = ("initial_salary", "hike_rate_mean", "hike_rate_std", "contribution_start", "contribution_increase_years",
+                  "contribution_increase_amount", "contribution_max", "lump_sum_amount", "allocation_blocks", "glide_path")
+
+
+def simulate_pre_retirement_batch(n_sims, initial_salary, hike_rate_mean, hike_rate_std, contribution_start,
+                                  contribution_increase_years, contribution_increase_amount, contribution_max,
+                                  lump_sum_amount, lump_sum_frequency, start_lump_sum_year, years,
+                                  start_age, acc_levy, inflation_rate, marginal_tax_rate, tax_brackets, growth_rates,
+                                  allocation_blocks, has_partner='Auto', partner_contribution_perc='Auto', has_children='Auto',
+                                  invested_real_estate='Auto', double_promotion_year=None, unforeseen_withdrawal_years=None,
+                                  tax_rates=NZ_TAX_RATES, glide_path=False, metrics=None, detail_paths=1,
+                                  variance_reduction="none", compact=False, scenarios=None, scenario_offset=0,
+                                  historical=None, kernel=None, variants=None, rng=None):
+    # Same cashflow rules as simulate_pre_retirement, evaluated for n_sims paths at once.
+    # `metrics` limits which columns are kept for every path; all columns are kept for the first
+    # `detail_paths` paths so their full table can still be displayed.
+    # `variance_reduction` selects how market return shocks are sampled (see variance_reduction.py).
+    # `glide_path` interpolates the allocation between block ends instead of stepping at each end.
+    # `compact` stores the kept per-path money columns as float32, halving their memory.
+    # `scenarios` is a ScenarioBank: market shocks are read from its paths starting at `scenario_offset`
+    # instead of being drawn, so runs over the same bank see the same markets.
+    # `historical` (a HistoricalReturns) bootstraps every fund's yearly return from its history instead.
+    # `kernel` picks the backend of the fund balance recurrence (see kernels.py); every backend gives the same paths.
+    # `variants` is a list of overrides of VARIANT_PARAMS evaluated on the same draws, returning one result per
+    # variant, each the same as a run with those parameters and this `rng`. The variant axis is folded into
+    # the path axis (column j * n_sims + i is path i of variant j), so every step runs over all variants at
+    # once. Variant allocations can only use the base allocation's funds, and no detail paths are kept.
+    rng = np.random.default_rng(rng)
+    n = n_sims
+    funds = get_funds(allocation_blocks)
+    columns = pre_retirement_columns(funds)
+    keep = set(columns) if metrics is None else set(metrics) | YEARLY_COLUMNS
+    unknown = keep - set(columns)
+    if unknown:
+        raise ValueError(f"Unknown pre-retirement metrics: {sorted(unknown)}")
+
+    base_values = dict(initial_salary=initial_salary, hike_rate_mean=hike_rate_mean, hike_rate_std=hike_rate_std,
+                       contribution_start=contribution_start, contribution_increase_years=contribution_increase_years,
+                       contribution_increase_amount=contribution_increase_amount, contribution_max=contribution_max,
+                       lump_sum_amount=lump_sum_amount, allocation_blocks=allocation_blocks, glide_path=glide_path)
+    set_params = [dict(base_values, **variant) for variant in variants] if variants is not None else [base_values]
+    unknown = set().union(*set_params) - set(VARIANT_PARAMS)
+    if unknown:
+        raise ValueError(f"Parameters that cannot vary over one set of draws: {sorted(unknown)}")
+    if any(not set(get_funds(params["allocation_blocks"])) <= set(funds) for params in set_params):
+        raise ValueError("Variant allocations can only use the funds of the base allocation")
+    k = len(set_params)
+    m = k * n
+    if variants is not None:
+        detail_paths = 0
+
+    def per_set(name):
+        return np.array([params[name] for params in set_params])
+
+    def per_variant(op, values, factors):
+        # op(values, factors) for (years, m) values and (k, years) or (k, 1) factors, each variant's row
+        # applied to its own paths through a (years, k, n) view instead of repeating it for every path
+        if k == 1:
+            return op(values, factors[0][:, None])
+        return op(values.reshape(len(values), k, n), factors.T[:, :, None]).reshape(len(values), m)
+
+    year_index = np.arange(1, years + 1)
+    set_weights = np.array([allocation_matrix(params["allocation_blocks"], years, funds, params["glide_path"])
+                            for params in set_params])
+    # (years, funds, k) as the recurrence kernel takes them
+    weights = np.ascontiguousarray(set_weights.transpose(1, 2, 0))
+
+    # --- Life events ---
+    with phase("pre.draws"):
+        if has_partner == 'Auto':
+            # First success of a 40% yearly chance over years 1-5, defaulting to year 5
+            partner_year = np.minimum(rng.geometric(0.4, size=n), 5)
+        else:
+            partner_year = np.full(n, 1 if has_partner == "Yes" else years + 1)
+
+        if has_children == 'Auto':
+            child_year = partner_year + 1
+        else:
+            child_year = np.full(n, 1 if has_children == "Yes" else years + 1)
+
+        if invested_real_estate == 'Auto':
+            home_buy_year = rng.integers(6, 12, size=n)
+        else:
+            home_buy_year = np.full(n, 10 if invested_real_estate == "Yes" else years + 1)
+
+        # Everything is laid out (years, n_sims): each year is a contiguous row, and the transpose of a
+        # finished matrix is the Fortran-ordered (n_sims, years) column EnsembleResult stores.
+        partner_status = year_index[:, None] >= partner_year
+        child_status = year_index[:, None] >= child_year
+        buying_home = year_index[:, None] == home_buy_year
+        owns_home = year_index[:, None] >= home_buy_year
+
+        child_offset = year_index[:, None] - child_year
+        child_expenses = np.where((child_offset >= 0) & (child_offset < 18),
+                                  12000 * (1 + inflation_rate) ** np.maximum(child_offset, 0), 0.0)
+
+        # --- Bulk random draws ---
+        # Drawn standard and scaled afterwards, which gives the same numbers as rng.normal(mean, std)
+        hike_shocks = rng.standard_normal((years, n))
+        child_costs = np.zeros((years, n))
+        child_costs[child_status] = rng.poisson(1500, size=np.count_nonzero(child_status))
+        market_funds = [fund for fund in funds if fund != "Foreign_Equities"]
+        shock_names = ["Foreign_Base", "Currency"] + market_funds
+        if historical is not None:
+            if scenarios is not None:
+                raise ValueError("Use either a scenario bank or historical returns, not both")
+            historical.check_variance_reduction(variance_reduction)
+            shocks = None
+        elif scenarios is None:
+            shocks = standard_normals(rng, n, years * len(shock_names), variance_reduction)
+            shocks = dict(zip(shock_names, shocks.reshape(len(shock_names), years, n)))
+        else:
+            scenarios.check_variance_reduction(variance_reduction)
+            shocks = {name: scenarios.pre_shocks(name, years, scenario_offset, n) for name in shock_names}
+        if historical is not None:
+            # One bootstrapped history year per year and path, shared by every fund
+            historical_years = historical.sample(rng, years, n)
+            foreign_return_rates = historical.returns(historical_years, "Foreign_Equities")
+        else:
+            foreign_return_rates = (
+                (1 + (FOREIGN_BASE_RETURN["mean"] + FOREIGN_BASE_RETURN["std"] * shocks["Foreign_Base"]))
+                * (1 + (CURRENCY_RETURN["mean"] + CURRENCY_RETURN["std"] * shocks["Currency"])) - 1
+            )
+        fund_g = np.empty((len(funds), years, n))
+        for i, fund in enumerate(funds):
+            if historical is not None:
+                fund_g[i] = historical.returns(historical_years, fund)
+            elif fund == "Foreign_Equities":
+                fund_g[i] = foreign_return_rates
+            else:
+                fund_g[i] = growth_rates[fund]["mean"] + growth_rates[fund]["std"] * shocks[fund]
+        del shocks
+
+        requested_withdrawal = np.zeros((years, n))
+        withdrawal_years = [year for year in range(1, years + 1) if unforeseen_withdrawal_years and year in unforeseen_withdrawal_years]
+        for year in withdrawal_years:
+            if isinstance(unforeseen_withdrawal_years, dict):
+                requested_withdrawal[year - 1] = float(unforeseen_withdrawal_years[year])
+            else:
+                requested_withdrawal[year - 1] = rng.integers(10000, 20000, size=n)
+
+        if k > 1:
+            # Every variant sees the same draws
+            (partner_status, child_status, buying_home, owns_home, child_expenses, hike_shocks, child_costs,
+             foreign_return_rates, requested_withdrawal, fund_g) = (
+                np.tile(values, k) for values in (partner_status, child_status, buying_home, owns_home, child_expenses,
+                                                  hike_shocks, child_costs, foreign_return_rates, requested_withdrawal, fund_g))
+        hikes = per_variant(np.add, per_variant(np.multiply, hike_shocks, per_set("hike_rate_std")[:, None]),
+                            per_set("hike_rate_mean")[:, None])
+        del hike_shocks
+
+    results = {}
+    detail = {}
+    # Yearly columns that differ between variants, as (k, years)
+    set_yearly = {}
+    detail_paths = min(detail_paths, n)
+
+    def wanted(*names):
+        # Paths a column has to be computed for: all of them, the detail paths, or none
+        if any(name in keep for name in names):
+            return slice(None)
+        return slice(0, detail_paths) if detail_paths else None
+
+    def width(paths):
+        return m if paths == slice(None) else detail_paths
+
+    def store(column, values):
+        # values: (years, paths) matrix covering at least wanted(column)
+        if column in keep:
+            money_dtype = MONEY_DTYPE if compact else float
+            results[column] = np.asarray(values, dtype=bool if column in BOOL_COLUMNS else money_dtype).T
+        elif detail_paths:
+            detail[column] = np.array(values[:, :detail_paths].T, dtype=bool if column in BOOL_COLUMNS else float)
+
+    # --- Salary and contributions, which do not depend on the fund balance ---
+    with phase("pre.tax"):
+        salary = np.empty((years, m))
+        current = np.repeat(per_set("initial_salary").astype(float), n)
+        for t, year in enumerate(year_index):
+            if double_promotion_year is not None and year == double_promotion_year:
+                current = current * 2
+            salary[t] = current
+            current = current * (1 + hikes[t])
+        del hikes
+
+        tax_table = TaxTable(tax_brackets, years, inflation_rate, tax_rates)
+        tax = np.empty((years, m))
+        for t, year in enumerate(year_index):
+            tax[t] = tax_table.tax(salary[t], year)
+        acc = acc_levy * salary
+        net_salary = salary - tax - acc
+
+    with phase("pre.contributions"):
+        contrib_rate = np.array([[
+            min(params["contribution_start"] + ((year - 1) // params["contribution_increase_years"]) * params["contribution_increase_amount"],
+                params["contribution_max"])
+            for year in range(1, years + 1)
+        ] for params in set_params])
+        employer_rate = np.minimum(0.03, contrib_rate)
+        emp_contrib = per_variant(np.multiply, net_salary, contrib_rate)
+        employer_contrib = per_variant(np.multiply, net_salary, employer_rate)
+        total_contrib = emp_contrib + employer_contrib
+
+        lump_sum_years = (year_index >= start_lump_sum_year) & ((year_index - start_lump_sum_year + 1) % lump_sum_frequency == 0)
+        lump_sum = np.array([np.where(lump_sum_years, float(amount), 0.0) for amount in per_set("lump_sum_amount")])
+        promotion_bonus = np.where(year_index == double_promotion_year, 10000.0, 0.0) if double_promotion_year is not None else np.zeros(years)
+        total_contrib = per_variant(np.add, total_contrib, lump_sum)
+        total_contrib = total_contrib + promotion_bonus[:, None]
+        if partner_status.any():
+            total_contrib = total_contrib + np.where(partner_status, salary * partner_contribution_perc, 0)
+
+        net_salary = net_salary - child_costs
+        total_contrib = np.where(child_status, np.maximum(0, total_contrib - child_costs * 0.1), total_contrib)
+        del child_costs
+
+        results["Year"] = year_index.astype(float)
+        results["Age"] = (start_age + year_index - 1).astype(float)
+        set_yearly["Employee Contribution Rate %"] = contrib_rate * 100
+        set_yearly["Employer Contribution Rate %"] = employer_rate * 100
+        set_yearly["Lump Sum Added"] = lump_sum + promotion_bonus
+        store("Gross Salary", salary)
+        hike_paths = wanted("Salary Hike Value", "Salary Hike %")
+        if hike_paths is not None:
+            path_salary = salary[:, hike_paths]
+            salary_change_value = np.zeros(path_salary.shape)
+            salary_change_value[1:] = path_salary[1:] - path_salary[:-1]
+            salary_change_percent = np.zeros(path_salary.shape)
+            np.divide(salary_change_value[1:] * 100, path_salary[:-1], out=salary_change_percent[1:], where=path_salary[:-1] != 0)
+            store("Salary Hike Value", salary_change_value)
+            store("Salary Hike %", salary_change_percent)
+        store("Income Tax", tax)
+        store("ACC Levy", acc)
+        store("Net Salary", net_salary)
+        store("Employee Contribution", emp_contrib)
+        store("Employer Contribution", employer_contrib)
+        store("Total Contribution", total_contrib)
+    del tax, acc, emp_contrib, employer_contrib
+
+    # --- Expenses ---
+    with phase("pre.expenses"):
+        expense_paths = wanted(*EXPENSE_CATEGORIES, "Total Spent")
+        if expense_paths is not None:
+            expense_rates = {
+                "Rent": 0.25,
+                "Groceries": 0.15,
+                "Travel": 0.10,
+                "Utilities": 0.05,
+                "Insurance": 0.05,
+                "Leisure": 0.10,
+                "Misc": 0.05,
+            }
+            inflation_factor = np.array([(1 + inflation_rate) ** (year - 1) for year in range(1, years + 1)])
+            # Rent only applies until the home is bought, so its upgrades follow one schedule for every renter
+            rent_multiplier = np.ones(years)
+            lifestyle_multiplier = np.ones(years)
+            rent, lifestyle = 1.0, 1.0
+            for t, year in enumerate(year_index):
+                if year % 2 == 0:
+                    rent *= (1 + 0.10)
+                if year % 5 == 0:
+                    rent *= (1 + 0.15)
+                    lifestyle *= (1 + 0.12)
+                rent_multiplier[t] = rent
+                lifestyle_multiplier[t] = lifestyle
+
+            # Filled in place: fresh (years, n_sims) temporaries per category cost more than the arithmetic
+            first_net_salary = net_salary[0, expense_paths]
+            total_spent = np.zeros((years, len(first_net_salary)))
+            scratch = np.empty_like(total_spent)
+            for category, rate in expense_rates.items():
+                value = scratch if wanted(category) is None else np.empty_like(total_spent)
+                np.multiply(first_net_salary * rate, inflation_factor[:, None], out=value)
+                if category == "Rent":
+                    value *= rent_multiplier[:, None]
+                    value[owns_home[:, expense_paths]] = 0
+                else:
+                    value *= lifestyle_multiplier[:, None]
+                store(category, value)
+                total_spent += value
+            total_spent += child_expenses[:, expense_paths]
+            store("Total Spent", total_spent)
+
+    store("Partner Status", partner_status)
+    store("Children Status", child_status)
+    store("Owns Home", owns_home)
+    del salary, net_salary
+
+    # --- Fund balance recurrence ---
+    with phase("pre.returns"):
+        foreign_index = funds.index("Foreign_Equities") if "Foreign_Equities" in funds else None
+        foreign_contrib = (per_variant(np.multiply, total_contrib, set_weights[:, :, foreign_index]) if foreign_index is not None
+                           else total_contrib * 0)
+        use_control = variance_reduction == "control_variate"
+        # Control variate: a shadow corpus fed the cross-path mean contribution and the same returns.
+        # Its expectation is the deterministic mean-return corpus, since returns are independent of contributions.
+        foreign_mean = (1 + FOREIGN_BASE_RETURN["mean"]) * (1 + CURRENCY_RETURN["mean"]) - 1
+        if scenarios is not None:
+            # Correlated base and currency shocks add their covariance to the expected product
+            foreign_mean += scenarios.correlation("Foreign_Base", "Currency") * FOREIGN_BASE_RETURN["std"] * CURRENCY_RETURN["std"]
+        mean_returns = np.array([
+            foreign_mean if fund == "Foreign_Equities" else growth_rates[fund]["mean"] for fund in funds
+        ])
+        control = np.zeros(m)
+        control_mean = np.zeros(k)
+        if use_control:
+            for t in range(years):
+                portfolio_return = (weights[t][:, :, None] * fund_g[:, t].reshape(len(funds), k, n)).sum(axis=0).reshape(m)
+                # Each variant's shadow corpus gets the mean contribution over its own paths
+                shadow_contrib = np.array([total_contrib[t, j * n:(j + 1) * n].mean() * (1 + 0.5 * sum(set_weights[j, t]))
+                                           for j in range(k)])
+                control = control * (1 + portfolio_return) + np.repeat(shadow_contrib, n)
+                control_mean = control_mean * (1 + np.array([sum(set_weights[j, t] * mean_returns) for j in range(k)])) + shadow_contrib
+
+        # Balances recorded year by year, sized for the paths that need them (derived columns included)
+        tracked = {}
+        for column, dependents in (("Foreign Corpus", ["FIF Tax % of Foreign Value"]),
+                                   ("FIF Tax (NZD)", ["FIF Tax % of Foreign Value"]),
+                                   ("Unforeseen Withdrawal", ["Withdrawal Shortfall"]),
+                                   ("Adjusted Fund Value", [])):
+            paths = wanted(column, *dependents)
+            tracked[column] = np.zeros((years, width(paths) if paths is not None else 0))
+        return_paths = wanted(*[f"{fund} Return" for fund in funds])
+        fund_returns = np.zeros((len(funds), years, width(return_paths) if return_paths is not None else 0))
+
+        # The corpus depends on its own history (withdrawals are capped at the balance, FIF tax applies
+        # above a threshold), so this part runs year by year
+        withdrawal_flags = np.isin(year_index, withdrawal_years)
+        fund_recurrence(buying_home, withdrawal_flags, requested_withdrawal, foreign_contrib, foreign_return_rates,
+                        weights, fund_g, total_contrib, marginal_tax_rate, tracked["Adjusted Fund Value"],
+                        tracked["Foreign Corpus"], tracked["FIF Tax (NZD)"], tracked["Unforeseen Withdrawal"],
+                        fund_returns, backend=kernel)
+        tracked = {column: values for column, values in tracked.items() if values.shape[1]}
+
+    with phase("pre.records"):
+        for column, values in tracked.items():
+            store(column, values)
+        rate_paths = wanted("Foreign Return Rate")
+        if rate_paths is not None:
+            store("Foreign Return Rate", foreign_return_rates[:, rate_paths] * 100)
+        if wanted("FIF Tax % of Foreign Value") is not None:
+            foreign_values, fif_values = tracked["Foreign Corpus"], tracked["FIF Tax (NZD)"]
+            store("FIF Tax % of Foreign Value", np.divide(fif_values * 100, foreign_values,
+                                                         out=np.zeros_like(foreign_values), where=foreign_values > 0))
+        store("Requested Withdrawal", requested_withdrawal)
+        if wanted("Withdrawal Shortfall") is not None:
+            withdrawn = tracked["Unforeseen Withdrawal"]
+            store("Withdrawal Shortfall", requested_withdrawal[:, :withdrawn.shape[1]] - withdrawn)
+        for i, fund in enumerate(funds):
+            # Fund contributions are one broadcast multiply over all years and paths
+            column = f"{fund} Contribution"
+            paths = wanted(column)
+            if paths is not None:
+                store(column, per_variant(np.multiply, total_contrib[:, paths], set_weights[:, :, i]))
+            if return_paths is not None:
+                store(f"{fund} Return", fund_returns[i])
+
+        detail = {column: detail[column] for column in columns if column in detail}
+        ensembles = []
+        for j in range(k):
+            # Each variant's rows of the per-path arrays, as views
+            paths = slice(j * n, (j + 1) * n)
+            arrays = {}
+            for column in columns:
+                if column in set_yearly:
+                    arrays[column] = set_yearly[column][j]
+                elif column in results:
+                    arrays[column] = results[column] if results[column].ndim == 1 else results[column][paths]
+            attrs = {"Variance Reduction": variance_reduction, "Groups": replicate_groups(n, variance_reduction)}
+            if use_control:
+                attrs["Control"] = control[paths]
+                attrs["Control Mean"] = np.full(n, control_mean[j])
+            ensembles.append(EnsembleResult(n, arrays, columns, detail, attrs))
+        return ensembles if variants is not None else ensembles[0]
@@ -0,0 +1,175 @@
+import json
+import numpy as np
+import pandas as pd
+from historical import DEFAULT_BLOCK_LENGTH, HistoricalReturns
+from tax import NZ_TAX_BRACKETS
+
+# Model assumptions shared by the dashboard, the batch runner and the benchmarks
+FUND_GROWTH_RATES = {
+    "Harboursafe": {"mean": 0.0375, "std": 0.05},
+    "Horizon": {"mean": 0.065, "std": 0.105},
+    "SkyHigh": {"mean": 0.1025, "std": 0.2075},
+    "Foreign_Equities": {"mean": 0.15, "std": np.sqrt(0.15**2 + 0.02**2)},
+    "Bitcoin": {"mean": 0.20, "std": 0.60},
+}
+ALLOCATION_BLOCK_ENDS = (5, 10, 15, 20, 25, 30, 35)
+PRE_RETIREMENT_ASSUMPTIONS = dict(
+    years=36,
+    start_age=30,
+    acc_levy=0.0167,
+    inflation_rate=0.025,
+    lump_sum_frequency=5,
+    start_lump_sum_year=5,
+)
+POST_RETIREMENT_ASSUMPTIONS = dict(
+    start_age=66,
+    inflation=0.025,
+    accumulation_years=35,
+)
+
+# Client inputs and their dashboard defaults. A batch profile sets any of these per client.
+PRE_RETIREMENT_INPUTS = dict(
+    initial_salary=70000,
+    hike_rate_mean=0.0375,
+    hike_rate_std=0.007,
+    contribution_start=0.03,
+    contribution_increase_years=2,
+    contribution_increase_amount=0.01,
+    contribution_max=0.12,
+    lump_sum_amount=10000,
+    marginal_tax_rate=0.30,
+    has_partner="No",
+    partner_contribution_perc=0.03,
+    has_children="No",
+    invested_real_estate="No",
+    double_promotion_year=10,
+)
+POST_RETIREMENT_INPUTS = dict(
+    return_mean=0.04,
+    return_std=0.02,
+    lifestyle_base_today=70000,
+    lifestyle_improvement_pct=0.40,
+    nz_super_annuity=23000,
+)
+CLIENT_DEFAULTS = dict(
+    PRE_RETIREMENT_INPUTS,
+    **POST_RETIREMENT_INPUTS,
+    life_expectancy=90,
+    # Share of the modeled age-65 spending used in retirement; empty uses the manual lifestyle inputs
+    retirement_spending_ratio=0.70,
+    glide_path=False,
+    unforeseen_withdrawals=None,
+    allocation_blocks=None,
+    n_simulation=1000,
+    random_seed=42,
+    variance_reduction="none",
+    # "normal" draws; "stationary" or "block" bootstrap the historical returns in historical.py
+    return_model="normal",
+    block_length=DEFAULT_BLOCK_LENGTH,
+)
+INTEGER_INPUTS = {"contribution_increase_years", "double_promotion_year", "life_expectancy", "n_simulation", "random_seed",
+                  "block_length"}
+
+
+def default_allocation_blocks():
+    # The dashboard's default slider weights, before normalization
+    blocks = []
+    for i, end_year in enumerate(ALLOCATION_BLOCK_ENDS):
+        blocks.append({"end": end_year, "weights": {
+            "Harboursafe": min(0.05 + 0.05 * i, 1.0),
+            "Horizon": min(0.05 + 0.05 * i, 1.0),
+            "SkyHigh": max(0.45 - 0.05 * i, 0.0),
+            "Foreign_Equities": max(0.30 - 0.05 * i, 0.0),
+            "Bitcoin": max(0.15 - 0.025 * i, 0.0),
+        }})
+    return blocks
+
+
+def normalize_allocation_blocks(allocation_blocks):
+    normalized_blocks = []
+    for block in allocation_blocks:
+        weights = block["weights"]
+        total_weight = sum(weights.values())
+        if total_weight <= 0:
+            normalized = {k: 1.0 / len(weights) for k in weights}
+        else:
+            normalized = {k: v / total_weight for k, v in weights.items()}
+        normalized_blocks.append({"end": block["end"], "weights": normalized})
+    return normalized_blocks
+
+
+def pre_retirement_params(allocation_blocks, glide_path=False, unforeseen_withdrawal_years=None, historical=None, **inputs):
+    # Engine keyword arguments: client inputs over the dashboard defaults plus the fixed model assumptions.
+    # allocation_blocks are expected to be normalized already; `historical` replaces the normal return draws.
+    return dict(
+        PRE_RETIREMENT_ASSUMPTIONS,
+        tax_brackets=NZ_TAX_BRACKETS,
+        growth_rates=FUND_GROWTH_RATES,
+        **dict(PRE_RETIREMENT_INPUTS, **inputs),
+        allocation_blocks=allocation_blocks,
+        glide_path=glide_path,
+        unforeseen_withdrawal_years=unforeseen_withdrawal_years,
+        historical=historical,
+    )
+
+
+def post_retirement_params(life_expectancy=90, historical=None, **inputs):
+    return dict(
+        POST_RETIREMENT_ASSUMPTIONS,
+        years=life_expectancy - 65,
+        **dict(POST_RETIREMENT_INPUTS, **inputs),
+        historical=historical,
+    )
+
+
+def historical_returns(return_model, block_length=DEFAULT_BLOCK_LENGTH):
+    return None if return_model == "normal" else HistoricalReturns(method=return_model, block_length=block_length)
+
+
+def _profile_value(name, value):
+    # CSV/Parquet cells: missing values fall back to the default, JSON columns are decoded
+    if value is None or (np.isscalar(value) and pd.isna(value)):
+        return None if name == "retirement_spending_ratio" else CLIENT_DEFAULTS[name]
+    if name == "unforeseen_withdrawals":
+        value = json.loads(value) if isinstance(value, str) else value
+        return {int(year): float(amount) for year, amount in value.items()}
+    if name == "allocation_blocks":
+        return json.loads(value) if isinstance(value, str) else value
+    if name == "glide_path":
+        return str(value).strip().lower() in ("1", "true", "yes") if not isinstance(value, (bool, np.bool_)) else bool(value)
+    if name in INTEGER_INPUTS:
+        return int(value)
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    return value
+
+
+def profile_inputs(profile):
+    # Pipeline inputs for one client profile (a dict or a row of the profiles table).
+    # Unknown keys are ignored so the table can carry ids and other bookkeeping columns.
+    client = dict(CLIENT_DEFAULTS)
+    client.update({name: _profile_value(name, value) for name, value in dict(profile).items() if name in CLIENT_DEFAULTS})
+    if client["double_promotion_year"] == 0:
+        client["double_promotion_year"] = None
+    allocation_blocks = normalize_allocation_blocks(client["allocation_blocks"] or default_allocation_blocks())
+    historical = historical_returns(client["return_model"], client["block_length"])
+    pre_params = pre_retirement_params(
+        allocation_blocks,
+        glide_path=client["glide_path"],
+        unforeseen_withdrawal_years=client["unforeseen_withdrawals"],
+        historical=historical,
+        **{name: client[name] for name in PRE_RETIREMENT_INPUTS},
+    )
+    return {
+        "pre_params": pre_params,
+        "n_simulation": client["n_simulation"],
+        "random_seed": client["random_seed"],
+        "variance_reduction": client["variance_reduction"],
+        "adaptive": None,
+        "scenario_bank": None,
+        "post_params": post_retirement_params(
+            client["life_expectancy"], historical, **{name: client[name] for name in POST_RETIREMENT_INPUTS}
+        ),
+        "spending_ratio": client["retirement_spending_ratio"],
+        "allocation_blocks": allocation_blocks,
+    }
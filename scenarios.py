@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+import numpy as np
+from pre_retirement import CURRENCY_RETURN, FOREIGN_BASE_RETURN
+from profiles import FUND_GROWTH_RATES, PRE_RETIREMENT_ASSUMPTIONS
+
+BANK_VERSION = 1
+# Pre-retirement shock streams: foreign equities are a base return with a currency overlay, every other
+# fund is drawn directly. Post-retirement returns are one stream of their own.
+PRE_ASSETS = ["Foreign_Base", "Currency"] + [fund for fund in FUND_GROWTH_RATES if fund != "Foreign_Equities"]
+DEFAULT_BANK_PATHS = 50_000
+DEFAULT_POST_YEARS = 50
+# Paths generated per chunk; the bank contents depend on it, so it is recorded in the metadata
+CHUNK_PATHS = 10_000
+# Bank draws are plain Monte Carlo, so only methods that leave the shocks as they are can use a bank
+BANK_VARIANCE_REDUCTION = ("none", "control_variate")
+
+
+def correlation_matrix(correlation=None, assets=PRE_ASSETS):
+    # `correlation` is a full matrix in `assets` order or a dict of {(asset, asset): rho}; unlisted pairs are independent
+    matrix = np.eye(len(assets))
+    if isinstance(correlation, dict):
+        for (first, second), rho in correlation.items():
+            unknown = {first, second} - set(assets)
+            if unknown:
+                raise ValueError(f"Unknown scenario assets: {sorted(unknown)}; choose from {assets}")
+            i, j = assets.index(first), assets.index(second)
+            matrix[i, j] = matrix[j, i] = rho
+    elif correlation is not None:
+        matrix = np.array(correlation, dtype=float)
+    if matrix.shape != (len(assets), len(assets)) or not np.allclose(matrix, matrix.T) or not np.allclose(np.diag(matrix), 1):
+        raise ValueError(f"Correlation must be a symmetric {len(assets)}x{len(assets)} matrix with a unit diagonal")
+    try:
+        np.linalg.cholesky(matrix)
+    except np.linalg.LinAlgError:
+        raise ValueError("Correlation matrix is not positive definite") from None
+    return matrix
+
+
+def build_scenario_bank(path, paths=DEFAULT_BANK_PATHS, pre_years=PRE_RETIREMENT_ASSUMPTIONS["years"],
+                        post_years=DEFAULT_POST_YEARS, seed=42, correlation=None, dtype="float64", overwrite=False):
+    # Writes correlated standard-normal shocks to `path`/pre.npy (assets, years, paths) and `path`/post.npy
+    # (years, paths) with a metadata.json next to them. The bank is written in chunks into a temporary
+    # directory and renamed into place, so readers never see a half-written bank.
+    if os.path.exists(path) and not overwrite:
+        raise FileExistsError(f"{path} already exists; pass overwrite=True to replace it")
+    matrix = correlation_matrix(correlation)
+    cholesky = np.linalg.cholesky(matrix)
+    tmp = f"{path}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    pre = np.lib.format.open_memmap(os.path.join(tmp, "pre.npy"), mode="w+", dtype=dtype,
+                                    shape=(len(PRE_ASSETS), pre_years, paths))
+    post = np.lib.format.open_memmap(os.path.join(tmp, "post.npy"), mode="w+", dtype=dtype, shape=(post_years, paths))
+    pre_seed, post_seed = np.random.SeedSequence(seed).spawn(2)
+    starts = range(0, paths, CHUNK_PATHS)
+    for start, pre_chunk, post_chunk in zip(starts, pre_seed.spawn(len(starts)), post_seed.spawn(len(starts))):
+        size = min(CHUNK_PATHS, paths - start)
+        z = np.random.default_rng(pre_chunk).standard_normal((len(PRE_ASSETS), pre_years * size))
+        pre[:, :, start:start + size] = (cholesky @ z).reshape(len(PRE_ASSETS), pre_years, size)
+        post[:, start:start + size] = np.random.default_rng(post_chunk).standard_normal((post_years, size))
+    pre.flush()
+    post.flush()
+    del pre, post
+
+    metadata = {
+        "version": BANK_VERSION,
+        "id": uuid.uuid4().hex,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "seed": seed,
+        "chunk_paths": CHUNK_PATHS,
+        "paths": paths,
+        "pre_years": pre_years,
+        "post_years": post_years,
+        "dtype": np.dtype(dtype).name,
+        "assets": PRE_ASSETS,
+        "correlation": matrix.tolist(),
+        # Shocks are standardized; engines apply their own assumptions as mean + std * shock
+        "currency": {
+            "foreign_base": FOREIGN_BASE_RETURN,
+            "currency": CURRENCY_RETURN,
+            "foreign_return": "(1 + foreign_base) * (1 + currency) - 1",
+        },
+        "growth_rates": {fund: {k: float(v) for k, v in rates.items()} for fund, rates in FUND_GROWTH_RATES.items()},
+    }
+    with open(os.path.join(tmp, "metadata.json"), "w") as handle:
+        json.dump(metadata, handle, indent=2)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return ScenarioBank(path)
+
+
+class ScenarioBank:
+    # A scenario bank opened read-only through memory maps. Slices are views into the mapped files, so
+    # every process that opens the same bank shares its pages through the OS page cache instead of drawing
+    # and holding its own random numbers. Engines take a bank as `scenarios` and a path `scenario_offset`.
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "metadata.json")) as handle:
+            self.metadata = json.load(handle)
+        if self.metadata.get("version") != BANK_VERSION:
+            raise ValueError(f"{path} is a version {self.metadata.get('version')} scenario bank; expected {BANK_VERSION}")
+        self.id = self.metadata["id"]
+        self.paths = self.metadata["paths"]
+        self.assets = self.metadata["assets"]
+        self.pre = np.load(os.path.join(path, "pre.npy"), mmap_mode="r")
+        self.post = np.load(os.path.join(path, "post.npy"), mmap_mode="r")
+
+    def __reduce__(self):
+        # Worker processes reopen the bank by path rather than receiving a copy of it
+        return ScenarioBank, (self.path,)
+
+    def cache_key(self):
+        # Identified by the id written when the bank was generated, not by where it is stored
+        return {"scenario_bank": self.id}
+
+    def __repr__(self):
+        return f"ScenarioBank({self.path!r}, paths={self.paths}, id={self.id[:8]})"
+
+    def _path_slice(self, offset, n):
+        if offset + n > self.paths:
+            raise ValueError(f"Scenario bank {self.path} has {self.paths:,} paths; paths {offset:,} to {offset + n:,} were requested")
+        return slice(offset, offset + n)
+
+    def check_variance_reduction(self, method):
+        if method not in BANK_VARIANCE_REDUCTION:
+            raise ValueError(f"Variance reduction {method!r} cannot use a scenario bank; use one of {BANK_VARIANCE_REDUCTION}")
+
+    def correlation(self, first, second):
+        return self.metadata["correlation"][self.assets.index(first)][self.assets.index(second)]
+
+    def pre_shocks(self, asset, years, offset, n):
+        # (years, n) shocks of one pre-retirement stream
+        if asset not in self.assets:
+            raise ValueError(f"Scenario bank {self.path} has no {asset!r} shocks; it holds {self.assets}")
+        if years > self.pre.shape[1]:
+            raise ValueError(f"Scenario bank {self.path} covers {self.pre.shape[1]} pre-retirement years; {years} were requested")
+        return np.asarray(self.pre[self.assets.index(asset), :years, self._path_slice(offset, n)], dtype=float)
+
+    def post_shocks(self, years, offset, n):
+        # (years, n) post-retirement return shocks
+        if years > self.post.shape[0]:
+            raise ValueError(f"Scenario bank {self.path} covers {self.post.shape[0]} post-retirement years; {years} were requested")
+        return np.asarray(self.post[:years, self._path_slice(offset, n)], dtype=float)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a memory-mapped bank of correlated market scenarios")
+    parser.add_argument("path", help="directory to write the bank to")
+    parser.add_argument("--paths", type=int, default=DEFAULT_BANK_PATHS, help="scenario paths in the bank")
+    parser.add_argument("--post-years", type=int, default=DEFAULT_POST_YEARS, help="post-retirement years covered")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dtype", choices=("float64", "float32"), default="float64",
+                        help="float32 halves the file; float64 slices are used without any conversion")
+    parser.add_argument("--correlation", help="JSON file with a matrix in asset order or a list of [asset, asset, rho]")
+    parser.add_argument("--overwrite", action="store_true", help="replace an existing bank")
+    args = parser.parse_args(argv)
+    if os.path.exists(args.path) and not args.overwrite:
+        parser.error(f"{args.path} already exists; pass --overwrite to replace it")
+
+    correlation = None
+    if args.correlation:
+        with open(args.correlation) as handle:
+            correlation = json.load(handle)
+        if correlation and len(correlation[0]) == 3 and isinstance(correlation[0][0], str):
+            correlation = {(first, second): rho for first, second, rho in correlation}
+    start = time.perf_counter()
+    bank = build_scenario_bank(args.path, args.paths, post_years=args.post_years, seed=args.seed,
+                               correlation=correlation, dtype=args.dtype, overwrite=args.overwrite)
+    size = bank.pre.nbytes + bank.post.nbytes
+    print(f"{bank.paths:,} scenarios ({size / 1024 ** 2:,.0f} MB) written to {args.path} "
+          f"in {time.perf_counter() - start:.1f}s; assets {', '.join(bank.assets)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+import numpy as np
+
+DEFAULT_MAX_QUEUED = 32
+# Jobs one session may have queued or running at once; None for no limit
+DEFAULT_MAX_PER_SESSION = 2
+# Finished jobs the wait and run time percentiles are taken over
+METRIC_WINDOW = 500
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    # One unit of work. `func(job)` runs on a scheduler thread and can check `job.cancel_event` and publish
+    # partial results to `job.progress`. Requests deduplicated onto the job each hold a subscription;
+    # release() drops one, and the job is cancelled once nobody is waiting for it.
+
+    def __init__(self, scheduler, func, key, session):
+        self.scheduler = scheduler
+        self.func = func
+        self.key = key
+        self.session = session
+        self.subscribers = 1
+        self.cancel_event = threading.Event()
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    @property
+    def state(self):
+        if self.finished is not None:
+            return "cancelled" if self.cancelled else "failed" if self.error is not None else "done"
+        return "queued" if self.started is None else "running"
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def release(self):
+        self.scheduler._release(self)
+
+
+class JobScheduler:
+    # A bounded pool of threads shared by every session of a server. Each session has its own FIFO queue
+    # and free threads take the next job from the sessions in turn, so one session submitting many jobs
+    # cannot starve the others. Jobs with the same `key` that are still queued or running are merged, and
+    # submissions beyond the queue limits raise QueueFull for the caller to report. Threads are started
+    # as jobs arrive and exit when the queues are empty.
+
+    def __init__(self, workers=None, max_queued=DEFAULT_MAX_QUEUED, max_per_session=DEFAULT_MAX_PER_SESSION):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.max_per_session = max_per_session
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()
+        self._inflight = {}
+        self._active = Counter()
+        self._running = set()
+        self._threads = 0
+        self._busy_seconds = 0.0
+        self._created = time.perf_counter()
+        self._waits = deque(maxlen=METRIC_WINDOW)
+        self._run_times = deque(maxlen=METRIC_WINDOW)
+        self.counts = Counter()
+
+    def submit(self, func, key=None, session=None):
+        with self._lock:
+            job = self._inflight.get(key) if key is not None else None
+            # A job already cancelled may still be running to its next check; it cannot take new subscribers
+            if job is not None and not job.cancelled:
+                job.subscribers += 1
+                self.counts["deduplicated"] += 1
+                return job
+            queued = sum(len(queue) for queue in self._queues.values())
+            if queued >= self.max_queued:
+                self.counts["rejected"] += 1
+                raise QueueFull(f"{queued} simulations are already waiting; try again shortly")
+            if self.max_per_session is not None and self._active[session] >= self.max_per_session:
+                self.counts["rejected"] += 1
+                raise QueueFull(f"this session already has {self._active[session]} simulations queued or running")
+            job = Job(self, func, key, session)
+            self._queues.setdefault(session, deque()).append(job)
+            self._active[session] += 1
+            if key is not None:
+                self._inflight[key] = job
+            self.counts["submitted"] += 1
+            if self._threads < self.workers:
+                self._threads += 1
+                threading.Thread(target=self._work, name=f"scheduler-{self._threads}", daemon=True).start()
+        return job
+
+    def _next_job(self):
+        # Round robin over the sessions with queued jobs, oldest job first within a session
+        for session, queue in self._queues.items():
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                if job is None:
+                    self._threads -= 1
+                    return
+                job.started = time.perf_counter()
+                self._waits.append(job.started - job.submitted)
+                self._running.add(job)
+            try:
+                job.result = job.func(job)
+            except BaseException as error:
+                # A cancelled job stops by raising whatever its function uses for that; it is not a failure.
+                # Anything else fails the job, SystemExit and KeyboardInterrupt included, and the thread
+                # carries on with the next job, so waiters are released and the thread count stays right.
+                if not job.cancelled:
+                    job.error = error
+            finally:
+                self._finish(job)
+
+    def _finish(self, job):
+        with self._lock:
+            job.finished = time.perf_counter()
+            if job.started is not None:
+                self._running.discard(job)
+                self._busy_seconds += job.finished - job.started
+                self._run_times.append(job.finished - job.started)
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            self._active[job.session] -= 1
+            if not self._active[job.session]:
+                del self._active[job.session]
+            self.counts[job.state] += 1
+        job._done.set()
+
+    def _release(self, job):
+        with self._lock:
+            if job.done or job.cancelled:
+                return
+            job.subscribers -= 1
+            if job.subscribers:
+                return
+            job.cancel_event.set()
+            queue = self._queues.get(job.session)
+            queued = queue is not None and job in queue
+            if queued:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.session]
+        if queued:
+            self._finish(job)
+
+    def queued_ahead(self, job):
+        # Jobs a free thread takes before `job`: with round robin, up to as many from every other session
+        # as `job` has ahead of it in its own queue, plus one more from sessions that come first in turn
+        with self._lock:
+            own = self._queues.get(job.session)
+            if own is None or job not in own:
+                return 0
+            position = own.index(job)
+            ahead = position
+            before = True
+            for session, queue in self._queues.items():
+                if session == job.session:
+                    before = False
+                else:
+                    ahead += min(len(queue), position + 1 if before else position)
+            return ahead
+
+    def metrics(self):
+        with self._lock:
+            now = time.perf_counter()
+            busy = self._busy_seconds + sum(now - job.started for job in self._running)
+            waits = np.array(self._waits)
+            run_times = np.array(self._run_times)
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "sessions": len(self._active),
+                **{name: self.counts[name] for name in ("submitted", "deduplicated", "rejected", "done", "failed", "cancelled")},
+                "queue_wait_p50": float(np.median(waits)) if waits.size else 0.0,
+                "queue_wait_p95": float(np.percentile(waits, 95)) if waits.size else 0.0,
+                "run_time_p50": float(np.median(run_times)) if run_times.size else 0.0,
+                "run_time_p95": float(np.percentile(run_times, 95)) if run_times.size else 0.0,
+                "utilization": busy / (self.workers * (now - self._created)),
+            }
@@ -0,0 +1,165 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from cache import parameter_key
+from pipeline import RETIREMENT_STAGES, Pipeline, Stage, funding_summary, run_batched, variant_key
+from profiles import CLIENT_DEFAULTS, FUND_GROWTH_RATES, POST_RETIREMENT_INPUTS, default_allocation_blocks, profile_inputs
+from variance_reduction import control_variate_probability
+
+SWEEP_METRICS = ("median_corpus", "p5_corpus", "sufficiency_score", "shortfall_probability")
+# Inputs that only change the post-retirement stages; every other input changes the pre-retirement ensemble
+POST_ONLY_INPUTS = set(POST_RETIREMENT_INPUTS) | {"life_expectancy", "retirement_spending_ratio"}
+WEIGHT_SUFFIX = "_weight"
+
+
+def is_weight(name):
+    return name.endswith(WEIGHT_SUFFIX) and name[:-len(WEIGHT_SUFFIX)] in FUND_GROWTH_RATES
+
+
+def point_profile(base, point):
+    # "<Fund>_weight" sets that fund's raw weight in every allocation block before normalization
+    profile = dict(base, **{name: value for name, value in point.items() if not is_weight(name)})
+    weights = {name[:-len(WEIGHT_SUFFIX)]: value for name, value in point.items() if is_weight(name)}
+    if weights:
+        blocks = profile.get("allocation_blocks") or default_allocation_blocks()
+        profile["allocation_blocks"] = [dict(block, weights=dict(block["weights"], **weights)) for block in blocks]
+    return profile
+
+
+def expand_grid(grid):
+    # A dict of name -> values is the full cartesian grid; a list of dicts is taken as given
+    if isinstance(grid, dict):
+        names = list(grid)
+        return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    return [dict(point) for point in grid]
+
+
+def check_names(points):
+    unknown = {name for point in points for name in point if name not in CLIENT_DEFAULTS and not is_weight(name)}
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+
+
+def ensemble_group(point):
+    return parameter_key({name: value for name, value in point.items() if name not in POST_ONLY_INPUTS})
+
+
+def sweep_aggregates_stage(ensemble):
+    # The parts of aggregates_stage the post-retirement stage and the sweep metrics read, computed the
+    # same way but without the per-age percentile table and the displayed path
+    simulated = ensemble["ensemble"]
+    final_corpuses = simulated.final("Adjusted Fund Value")
+    corpus_at_retirement = np.quantile(simulated.at_age("Adjusted Fund Value", 65), 0.5)
+    return {
+        "final_corpuses": final_corpuses,
+        "median_corpus": np.median(final_corpuses),
+        "p5": np.percentile(final_corpuses, 5),
+        "corpus_at_retirement": corpus_at_retirement if pd.notna(corpus_at_retirement) else np.mean(final_corpuses),
+    }
+
+
+def sweep_summary_stage(variance_reduction, ensemble, aggregates, post):
+    # The headline numbers of summaries_stage without the precision and ruin-curve tables
+    ruined = post["post_batch"]["Ruined"]
+    attrs = ensemble["ensemble"].attrs
+    if variance_reduction == "control_variate" and "Control" in attrs:
+        shortfall = control_variate_probability(ruined, attrs["Control"], attrs["Control Mean"])[0]
+    else:
+        shortfall = np.mean(ruined)
+    return {
+        "median_corpus": aggregates["median_corpus"],
+        "p5_corpus": aggregates["p5"],
+        "sufficiency_score": funding_summary(aggregates["corpus_at_retirement"], post["df_post"])["sufficiency_score"],
+        "shortfall_probability": shortfall * 100,
+    }
+
+
+SWEEP_STAGES = [
+    RETIREMENT_STAGES[0],
+    Stage("aggregates", sweep_aggregates_stage, upstream=("ensemble",)),
+    RETIREMENT_STAGES[2],
+    Stage("sweep_summary", sweep_summary_stage, inputs=("variance_reduction",), upstream=("ensemble", "aggregates", "post")),
+]
+
+
+def point_inputs(base, point, paths):
+    profile = point_profile(base, point)
+    if paths is not None:
+        profile["n_simulation"] = paths
+    return profile_inputs(profile)
+
+
+def _run_points(task):
+    # The ensembles of all points are simulated together on one set of draws (run_batched), and points
+    # sharing their pre-retirement inputs share a pipeline state, so only the post-retirement stages rerun
+    # between them
+    base, points, paths, workers = task
+    states = {}
+    runs = [(point_inputs(base, point, paths), states.setdefault(ensemble_group(point), {})) for point in points]
+    results = run_batched(Pipeline(SWEEP_STAGES), runs, workers)
+    return [dict(point, **outputs["sweep_summary"]) for point, (outputs, _) in zip(points, results)]
+
+
+def sweep(grid, base=None, paths=None, workers=1):
+    # Evaluates every parameter set against the same base client profile. All points use the base
+    # random seed, so each sees the same salary, event and market draws (common random numbers) and
+    # the differences between points come from the parameters rather than from sampling noise. That
+    # also lets a sweep use fewer `paths` per point than a standalone run needs for the same contrast.
+    # Points that differ only in pre-retirement parameters the draws do not depend on (VARIANT_PARAMS:
+    # salary, hikes, contributions, allocation) are one task, evaluated along the engine's variant axis.
+    # Tasks run in parallel over `workers`; a single task uses them for its shards instead.
+    base = dict(base or {})
+    points = expand_grid(grid)
+    check_names(points)
+    groups = {}
+    for index, point in enumerate(points):
+        groups.setdefault(variant_key(point_inputs(base, point, paths)), []).append(index)
+    # Points of one ensemble next to each other, so they reuse each other's pipeline state
+    groups = [sorted(indexes, key=lambda i: ensemble_group(points[i])) for indexes in groups.values()]
+    workers = workers or os.cpu_count() or 1
+    if len(groups) == 1 or workers <= 1:
+        results = [_run_points((base, [points[i] for i in indexes], paths, workers if len(groups) == 1 else 1))
+                   for indexes in groups]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+            results = list(pool.map(_run_points, [(base, [points[i] for i in indexes], paths, 1) for indexes in groups]))
+    rows = [None] * len(points)
+    for indexes, group_rows in zip(groups, results):
+        for index, row in zip(indexes, group_rows):
+            rows[index] = row
+    return pd.DataFrame(rows)
+
+
+def heatmap_table(results, x, y, metric="median_corpus"):
+    # One metric over a two-parameter sweep: rows are the `y` values, columns the `x` values
+    return results.pivot_table(index=y, columns=x, values=metric, aggfunc="first")
+
+
+def tornado_table(ranges, base=None, metrics=SWEEP_METRICS, paths=None, workers=1):
+    # Moves one parameter at a time to its low and high value with everything else at the base profile.
+    # `ranges` maps a parameter to (low, high); rows are sorted by swing within each metric.
+    base = dict(base or {})
+    points = [{}]
+    for name, (low, high) in ranges.items():
+        points += [{name: low}, {name: high}]
+    results = sweep(points, base, paths, workers)
+    base_row = results.iloc[0]
+    rows = []
+    for i, (name, (low, high)) in enumerate(ranges.items()):
+        at_low, at_high = results.iloc[1 + 2 * i], results.iloc[2 + 2 * i]
+        for metric in metrics:
+            rows.append({
+                "Metric": metric,
+                "Parameter": name,
+                "Low Value": low,
+                "High Value": high,
+                "Base": base_row[metric],
+                "At Low": at_low[metric],
+                "At High": at_high[metric],
+                "Swing": abs(at_high[metric] - at_low[metric]),
+            })
+    table = pd.DataFrame(rows)
+    order = {metric: i for i, metric in enumerate(metrics)}
+    return table.sort_values(["Metric", "Swing"], key=lambda c: c.map(order) if c.name == "Metric" else -c).reset_index(drop=True)
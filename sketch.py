@@ -0,0 +1,143 @@
+import argparse
+import sys
+import numpy as np
+from ensemble import DEFAULT_QUANTILES, quantile_label
+
+
+class QuantileSketch:
+    # Per-age log-bucketed quantile sketch (DDSketch style) with running mean and variance.
+    # Every quantile is within `relative_accuracy` of the true value (relative error); values with
+    # magnitude below `min_value` are counted as zero. Memory depends only on the number of ages and
+    # the bucket range, never on how many paths were added, and two sketches with the same settings
+    # merge exactly by adding their bucket counts.
+
+    def __init__(self, ages, relative_accuracy=0.01, min_value=1.0, max_value=1e13):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.ages = np.asarray(ages)
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self._min_key = int(np.ceil(np.log(min_value) / self._log_gamma))
+        self._max_key = int(np.ceil(np.log(max_value) / self._log_gamma))
+        n_ages = len(self.ages)
+        n_keys = self._max_key - self._min_key + 1
+        self.positive = np.zeros((n_ages, n_keys), dtype=np.int64)
+        self.negative = np.zeros((n_ages, n_keys), dtype=np.int64)
+        self.zero = np.zeros(n_ages, dtype=np.int64)
+        self.count = np.zeros(n_ages, dtype=np.int64)
+        self.mean = np.zeros(n_ages)
+        self._m2 = np.zeros(n_ages)
+        self.min = np.full(n_ages, np.inf)
+        self.max = np.full(n_ages, -np.inf)
+
+    def _settings(self):
+        return (tuple(self.ages), self.relative_accuracy, self.min_value, self.max_value)
+
+    def _bucket_counts(self, magnitudes, age_index):
+        keys = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+        keys = np.clip(keys, self._min_key, self._max_key) - self._min_key
+        n_keys = self.positive.shape[1]
+        flat = age_index * n_keys + keys
+        return np.bincount(flat, minlength=self.positive.size).reshape(self.positive.shape)
+
+    def update(self, values):
+        # values: (n_paths, n_ages) chunk of simulated paths
+        values = np.asarray(values, dtype=float)
+        n = values.shape[0]
+        if n == 0:
+            return self
+        age_index = np.broadcast_to(np.arange(len(self.ages)), values.shape)
+        positive = values >= self.min_value
+        negative = values <= -self.min_value
+        self.positive += self._bucket_counts(values[positive], age_index[positive])
+        self.negative += self._bucket_counts(-values[negative], age_index[negative])
+        self.zero += n - positive.sum(axis=0) - negative.sum(axis=0)
+
+        chunk_mean = values.mean(axis=0)
+        chunk_m2 = ((values - chunk_mean) ** 2).sum(axis=0)
+        self._combine_moments(n, chunk_mean, chunk_m2)
+        self.min = np.minimum(self.min, values.min(axis=0))
+        self.max = np.maximum(self.max, values.max(axis=0))
+        return self
+
+    def _combine_moments(self, n, mean, m2):
+        # Chan et al. parallel update of running mean and sum of squared deviations
+        total = self.count + n
+        delta = mean - self.mean
+        weight = np.divide(n, total, out=np.zeros(len(self.ages)), where=total > 0)
+        self.mean = self.mean + delta * weight
+        self._m2 = self._m2 + m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    def merge(self, other):
+        if self._settings() != other._settings():
+            raise ValueError("Only sketches with the same ages and accuracy settings can be merged")
+        self.positive += other.positive
+        self.negative += other.negative
+        self.zero += other.zero
+        self._combine_moments(other.count, other.mean, other._m2)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(np.divide(self._m2, self.count, out=np.full(len(self.ages), np.nan), where=self.count > 0))
+
+    def quantile(self, q):
+        # Buckets in ascending value order: most negative first, then zero, then positive.
+        counts = np.concatenate([self.negative[:, ::-1], self.zero[:, None], self.positive], axis=1)
+        keys = np.arange(self._min_key, self._max_key + 1)
+        representative = 2 * self.gamma ** keys / (self.gamma + 1)
+        values = np.concatenate([-representative[::-1], [0.0], representative])
+        rank = q * (self.count - 1)
+        bucket = (np.cumsum(counts, axis=1) > rank[:, None]).argmax(axis=1)
+        result = np.clip(values[bucket], self.min, self.max)
+        return np.where(self.count > 0, result, np.nan)
+
+    def percentiles(self, quantiles=DEFAULT_QUANTILES):
+        # Same layout as EnsembleResult.percentiles, so it can feed plot_corpus_band directly.
+        import pandas as pd
+        frame = pd.DataFrame({"Age": self.ages.astype(int)})
+        for q in quantiles:
+            frame[quantile_label(q)] = self.quantile(q)
+        frame.attrs["relative_accuracy"] = self.relative_accuracy
+        return frame
+
+    def moments(self):
+        import pandas as pd
+        return pd.DataFrame({"Age": self.ages.astype(int), "count": self.count, "mean": self.mean, "std": self.std})
+
+    def final(self, quantiles=DEFAULT_QUANTILES):
+        summary = {quantile_label(q): self.quantile(q)[-1] for q in quantiles}
+        summary.update(mean=self.mean[-1], std=self.std[-1], relative_accuracy=self.relative_accuracy)
+        return summary
+
+
+def main(argv=None):
+    # The per-age corpus band of a default-profile ensemble too large to hold, sketched across workers
+    from parallel import run_pre_retirement_sketch
+    from profiles import profile_inputs
+    parser = argparse.ArgumentParser(description="Sketch the per-age quantiles of a very large pre-retirement ensemble")
+    parser.add_argument("--paths", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument("--accuracy", type=float, default=0.01, help="relative accuracy of every quantile")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="CSV file for the per-age percentiles (default: print them)")
+    args = parser.parse_args(argv)
+    params = profile_inputs({"n_simulation": args.paths})["pre_params"]
+    sketch = run_pre_retirement_sketch(args.paths, seed=args.seed, workers=args.workers,
+                                       relative_accuracy=args.accuracy, **params)
+    frame = sketch.percentiles().merge(sketch.moments(), on="Age")
+    if args.output:
+        frame.to_csv(args.output, index=False)
+    else:
+        print(frame.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import time
+from pipeline import Pipeline, prime_batched
+from pre_retirement import VARIANT_PARAMS
+from sensitivity import SWEEP_STAGES
+
+# Solvable inputs: search direction (smallest value that meets the target, or largest) and default bounds.
+# Each search is bracketed within its bounds and stops once the bracket is narrower than the tolerance.
+SOLVE_PARAMETERS = {
+    "contribution_max": {"direction": "min", "bounds": (0.0, 0.30), "tolerance": 0.0005},
+    "contribution_start": {"direction": "min", "bounds": (0.0, 0.20), "tolerance": 0.0005},
+    "retirement_spending_ratio": {"direction": "max", "bounds": (0.0, 2.0), "tolerance": 0.005},
+    "lifestyle_base_today": {"direction": "max", "bounds": (0.0, 500000.0), "tolerance": 100.0},
+}
+# Path count for interactive goal seeking; enough for stable percentiles while each solve stays well under a second
+DEFAULT_SOLVER_PATHS = 2_000
+# Target metrics and whether they have to be at least or at most the target value
+TARGETS = {
+    "sufficiency_score": ">=",
+    "shortfall_probability": "<=",
+    "median_corpus": ">=",
+    "p5_corpus": ">=",
+}
+
+
+def with_parameter(inputs, parameter, value):
+    # Pipeline inputs with one solvable input replaced
+    inputs = dict(inputs, adaptive=None)
+    if parameter in ("contribution_max", "contribution_start"):
+        inputs["pre_params"] = dict(inputs["pre_params"], **{parameter: value})
+    elif parameter == "retirement_spending_ratio":
+        inputs["spending_ratio"] = value
+    else:
+        # The manual lifestyle only applies when retirement spending is not linked to the age-65 spending
+        inputs["post_params"] = dict(inputs["post_params"], **{parameter: value})
+        inputs["spending_ratio"] = None
+    return inputs
+
+
+class GoalSeeker:
+    # Evaluates the sweep summary for candidate values on one fixed scenario set: the seed and path count
+    # never change, so the metrics move only with the parameter and are monotone in it. One pipeline state
+    # is kept across iterations, so searches over post-retirement inputs simulate the ensemble once, and
+    # every evaluated value is remembered.
+
+    def __init__(self, inputs, paths=None):
+        self.inputs = dict(inputs)
+        if paths is not None:
+            self.inputs["n_simulation"] = paths
+        self.pipeline = Pipeline(SWEEP_STAGES)
+        self.state = {}
+        self.primed = {}
+        self.evaluated = {}
+
+    def metrics(self, parameter, value):
+        key = (parameter, value)
+        if key not in self.evaluated:
+            # A primed value has its own state; otherwise the one shared state is kept, so only the stages
+            # the parameter changes rerun
+            state = self.primed.pop(key, self.state)
+            outputs, _ = self.pipeline.run(with_parameter(self.inputs, parameter, value), state)
+            self.evaluated[key] = outputs["sweep_summary"]
+        return self.evaluated[key]
+
+    def prime(self, parameter, values):
+        # Simulates the ensembles of several values in one call along the engine's variant axis, when the
+        # parameter leaves the random draws unchanged; the later stages only run once a value is evaluated
+        if parameter not in VARIANT_PARAMS:
+            return
+        runs = []
+        for value in dict.fromkeys(values):
+            key = (parameter, value)
+            if key not in self.evaluated and key not in self.primed:
+                self.primed[key] = {}
+                runs.append((with_parameter(self.inputs, parameter, value), self.primed[key]))
+        prime_batched(self.pipeline, runs)
+
+    def meets(self, parameter, value, metric, target):
+        result = self.metrics(parameter, value)[metric]
+        return result >= target if TARGETS[metric] == ">=" else result <= target
+
+    def solve(self, parameter, metric, target, bounds=None, tolerance=None):
+        if parameter not in SOLVE_PARAMETERS:
+            raise ValueError(f"Cannot solve for {parameter!r}; choose from {sorted(SOLVE_PARAMETERS)}")
+        if metric not in TARGETS:
+            raise ValueError(f"Unknown target metric {metric!r}; choose from {sorted(TARGETS)}")
+        spec = SOLVE_PARAMETERS[parameter]
+        low, high = bounds or spec["bounds"]
+        tolerance = tolerance or spec["tolerance"]
+        start = time.perf_counter()
+        evaluations = len(self.evaluated)
+        # `good` meets the target and `bad` does not; for a "max" search the target holds below the answer
+        good, bad = (high, low) if spec["direction"] == "min" else (low, high)
+        # The bounds are checked first, so their ensembles are simulated together. Bisection midpoints
+        # depend on the previous step; simulating the next levels ahead on the variant axis cost as much as
+        # the steps it saved.
+        self.prime(parameter, [bad, good])
+        if self.meets(parameter, bad, metric, target):
+            status, value = "met at bound", bad
+        elif not self.meets(parameter, good, metric, target):
+            status, value = "unreachable", None
+        else:
+            while abs(good - bad) > tolerance:
+                middle = (good + bad) / 2
+                if self.meets(parameter, middle, metric, target):
+                    good = middle
+                else:
+                    bad = middle
+            status, value = "solved", good
+        return {
+            "parameter": parameter,
+            "metric": metric,
+            "target": target,
+            "status": status,
+            "value": value,
+            "metrics": self.metrics(parameter, value) if value is not None else None,
+            "evaluations": len(self.evaluated) - evaluations,
+            "seconds": time.perf_counter() - start,
+        }
+
+
+def solve(inputs, parameter, metric, target, bounds=None, tolerance=None, paths=None):
+    # Smallest contribution, or largest retirement spending, that meets a target such as
+    # ("sufficiency_score", 80) or ("shortfall_probability", 10), for one set of pipeline inputs
+    return GoalSeeker(inputs, paths).solve(parameter, metric, target, bounds, tolerance)
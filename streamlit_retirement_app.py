@@ -1,191 +1,207 @@
+import os
+import time
+import uuid
 import numpy as np
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.ticker import FuncFormatter
-from scipy.stats import norm
-import seaborn as sns
-from post_retirement import simulate_post_retirement
-from pre_retirement import simulate_pre_retirement
-
-sns.set_style("whitegrid")
-
-ASSET_COLUMNS = [
-    "Harboursafe Contribution",
-    "Horizon Contribution",
-    "SkyHigh Contribution",
-    "Foreign_Equities Contribution",
-    "Bitcoin Contribution"
-]
-
-
-def normalize_allocation_blocks(allocation_blocks):
-    normalized_blocks = []
-    for block in allocation_blocks:
-        weights = block["weights"]
-        total_weight = sum(weights.values())
-        if total_weight <= 0:
-            normalized = {k: 1.0 / len(weights) for k in weights}
-        else:
-            normalized = {k: v / total_weight for k, v in weights.items()}
-        normalized_blocks.append({"end": block["end"], "weights": normalized})
-    return normalized_blocks
-
-
-def format_currency(value):
-    if pd.isna(value):
-        return "N/A"
-    return f"${value:,.0f}"
-
-
-def build_aggregate_summary(df_list):
-    long_df = pd.concat([df.assign(Simulation=i) for i, df in enumerate(df_list)], ignore_index=True)
-    percentiles = long_df.groupby("Age")["Adjusted Fund Value"].quantile([0.05, 0.5, 0.95]).unstack(level=1)
-    percentiles.columns = ["p5", "median", "p95"]
-    percentiles = percentiles.reset_index()
-    return long_df, percentiles
-
-
-def million_formatter(x, pos):
-    if x >= 1e6:
-        return f"{x/1e6:.1f}M"
-    if x >= 1e3:
-        return f"{x/1e3:.0f}K"
-    return f"{x:.0f}"
-
-
-def plot_retirement_corpus_distribution(final_values):
-    mu = np.mean(final_values)
-    p5 = np.percentile(final_values, 5)
-    p95 = np.percentile(final_values, 95)
-
-    x = np.linspace(min(final_values), max(final_values), 200)
-    pdf = norm.pdf(x, mu, np.std(final_values))
-
-    fig, ax = plt.subplots(figsize=(10, 5))
-    sns.histplot(final_values, kde=False, stat="density", bins=30, color="#6fa8dc", ax=ax)
-    ax.plot(x, pdf, color="#2a4d69", linewidth=2.5, label="Normal PDF")
-    ax.fill_between(x, 0, pdf, where=(x <= p5), color="#f4cccc", alpha=0.4, label="Lower 5% tail")
-    ax.fill_between(x, 0, pdf, where=(x >= p95), color="#d9ead3", alpha=0.4, label="Upper 5% tail")
-    ax.axvline(mu, color="#1f618d", linestyle="-", linewidth=2, label=f"Mean: {format_currency(mu)}")
-    ax.axvline(p5, color="#a6acaf", linestyle="--", linewidth=1.5, label=f"5th percentile: {format_currency(p5)}")
-    ax.axvline(p95, color="#a6acaf", linestyle="--", linewidth=1.5, label=f"95th percentile: {format_currency(p95)}")
-    ax.set_title("Distribution of Final Retirement Corpus")
-    ax.set_xlabel("Corpus at Retirement (Millions NZD)")
-    ax.set_ylabel("Density")
-    ax.xaxis.set_major_formatter(FuncFormatter(million_formatter))
-    ax.legend(loc="upper right", frameon=False)
-    return fig, mu, p5, p95
-
-
-def plot_corpus_band(percentiles):
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.fill_between(percentiles["Age"], percentiles["p5"], percentiles["p95"], color="#cfe2f3", alpha=0.3, label="5th–95th percentile range")
-    ax.plot(percentiles["Age"], percentiles["median"], color="#114b8d", linewidth=2.5, label="Median corpus")
-    ax.set_title("Projected Retirement Corpus with Risk Bands")
-    ax.set_xlabel("Age")
-    ax.set_ylabel("Projected Fund Value (Millions NZD)")
-    ax.yaxis.set_major_formatter(FuncFormatter(million_formatter))
-    ax.legend()
-    return fig
-
-
-def plot_contribution_stack(df_pre):
-    fig, ax = plt.subplots(figsize=(10, 5))
-    contributions = df_pre[["Age"] + ASSET_COLUMNS].copy()
-    contributions = contributions.set_index("Age")
-    contributions.plot.area(ax=ax, cmap="tab20", alpha=0.9)
-    ax.set_title("Annual Fund Contributions by Asset")
-    ax.set_xlabel("Age")
-    ax.set_ylabel("Contribution Amount (NZD)")
-    ax.legend(loc="upper left", fontsize="small")
-    return fig
-
-
-def plot_cashflow(df_pre):
+from background import BackgroundRun
+from cache import DEFAULT_CACHE_BYTES, ResultCache, parameter_key
+from formatting import format_currency
+from instrumentation import configure_logging, log_timings, recording
+from pipeline import RETIREMENT_STAGES, Pipeline
+from profiles import historical_returns, normalize_allocation_blocks, post_retirement_params, pre_retirement_params
+from scenarios import ScenarioBank
+from scheduler import DEFAULT_MAX_PER_SESSION, DEFAULT_MAX_QUEUED, JobScheduler, QueueFull
+from solver import DEFAULT_SOLVER_PATHS, GoalSeeker
+from warmup import start_warm_up
+
+configure_logging()
+
+
+@st.cache_resource
+def get_result_cache():
+    # One cache per server process, shared by every session; set RETIREMENT_CACHE_DIR to keep results across restarts
+    max_bytes = int(float(os.environ.get("RETIREMENT_CACHE_MB", DEFAULT_CACHE_BYTES / 1024 ** 2)) * 1024 ** 2)
+    return ResultCache(max_bytes=max_bytes, disk_dir=os.environ.get("RETIREMENT_CACHE_DIR"))
+
+
+@st.cache_resource
+def get_scheduler():
+    # Every session's simulations run on this one bounded pool; RETIREMENT_SCHEDULER_WORKERS sizes it
+    # (default: one per CPU) and RETIREMENT_QUEUE_LIMIT caps how many may wait
+    return JobScheduler(
+        workers=int(os.environ.get("RETIREMENT_SCHEDULER_WORKERS", 0)) or None,
+        max_queued=int(os.environ.get("RETIREMENT_QUEUE_LIMIT", DEFAULT_MAX_QUEUED)),
+        max_per_session=DEFAULT_MAX_PER_SESSION,
+    )
+
+
+@st.cache_resource
+def get_historical_returns(return_model, block_length):
+    # The workbook is converted to its cached binary form once per server process at most
+    return historical_returns(return_model, block_length)
+
+
+@st.cache_resource
+def get_scenario_bank(path):
+    # Opened once per server process; every session reads the same memory-mapped pages
+    return ScenarioBank(path)
+
+
+RETURN_MODEL_OPTIONS = {
+    "Normal Draws": "normal",
+    "Historical (Stationary Bootstrap)": "stationary",
+    "Historical (Block Bootstrap)": "block",
+}
+
+VARIANCE_REDUCTION_OPTIONS = {
+    "None": "none",
+    "Antithetic": "antithetic",
+    "Sobol (quasi-Monte Carlo)": "sobol",
+    "Control Variates": "control_variate",
+}
+
+# Seconds between redraws of the partial results while a run is in progress
+PREVIEW_INTERVAL = 0.25
+
+CHART_SECTIONS = ["Funding Gauge", "Risk Bands & Distribution", "Allocation & Cashflow", "Drawdown & Return Volatility"]
+
+
+def cashflow_frame(df_pre):
     df = df_pre.copy()
     expense_cols = ["Rent", "Groceries", "Travel", "Utilities", "Insurance", "Leisure", "Misc"]
     df["Total Expenses"] = df[expense_cols].sum(axis=1)
-    fig, ax = plt.subplots(figsize=(10, 4))
-    ax.plot(df["Age"], df["Net Salary"], label="Net Salary", color="#2a6f97", linewidth=2)
-    ax.plot(df["Age"], df["Total Contribution"], label="Total Contribution", color="#ff8c42", linewidth=2)
-    ax.plot(df["Age"], df["Total Expenses"], label="Total Expenses", color="#8c2d04", linewidth=2)
-    ax.plot(df["Age"], df["Adjusted Fund Value"], label="Portfolio Value", color="#1b4f72", linewidth=2, linestyle="--")
-    ax.set_title("Net Cashflow, Savings, Expenses and Portfolio Value")
-    ax.set_xlabel("Age")
-    ax.set_ylabel("NZD")
-    ax.legend()
-    ax.yaxis.set_major_formatter(FuncFormatter(million_formatter))
-    return fig
-
-
-def plot_funding_gauge(score, corpus, required):
-    fig, ax = plt.subplots(figsize=(4, 2.2))
-    fig.subplots_adjust(top=0.85, bottom=0.12, left=0.05, right=0.98)
-    ax.axis("off")
-
-    segments = [
-        (108, 180, "#d9534f"),  # 0-60%
-        (36, 108, "#f0ad4e"),   # 60-80%
-        (0, 36, "#5cb85c"),     # 80-100%
+    return df.set_index("Age")[["Net Salary", "Total Contribution", "Total Expenses", "Adjusted Fund Value"]]
+
+
+def distribution_frame(final_values, bins=30):
+    counts, edges = np.histogram(final_values, bins=bins)
+    return pd.DataFrame({"Paths": counts}, index=pd.Index((edges[:-1] + edges[1:]) / 2 / 1e6, name="Corpus (Millions NZD)"))
+
+
+def show_preview(preview, n_simulation):
+    # The risk band and distribution of the paths simulated so far, drawn natively so each redraw is cheap
+    st.progress(preview["paths"] / n_simulation, text=f"Simulated {preview['paths']:,} of {n_simulation:,} paths...")
+    col1, col2 = st.columns(2)
+    col1.markdown("**Corpus Risk Band (partial)**")
+    col1.line_chart(preview["corpus_percentiles"].set_index("Age")[["p5", "median", "p95"]])
+    col2.markdown("**Final Corpus Distribution (partial)**")
+    col2.bar_chart(distribution_frame(preview["final_corpuses"]))
+
+
+def run_in_background(inputs, workers, profile_phases, n_simulation, progressive):
+    # Submits the run to the shared scheduler, or keeps following the session's run with the same inputs,
+    # and waits for it, redrawing partial results if `progressive`. Any rerun without a click cancels the
+    # session's run before it gets here.
+    key = parameter_key(inputs)
+    run = st.session_state.get("background_run")
+    if run is None or run[0] != key:
+        if run is not None:
+            run[1].cancel()
+        pipeline_state = st.session_state.setdefault("pipeline_state", {})
+        session = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+        try:
+            run = (key, BackgroundRun(get_pipeline(), inputs, pipeline_state, context={"workers": workers},
+                                      profile=profile_phases, scheduler=get_scheduler(), session=session,
+                                      preview=progressive))
+        except QueueFull as error:
+            st.session_state.pop("background_run", None)
+            st.warning(f"The simulator is busy: {error}. Your inputs are kept; press Apply again in a moment.")
+            st.stop()
+        st.session_state["background_run"] = run
+    run = run[1]
+    placeholder = st.empty()
+    shown = None
+    with st.spinner("Running retirement simulations..."):
+        while not run.wait(PREVIEW_INTERVAL):
+            ahead = run.queued_ahead
+            preview = run.preview if progressive else None
+            if ahead is not None:
+                placeholder.info(f"Waiting for a free simulation slot: {ahead} run{'s' if ahead != 1 else ''} ahead of yours.")
+            elif preview is None:
+                placeholder.empty()
+            elif preview is not shown:
+                shown = preview
+                with placeholder.container():
+                    show_preview(preview, n_simulation)
+    placeholder.empty()
+    del st.session_state["background_run"]
+    if run.error is not None:
+        raise run.error
+    st.session_state["pipeline_state"] = run.state
+    return run.outputs, run.recomputed, run.timings
+
+
+def allocation_frame(normalized_blocks):
+    return pd.DataFrame([block["weights"] for block in normalized_blocks],
+                        index=pd.Index([block["end"] for block in normalized_blocks], name="Year End"))
+
+
+def show_chart(name, plot, *data, native=None):
+    # native: (st chart function, pre-aggregated frame), used instead of matplotlib when native charts are on
+    if native is not None and st.session_state.get("native_charts"):
+        chart, frame = native
+        chart(frame)
+    else:
+        st.image(get_figure_renderer().render(name, plot, *data))
+
+
+def goal_seek_table(inputs, target_sufficiency, target_shortfall):
+    # Smallest max contribution and largest retirement spending that reach the targets, on one fixed scenario set
+    seeker = GoalSeeker(inputs, paths=min(inputs["n_simulation"], DEFAULT_SOLVER_PATHS))
+    spending = "retirement_spending_ratio" if inputs["spending_ratio"] is not None else "lifestyle_base_today"
+    goals = [
+        (f"Sufficiency ≥ {target_sufficiency}%", "Max Contribution %", "contribution_max", "sufficiency_score", target_sufficiency),
+        (f"Shortfall ≤ {target_shortfall}%", "Max Contribution %", "contribution_max", "shortfall_probability", target_shortfall),
+        (f"Shortfall ≤ {target_shortfall}%", "Retirement Spending", spending, "shortfall_probability", target_shortfall),
     ]
-    for start, end, color in segments:
-        wedge = patches.Wedge((0, 0), 1.0, start, end, width=0.18, facecolor=color, edgecolor="none")
-        ax.add_patch(wedge)
-
-    outer = patches.Wedge((0, 0), 1.0, 180, 0, width=0.03, facecolor="none", edgecolor="#666", linewidth=1.5)
-    ax.add_patch(outer)
-
-    score_theta = 180 - np.clip(score, 0, 100) / 100 * 180
-    x = np.cos(np.radians(score_theta)) * 0.82
-    y = np.sin(np.radians(score_theta)) * 0.82
-    needle_color = "#d9534f" if score < 60 else "#f0ad4e" if score < 80 else "#5cb85c"
-    ax.plot([0, x], [0, y], color=needle_color, linewidth=4, zorder=5)
-    hub = patches.Circle((0, 0), 0.06, facecolor=needle_color, edgecolor="#ffffff", linewidth=2, zorder=6)
-    ax.add_patch(hub)
-
-    for pct in range(0, 101, 20):
-        angle = 180 - pct / 100 * 180
-        x0 = np.cos(np.radians(angle)) * 0.92
-        y0 = np.sin(np.radians(angle)) * 0.92
-        x1 = np.cos(np.radians(angle)) * 1.0
-        y1 = np.sin(np.radians(angle)) * 1.0
-        ax.plot([x0, x1], [y0, y1], color="#333", linewidth=2)
-        xl = np.cos(np.radians(angle)) * 1.12
-        yl = np.sin(np.radians(angle)) * 1.12
-        ax.text(xl, yl, f"{pct}%", ha="center", va="center", fontsize=9, color="#333")
-
-    ax.text(0, -0.18, f"Funding sufficiency", ha="center", fontsize=12, fontweight="bold")
-    ax.text(0, -0.34, f"{score:.0f}% funded", ha="center", fontsize=11, color="#333")
-    ax.text(0, -0.52, f"{format_currency(corpus)} / {format_currency(required)}", ha="center", fontsize=9, color="#555")
-
-    ax.set_xlim(-1.2, 1.2)
-    ax.set_ylim(-0.7, 1.05)
-    return fig
-
-
-def plot_allocation_evolution(normalized_blocks):
-    data = {"Age": [block["end"] for block in normalized_blocks]}
-    assets = list(normalized_blocks[0]["weights"].keys())
-    for asset in assets:
-        data[asset] = [block["weights"][asset] for block in normalized_blocks]
-    df = pd.DataFrame(data)
-
-    fig, ax = plt.subplots(figsize=(10, 4))
-    palette = ["#1b4f72", "#117a65", "#d35400", "#6c3483", "#1f618d"]
-    for asset, color in zip(assets, palette):
-        ax.plot(df["Age"], df[asset], marker="o", linewidth=2, label=asset, color=color)
-    ax.set_title("Selected Portfolio Allocation Over Time")
-    ax.set_xlabel("Year End")
-    ax.set_ylabel("Allocation Weight")
-    ax.set_ylim(0, 1)
-    ax.legend(loc="upper left", fontsize="small")
-    return fig
+    rows = []
+    for goal, setting, parameter, metric, target in goals:
+        result = seeker.solve(parameter, metric, target)
+        value = result["value"]
+        if value is None:
+            required = "Not reachable"
+        elif parameter == "lifestyle_base_today":
+            required = f"{format_currency(value)} per year today"
+        elif parameter == "retirement_spending_ratio":
+            required = f"{value:.1%} of age-65 spending"
+        else:
+            required = f"{value:.1%}"
+        metrics = result["metrics"] or {}
+        rows.append({
+            "Goal": goal,
+            "Setting": setting,
+            "Required Value": required,
+            "Sufficiency %": metrics.get("sufficiency_score"),
+            "Shortfall %": metrics.get("shortfall_probability"),
+        })
+    return pd.DataFrame(rows)
+
+
+@st.cache_resource
+def get_figure_renderer():
+    # Rendered chart bytes, shared by every session and keyed by the plotted data. matplotlib loads here,
+    # on the first chart, rather than before the inputs are shown.
+    from figures import FigureRenderer
+    return FigureRenderer()
+
+
+@st.cache_resource
+def get_warm_up():
+    # Once per server process: load the chart modules and run a small simulation in the background
+    return start_warm_up()
+
+
+@st.cache_resource
+def get_pipeline():
+    return Pipeline(RETIREMENT_STAGES, cache=get_result_cache())
 
 
 def main():
     st.set_page_config(page_title="Retirement Planner", page_icon="💰", layout="wide")
+    # Set RETIREMENT_WARMUP=1 to warm up while the first visitor is still choosing inputs
+    if os.environ.get("RETIREMENT_WARMUP"):
+        get_warm_up()
     st.title("💼 Financial Advisor — NZ Retirement Planning Simulator")
     st.markdown(
         "This interactive planner evaluates your savings path and retirement funding using realistic salary growth, contributions, investment allocation, and NZ Super support. It helps you understand how robust your corpus is against downside risk."
@@ -278,94 +294,175 @@ def main():
                 }
                 allocation_blocks.append({"end": end_year, "weights": allocation})
             st.caption("Weights are normalized automatically to model a valid allocation mix.")
+            glide_path = st.checkbox("Glide Path Between Blocks", value=False)
+            st.caption("Glide path moves the weights gradually from one block end to the next instead of switching at each block end.")
+
+        with st.expander("⚙️ Simulation Settings", expanded=False):
+            n_simulation = st.number_input("Number of Simulations", min_value=100, max_value=200000, value=1000, step=100)
+            random_seed = st.number_input("Random Seed", min_value=0, value=42, step=1)
+            workers = st.number_input("Parallel Workers", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1)
+            variance_reduction = VARIANCE_REDUCTION_OPTIONS[
+                st.selectbox("Variance Reduction", list(VARIANCE_REDUCTION_OPTIONS), index=0)
+            ]
+            st.caption("The same seed reproduces the same results for any number of workers.")
+            adaptive_paths = st.checkbox("Adaptive Path Count", value=False)
+            adaptive_time_limit = st.number_input(
+                "Adaptive Time Limit (s)", min_value=0.5, max_value=60.0, value=5.0, step=0.5, disabled=not adaptive_paths
+            )
+            st.caption(
+                "Adaptive mode simulates in batches and stops once the median, 5th percentile and shortfall estimates "
+                "are precise enough; Number of Simulations becomes the upper limit."
+            )
+            return_model = RETURN_MODEL_OPTIONS[st.selectbox("Return Model", list(RETURN_MODEL_OPTIONS), index=0)]
+            block_length = st.number_input(
+                "Mean Block Length (years)", min_value=1, max_value=20, value=5, step=1, disabled=return_model == "normal"
+            )
+            st.caption(
+                "Historical models resample runs of consecutive years from the projection workbook in CSV Files "
+                "instead of drawing each fund's return from a normal distribution. Harboursafe, Horizon and SkyHigh "
+                "earn their own return of the sampled year; Foreign Equities and retirement savings earn the "
+                "portfolio's."
+            )
+            scenario_bank_path = st.text_input(
+                "Scenario Bank Directory", value=os.environ.get("RETIREMENT_SCENARIO_BANK", "")
+            ).strip()
+            st.caption(
+                "Reads market returns from a bank built with `python scenarios.py <directory>` instead of drawing "
+                "them, so every run and every user sees the same scenarios. Leave empty to draw fresh returns."
+            )
+            progressive_results = st.checkbox("Progressive Results", value=True)
+            st.caption(
+                "Draws the risk band and distribution from the first few hundred paths while the rest are simulated. "
+                "Simulations from every session share one queue; changing an input cancels a run still in progress."
+            )
+            profile_phases = st.checkbox("Profile Engine Phases", value=False)
+            st.caption(
+                "Profiling also times tax, contributions, expenses, returns and record building inside the engines "
+                "and measures allocation peaks, which slows the run down."
+            )
+
+        with st.expander("🖼️ Charts", expanded=False):
+            chart_sections = st.multiselect("Chart Sections", CHART_SECTIONS, default=CHART_SECTIONS)
+            st.checkbox("Native Streamlit Charts", value=False, key="native_charts")
+            st.caption(
+                "Only the selected sections are drawn. Native charts plot the same pre-aggregated data interactively "
+                "without matplotlib; the gauge and return boxes stay as images."
+            )
+
+        with st.expander("🎯 Goal Seek", expanded=False):
+            goal_seek = st.checkbox("Solve for Targets", value=False)
+            target_sufficiency = st.number_input("Target Sufficiency %", min_value=1, max_value=100, value=80, step=5)
+            target_shortfall = st.number_input("Max Shortfall Probability %", min_value=0.0, max_value=100.0, value=10.0, step=1.0)
+            st.caption(
+                "Finds the lowest Max Contribution % and the highest retirement spending that reach the targets, "
+                "by bisection on a fixed set of simulated scenarios."
+            )
 
     apply_clicked = st.button("🚀 Apply and Run Simulation")
+    if not apply_clicked and "background_run" in st.session_state:
+        # Inputs changed while a run was still going; its results would no longer match them
+        st.session_state.pop("background_run")[1].cancel()
 
     if apply_clicked:
         normalized_allocation_blocks = normalize_allocation_blocks(allocation_blocks)
-
-        with st.spinner("Running retirement simulations..."):
-            n_simulation = 1000
-            df_list = []
-            for _ in range(n_simulation):
-                df_sim = simulate_pre_retirement(
-                    initial_salary=initial_salary,
-                    hike_rate_mean=hike_rate_mean,
-                    hike_rate_std=hike_rate_std,
-                    contribution_start=contribution_start,
-                    contribution_increase_years=contribution_increase_years,
-                    contribution_increase_amount=contribution_increase_amount,
-                    contribution_max=contribution_max,
-                    lump_sum_amount=lump_sum_amount,
-                    lump_sum_frequency=5,
-                    start_lump_sum_year=5,
-                    years=36,
-                    start_age=30,
-                    acc_levy=0.0167,
-                    inflation_rate=0.025,
-                    marginal_tax_rate=marginal_tax_rate,
-                    tax_brackets=[(0, 15600), (15601, 53500), (53501, 78100), (78101, 180000), (180001, float("inf"))],
-                    growth_rates={
-                        "Harboursafe": {"mean": 0.0375, "std": 0.05},
-                        "Horizon": {"mean": 0.065, "std": 0.105},
-                        "SkyHigh": {"mean": 0.1025, "std": 0.2075},
-                        "Foreign_Equities": {"mean": 0.15, "std": np.sqrt(0.15**2 + 0.02**2)},
-                        "Bitcoin": {"mean": 0.20, "std": 0.60}
-                    },
-                    allocation_blocks=normalized_allocation_blocks,
-                    has_partner=partner_status,
-                    partner_contribution_perc=partner_contribution_perc,
-                    has_children=has_children,
-                    invested_real_estate=invested_real_estate,
-                    double_promotion_year=double_promotion_year,
-                    unforeseen_withdrawal_years=withdrawal_entries,
-                )
-                df_list.append(df_sim)
-
-        df_pre = df_list[0]
-        long_df, corpus_percentiles = build_aggregate_summary(df_list)
-
-        total_contributions = long_df.groupby("Simulation")["Total Contribution"].sum().mean()
-        age_65_spending = long_df.loc[long_df["Age"] == 65].groupby("Simulation")["Total Spent"].last()
-        median_age_65_spending = age_65_spending.median()
-        final_corpuses = [df["Adjusted Fund Value"].iloc[-1] for df in df_list]
-        mean_corpus = np.mean(final_corpuses)
-        median_corpus = np.median(final_corpuses)
-        p5 = np.percentile(final_corpuses, 5)
-        p95 = np.percentile(final_corpuses, 95)
-
-        retirement_corpus_mean = corpus_percentiles.loc[corpus_percentiles["Age"] == 65, "median"].squeeze()
-        corpus_at_retirement = retirement_corpus_mean if pd.notna(retirement_corpus_mean) else mean_corpus
-        total_profit = corpus_at_retirement - total_contributions if pd.notna(corpus_at_retirement) else np.nan
         use_linked_retirement_spending = retirement_spending_source == "Use age-65 spending from simulation"
-        retirement_lifestyle_start = None
-        spending_basis = "Manual lifestyle input"
-        if use_linked_retirement_spending and pd.notna(median_age_65_spending):
-            retirement_lifestyle_start = median_age_65_spending * retirement_spending_ratio
-            spending_basis = f"{retirement_spending_ratio:.0%} of median modeled age-65 spending"
-
-        df_post = simulate_post_retirement(
-            corpus=corpus_at_retirement,
-            start_age=66,
-            years=expected_life_expectancy - 65,
+        spending_ratio = retirement_spending_ratio if use_linked_retirement_spending else None
+        historical = get_historical_returns(return_model, block_length)
+        post_params = post_retirement_params(
+            expected_life_expectancy,
+            historical,
             return_mean=return_mean,
             return_std=return_std,
-            inflation=0.025,
             lifestyle_base_today=lifestyle_base_today,
             lifestyle_improvement_pct=lifestyle_improvement_pct,
             nz_super_annuity=nz_super_annuity,
-            accumulation_years=35,
-            lifestyle_at_retirement=retirement_lifestyle_start,
-            spending_basis=spending_basis,
         )
-
-        total_fund_withdrawal = df_post["Withdrawal from Fund"].sum()
-        shortfall_probability = np.mean(np.array(final_corpuses) < total_fund_withdrawal) * 100
-        sufficiency_score = int(min(100, 100 * corpus_at_retirement / total_fund_withdrawal)) if total_fund_withdrawal > 0 else 100
-        funding_status = "Sufficient" if sufficiency_score >= 80 and df_post["Remaining Corpus"].min() >= 0 else "At Risk"
+        pre_params = pre_retirement_params(
+            normalized_allocation_blocks,
+            glide_path=glide_path,
+            unforeseen_withdrawal_years=withdrawal_entries,
+            historical=historical,
+            initial_salary=initial_salary,
+            hike_rate_mean=hike_rate_mean,
+            hike_rate_std=hike_rate_std,
+            contribution_start=contribution_start,
+            contribution_increase_years=contribution_increase_years,
+            contribution_increase_amount=contribution_increase_amount,
+            contribution_max=contribution_max,
+            lump_sum_amount=lump_sum_amount,
+            marginal_tax_rate=marginal_tax_rate,
+            has_partner=partner_status,
+            partner_contribution_perc=partner_contribution_perc,
+            has_children=has_children,
+            invested_real_estate=invested_real_estate,
+            double_promotion_year=double_promotion_year,
+        )
+        if historical is not None and variance_reduction != "none":
+            st.error("Historical returns are resampled years with no known expectation to reduce variance against; "
+                     "set Variance Reduction to None.")
+            st.stop()
+        scenario_bank = None
+        if scenario_bank_path:
+            try:
+                scenario_bank = get_scenario_bank(scenario_bank_path)
+                if n_simulation > scenario_bank.paths:
+                    raise ValueError(f"it holds {scenario_bank.paths:,} paths, fewer than the {n_simulation:,} simulations requested")
+                scenario_bank.check_variance_reduction(variance_reduction)
+                if historical is not None:
+                    raise ValueError("historical returns already replace the drawn markets; choose Normal Draws to use a bank")
+            except (OSError, ValueError) as error:
+                st.error(f"Cannot use the scenario bank at {scenario_bank_path}: {error}")
+                st.stop()
+        inputs = {
+            "pre_params": pre_params,
+            "n_simulation": n_simulation,
+            "random_seed": random_seed,
+            "variance_reduction": variance_reduction,
+            # Adaptive stopping looks at shortfall, so only then does the ensemble depend on post-retirement inputs
+            "adaptive": {
+                "time_limit": adaptive_time_limit, "post_params": post_params, "spending_ratio": spending_ratio,
+            } if adaptive_paths else None,
+            "scenario_bank": scenario_bank,
+            "post_params": post_params,
+            "spending_ratio": spending_ratio,
+            "allocation_blocks": normalized_allocation_blocks,
+        }
+
+        outputs, recomputed, timings = run_in_background(inputs, workers, profile_phases, n_simulation, progressive_results)
+        render_start = time.perf_counter()
+
+        adaptive_summary = outputs["ensemble"]["adaptive_summary"]
+        if adaptive_summary is not None:
+            n_simulation = adaptive_summary["Paths Used"]
+        aggregates = outputs["aggregates"]
+        df_pre = aggregates["df_pre"]
+        corpus_percentiles = aggregates["corpus_percentiles"]
+        total_contributions = aggregates["total_contributions"]
+        median_age_65_spending = aggregates["median_age_65_spending"]
+        median_corpus = aggregates["median_corpus"]
+        p5 = aggregates["p5"]
+        p95 = aggregates["p95"]
+        corpus_at_retirement = aggregates["corpus_at_retirement"]
+        df_post = outputs["post"]["df_post"]
+        spending_basis = outputs["post"]["spending_basis"]
+        summaries = outputs["summaries"]
+        precision = summaries["precision"]
+        mean_corpus = summaries["mean_corpus"]
+        shortfall_probability = summaries["shortfall_probability"]
+        ruin_curve = summaries["ruin_curve"]
+        total_fund_withdrawal = summaries["total_fund_withdrawal"]
+        sufficiency_score = summaries["sufficiency_score"]
+        funding_status = summaries["funding_status"]
 
         required_fund = total_fund_withdrawal
         st.subheader("📊 Retirement Summary")
+        if adaptive_summary is not None:
+            st.caption(
+                f"Adaptive run used {adaptive_summary['Paths Used']:,} paths in {adaptive_summary['Elapsed Seconds']:.1f}s "
+                f"({adaptive_summary['Stop Reason']}): median ±{adaptive_summary['Median CI Half-Width %']:.1f}%, "
+                f"5th percentile ±{adaptive_summary['P5 CI Half-Width %']:.1f}%, "
+                f"shortfall ±{adaptive_summary['Shortfall CI Half-Width (pp)']:.1f} pp at 95% confidence."
+            )
         c1, c2, c3, c4, c5 = st.columns(5)
         c1.metric("Mean Corpus at 65", format_currency(mean_corpus))
         c2.metric("Median Corpus at 65", format_currency(median_corpus))
@@ -388,88 +485,91 @@ def main():
 - **Expected fund withdrawal need:** {format_currency(total_fund_withdrawal)}  
 - **5th percentile corpus:** {format_currency(p5)}  
 - **95th percentile corpus:** {format_currency(p95)}  
-- **Shortfall probability:** {shortfall_probability:.1f}%  
+- **Shortfall probability:** {shortfall_probability:.1f}% of simulated paths run out of savings by age {expected_life_expectancy}  
 - **Recommended action:** increase savings or lower spending if your sufficiency score is below 80% or if the retirement corpus runs out after age 65.
 """
             )
         else:
             st.markdown("- **The retirement funding analysis indicates the simulated fund outflow is zero or not meaningful. Review lifestyle assumptions.**")
 
-        gauge_fig = plot_funding_gauge(sufficiency_score, corpus_at_retirement, required_fund)
-        st.pyplot(gauge_fig)
-
-        st.markdown("---")
-        st.markdown(
-            "### What the charts are telling you"
-            "\n- The median path shows the most typical corpus build-up by age 65."
-            "\n- The shaded risk band shows downside and upside outcomes across 1,000 simulations."
-            "\n- Retirement Sufficiency measures whether the age-65 corpus can support the modeled retirement withdrawal profile after NZ Super, not just whether the balance equals one year of spending."
-            "\n- Post-retirement lifestyle spending now starts from the selected spending basis, so it no longer resets unexpectedly at age 66."
-            "\n- Wide return distributions imply higher volatility, while narrow boxes suggest more stable funds."
-        )
-
-        fig_corpus_band = plot_corpus_band(corpus_percentiles)
-        fig_dist, _, _, _ = plot_retirement_corpus_distribution(final_corpuses)
-        fig_alloc = plot_allocation_evolution(normalized_allocation_blocks)
-        fig_cashflow = plot_cashflow(df_pre)
-
-        top_left, top_right = st.columns(2)
-        with top_left:
-            st.subheader("📈 Retirement Corpus Risk Bands")
-            st.pyplot(fig_corpus_band)
-            st.markdown(
-                "This chart shows the expected range of fund values at each age. The dark line is the median scenario, while the shaded area captures the most likely downside and upside paths."
+        if goal_seek:
+            goals = get_result_cache().get_or_compute(
+                parameter_key({"goal_seek": inputs, "sufficiency": target_sufficiency, "shortfall": target_shortfall}),
+                lambda: goal_seek_table(inputs, target_sufficiency, target_shortfall),
             )
-        with top_right:
-            st.subheader("📊 Outcome Distribution")
-            st.pyplot(fig_dist)
-            st.markdown(
-                "The histogram shows the probability of different final corpus outcomes at retirement. A left-skewed tail means downside risk is possible, while the peak shows the most probable corpus range."
+            st.markdown("#### 🎯 What it takes to reach your targets")
+            st.dataframe(goals, hide_index=True)
+            st.caption(
+                f"Solved on a fixed set of {min(inputs['n_simulation'], DEFAULT_SOLVER_PATHS):,} scenarios with all other inputs unchanged."
             )
 
-        mid_left, mid_right = st.columns(2)
-        with mid_left:
-            st.subheader("📐 Portfolio Allocation Over Time")
-            st.pyplot(fig_alloc)
-            st.markdown(
-                "This plot shows how asset allocation weights evolve over the selected years. Use it to verify your risk posture and ensure the mix matches your retirement horizon."
-            )
-        with mid_right:
-            st.subheader("💰 Cashflow and Savings Insight")
-            st.pyplot(fig_cashflow)
-            st.markdown(
-                "Compare net salary, total contributions, portfolio value, and total expenses. The portfolio value line shows how invested capital grows compared to spending. "
-                "The expense line is an annual spending requirement, while portfolio value is the total accumulated balance. The post-retirement model can use a selected percentage of age-65 expenses to reflect a realistic retirement downshift."
-            )
+        # Charts are rendered here rather than in a pipeline stage, so hidden sections cost nothing.
+        # The plotting modules (matplotlib, seaborn) load on the first run that gets this far.
+        import charts
+        with recording(timings=timings):
+            if "Funding Gauge" in chart_sections:
+                show_chart("gauge", charts.plot_funding_gauge, sufficiency_score, corpus_at_retirement, total_fund_withdrawal)
 
-        bottom_left, bottom_right = st.columns(2)
-        with bottom_left:
-            st.subheader("📉 Post-Retirement Drawdown")
-            fig_drawdown, ax = plt.subplots(figsize=(10, 4))
-            ax.plot(df_post["Age"], df_post["Remaining Corpus"], color="#d1495b", linewidth=2.5)
-            ax.fill_between(df_post["Age"], df_post["Remaining Corpus"], 0, where=df_post["Remaining Corpus"] >= 0, color="#f7cac9", alpha=0.4)
-            ax.fill_between(df_post["Age"], df_post["Remaining Corpus"], 0, where=df_post["Remaining Corpus"] < 0, color="#c1121f", alpha=0.4)
-            ax.set_title("Post-Retirement Corpus Drawdown")
-            ax.set_xlabel("Age")
-            ax.set_ylabel("Remaining Corpus (NZD)")
-            ax.grid(True)
-            st.pyplot(fig_drawdown)
-            st.markdown(
-                "This chart shows how your retirement corpus moves after age 65. If the line crosses below zero, the assumed lifestyle spending exceeds available savings."
-            )
-        with bottom_right:
-            st.subheader("📈 Fund Return Volatility")
-            return_columns = [col for col in df_pre.columns if "Return" in col and "FIF" not in col and "Return Rate" not in col]
-            fig_returns, ax_returns = plt.subplots(figsize=(10, 4))
-            sns.boxplot(data=df_pre[return_columns], ax=ax_returns, palette="Set3")
-            ax_returns.set_title("Annual Fund Return Distribution")
-            ax_returns.set_ylabel("Return (NZD)")
-            ax_returns.set_xticklabels(ax_returns.get_xticklabels(), rotation=30, ha="right")
-            st.pyplot(fig_returns)
+            st.markdown("---")
             st.markdown(
-                "Asset boxes with greater height represent more volatile returns. Choose more stable funds if you need a smoother outcome, or more aggressive funds if you can tolerate higher risk."
+                "### What the charts are telling you"
+                "\n- The median path shows the most typical corpus build-up by age 65."
+                f"\n- The shaded risk band shows downside and upside outcomes across {n_simulation:,} simulations."
+                "\n- Retirement Sufficiency measures whether the age-65 corpus can support the modeled retirement withdrawal profile after NZ Super, not just whether the balance equals one year of spending."
+                "\n- Post-retirement lifestyle spending now starts from the selected spending basis, so it no longer resets unexpectedly at age 66."
+                "\n- Wide return distributions imply higher volatility, while narrow boxes suggest more stable funds."
             )
 
+            if "Risk Bands & Distribution" in chart_sections:
+                top_left, top_right = st.columns(2)
+                with top_left:
+                    st.subheader("📈 Retirement Corpus Risk Bands")
+                    show_chart("corpus_band", charts.plot_corpus_band, corpus_percentiles,
+                               native=(st.line_chart, corpus_percentiles.set_index("Age")[["p5", "median", "p95"]]))
+                    st.markdown(
+                        "This chart shows the expected range of fund values at each age. The dark line is the median scenario, while the shaded area captures the most likely downside and upside paths."
+                    )
+                with top_right:
+                    st.subheader("📊 Outcome Distribution")
+                    show_chart("distribution", charts.plot_retirement_corpus_distribution, aggregates["final_corpuses"],
+                               native=(st.bar_chart, distribution_frame(aggregates["final_corpuses"])))
+                    st.markdown(
+                        "The histogram shows the probability of different final corpus outcomes at retirement. A left-skewed tail means downside risk is possible, while the peak shows the most probable corpus range."
+                    )
+
+            if "Allocation & Cashflow" in chart_sections:
+                mid_left, mid_right = st.columns(2)
+                with mid_left:
+                    st.subheader("📐 Portfolio Allocation Over Time")
+                    show_chart("allocation", charts.plot_allocation_evolution, normalized_allocation_blocks,
+                               native=(st.line_chart, allocation_frame(normalized_allocation_blocks)))
+                    st.markdown(
+                        "This plot shows how asset allocation weights evolve over the selected years. Use it to verify your risk posture and ensure the mix matches your retirement horizon."
+                    )
+                with mid_right:
+                    st.subheader("💰 Cashflow and Savings Insight")
+                    show_chart("cashflow", charts.plot_cashflow, df_pre, native=(st.line_chart, cashflow_frame(df_pre)))
+                    st.markdown(
+                        "Compare net salary, total contributions, portfolio value, and total expenses. The portfolio value line shows how invested capital grows compared to spending. "
+                        "The expense line is an annual spending requirement, while portfolio value is the total accumulated balance. The post-retirement model can use a selected percentage of age-65 expenses to reflect a realistic retirement downshift."
+                    )
+
+            if "Drawdown & Return Volatility" in chart_sections:
+                bottom_left, bottom_right = st.columns(2)
+                with bottom_left:
+                    st.subheader("📉 Post-Retirement Drawdown")
+                    show_chart("drawdown", charts.plot_drawdown, df_post,
+                               native=(st.area_chart, df_post.set_index("Age")[["Remaining Corpus"]]))
+                    st.markdown(
+                        "This chart shows how your retirement corpus moves after age 65. If the line crosses below zero, the assumed lifestyle spending exceeds available savings."
+                    )
+                with bottom_right:
+                    st.subheader("📈 Fund Return Volatility")
+                    show_chart("returns", charts.plot_fund_returns, df_pre)
+                    st.markdown(
+                        "Asset boxes with greater height represent more volatile returns. Choose more stable funds if you need a smoother outcome, or more aggressive funds if you can tolerate higher risk."
+                    )
+
         st.markdown("---")
         st.subheader("Pre-Retirement Summary")
         pre_comments = []
@@ -524,6 +624,53 @@ def main():
         with st.expander("📊 Aggregate Simulation Summary", expanded=False):
             st.dataframe(corpus_percentiles)
 
+        with st.expander("📉 Post-Retirement Ruin Probability", expanded=False):
+            st.dataframe(ruin_curve)
+
+        with st.expander("🎯 Estimator Precision", expanded=False):
+            st.dataframe(precision)
+            st.caption("Standard errors follow the selected sampling scheme; lower is better for the same number of paths.")
+            if adaptive_summary is not None:
+                st.dataframe(pd.DataFrame([adaptive_summary]))
+
+        timings.add("render", time.perf_counter() - render_start)
+        log_timings(timings, n_simulation=int(n_simulation), workers=int(workers),
+                    variance_reduction=variance_reduction, recomputed=recomputed)
+        with st.sidebar.expander("⏱️ Performance", expanded=False):
+            st.caption(
+                f"Stages {timings.total('stage.'):.2f}s · charts {timings.total('figure.'):.2f}s · "
+                f"rendering {timings.total('render'):.2f}s"
+                + ("" if profile_phases else " · enable Profile Engine Phases for the engine breakdown")
+            )
+            st.dataframe(timings.frame())
+
+        with st.sidebar.expander("🗄️ Result Cache", expanded=False):
+            cache_stats = get_result_cache().stats()
+            st.caption(
+                f"Hit rate {cache_stats['hit_rate']:.0%} · {cache_stats['entries']} entries · "
+                f"{cache_stats['bytes'] / 1024 ** 2:.1f} of {cache_stats['max_bytes'] / 1024 ** 2:.0f} MB · "
+                f"{cache_stats['evictions']} evictions"
+            )
+            st.json(cache_stats)
+            st.caption(f"Stages recomputed this run: {', '.join(recomputed) or 'none'}")
+
+        with st.sidebar.expander("🧵 Simulation Queue", expanded=False):
+            queue_stats = get_scheduler().metrics()
+            st.caption(
+                f"{queue_stats['running']} running · {queue_stats['queued']} queued on {queue_stats['workers']} workers · "
+                f"utilization {queue_stats['utilization']:.0%} · wait p50 {queue_stats['queue_wait_p50']:.2f}s · "
+                f"run p50 {queue_stats['run_time_p50']:.2f}s"
+            )
+            st.json(queue_stats)
+
+        with st.sidebar.expander("🖼️ Chart Cache", expanded=False):
+            chart_stats = get_figure_renderer().cache.stats()
+            st.caption(
+                f"Hit rate {chart_stats['hit_rate']:.0%} · {chart_stats['entries']} images · "
+                f"{chart_stats['bytes'] / 1024 ** 2:.1f} MB"
+            )
+            st.json(chart_stats)
+
 
 if __name__ == "__main__":
     main()
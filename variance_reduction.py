@@ -0,0 +1,100 @@
+import warnings
+import numpy as np
+
+VARIANCE_REDUCTION_METHODS = ("none", "antithetic", "sobol", "control_variate")
+
+# Sobol draws are split into independently scrambled replicates so their error can be estimated
+SOBOL_REPLICATES = 8
+STANDARD_ERROR_BATCHES = 20
+
+
+def standard_normals(rng, n, dims, method="none"):
+    # Returns (dims, n) standard normal shocks, one column per path.
+    if method not in VARIANCE_REDUCTION_METHODS:
+        raise ValueError(f"Unknown variance reduction method: {method}")
+    if method == "antithetic":
+        # Path i and path i + half see mirrored shocks
+        half = (n + 1) // 2
+        z = rng.standard_normal((dims, half))
+        return np.concatenate([z, -z], axis=1)[:, :n]
+    if method == "sobol":
+        from scipy.stats import norm, qmc
+        block = -(-n // SOBOL_REPLICATES)
+        blocks = []
+        with warnings.catch_warnings():
+            # Balance is best at powers of two, but any block size is a valid randomized QMC sample
+            warnings.simplefilter("ignore", UserWarning)
+            for _ in range(SOBOL_REPLICATES):
+                u = qmc.Sobol(d=dims, scramble=True, seed=rng).random(block)
+                blocks.append(norm.ppf(np.clip(u, 1e-12, 1 - 1e-12)).T)
+        return np.concatenate(blocks, axis=1)[:, :n]
+    return rng.standard_normal((dims, n))
+
+
+def replicate_groups(n, method="none"):
+    # Paths sharing a group id are not independent of each other (antithetic pairs, Sobol replicates).
+    if method == "antithetic":
+        return np.arange(n) % ((n + 1) // 2)
+    if method == "sobol":
+        return np.arange(n) // -(-n // SOBOL_REPLICATES)
+    return np.arange(n)
+
+
+def batch_standard_error(values, statistic, groups, n_batches=STANDARD_ERROR_BATCHES):
+    # Batch-means error for any statistic; whole groups go into the same batch.
+    _, group_index = np.unique(groups, return_inverse=True)
+    n_batches = min(n_batches, group_index.max() + 1)
+    if n_batches < 2:
+        return np.nan
+    batch = group_index % n_batches
+    estimates = [statistic(values[batch == b]) for b in range(n_batches)]
+    return np.std(estimates, ddof=1) / np.sqrt(n_batches)
+
+
+def control_variate_mean(values, control, control_mean):
+    # Regression-adjusted mean of `values` using a control with known expectation.
+    values = np.asarray(values, dtype=float)
+    deviation = np.asarray(control, dtype=float) - control_mean
+    variance = np.var(deviation, ddof=1)
+    beta = np.cov(values, deviation)[0, 1] / variance if variance > 0 else 0.0
+    adjusted = values - beta * deviation
+    return adjusted.mean(), adjusted.std(ddof=1) / np.sqrt(len(adjusted))
+
+
+def control_variate_probability(flags, control, control_mean):
+    # control_variate_mean of 0/1 outcomes, clipped to [0, 1]: the regression adjustment can push the
+    # estimate of a rare or near-certain event past either end
+    estimate, standard_error = control_variate_mean(flags, control, control_mean)
+    return float(np.clip(estimate, 0.0, 1.0)), standard_error
+
+
+def estimate_precision(final_corpuses, method, groups, shortfall=None, control=None, control_mean=None):
+    # Estimates and standard errors for the headline metrics under the chosen sampling scheme.
+    final_corpuses = np.asarray(final_corpuses, dtype=float)
+    rows = []
+
+    def add(metric, values, statistic):
+        rows.append({
+            "Metric": metric,
+            "Estimate": statistic(values),
+            "Standard Error": batch_standard_error(values, statistic, groups),
+        })
+
+    add("Mean Corpus at 65", final_corpuses, np.mean)
+    add("Median Corpus at 65", final_corpuses, np.median)
+    add("5th Percentile Corpus", final_corpuses, lambda v: np.percentile(v, 5))
+    if shortfall is not None:
+        add("Shortfall Probability", np.asarray(shortfall, dtype=float), np.mean)
+
+    if method == "antithetic":
+        # Pair averages are independent, which gives a sharper error for the means
+        _, pair = np.unique(groups, return_inverse=True)
+        pairs = np.bincount(pair, weights=final_corpuses) / np.bincount(pair)
+        rows[0]["Standard Error"] = pairs.std(ddof=1) / np.sqrt(len(pairs))
+    if method == "control_variate" and control is not None:
+        rows[0]["Estimate"], rows[0]["Standard Error"] = control_variate_mean(final_corpuses, control, control_mean)
+        if shortfall is not None:
+            rows[-1]["Estimate"], rows[-1]["Standard Error"] = control_variate_probability(shortfall, control, control_mean)
+    for row in rows:
+        row["Method"] = method
+    return rows